@@ -0,0 +1,96 @@
+"""
+Deep folder tree test for the storage backends.
+
+Builds a chain of nested folders deeper than Python's recursion limit,
+then moves folders around it: moves that would put a folder inside
+itself must be refused, and every other move must keep the folder
+outline and aggregates in step with the tree, across a reopen. Runs in
+a temporary directory, never on real data.
+
+    python deep_tree_test.py [--backend json|journal|sqlite] [--depth 1500]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def open_backend(backend):
+    # Imported here: DATA_PATH is resolved on import, relative to the working directory
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'plugin.video.mis.favoritos')]
+    import mock_kodi  # noqa: F401
+    if backend == 'sqlite':
+        from resources.lib.sqlite_storage import SQLiteStorage
+        return SQLiteStorage()
+    from resources.lib.storage import JSONStorage
+    return JSONStorage(journal=backend == 'journal')
+
+
+def check(ok, message):
+    print(f"[{'PASS' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def outline_of(storage):
+    return [(folder_id, name, depth, tuple(path)) for folder_id, name, depth, path in storage.get_folder_outline()]
+
+
+def run(backend, depth):
+    os.chdir(tempfile.mkdtemp(prefix=f'misfav-deep-{backend}-'))
+    storage = open_backend(backend)
+    chain = ['root']
+    with storage.transaction():
+        for level in range(depth):
+            storage.add_folder(chain[-1], f'Nivel {level}')
+            chain.append(storage.get_folder_contents(chain[-1])[0]['id'])
+        storage.add_item(chain[-1], 'Fondo', 'plugin://deep/?leaf=1', '')
+    top, middle, bottom = chain[1], chain[depth // 2], chain[-1]
+
+    ok = check(len(storage.get_path(bottom)) == depth - 1, f"{backend}: chain of {depth} folders built")
+    start = time.perf_counter()
+    refused = [storage.move_folder(top, target) for target in (top, middle, bottom)]
+    refused.append(storage.move_item(top, bottom))
+    elapsed = time.perf_counter() - start
+    ok &= check(not any(refused) and storage.get_parent(top)['id'] == 'root',
+                f"{backend}: moves into itself or its own subfolders refused ({elapsed / 4 * 1000:.2f} ms each)")
+    ok &= check(not storage.move_folder('root', middle) and not storage.move_folder(chain[-1] + '-x', 'root'),
+                f"{backend}: moving Root or a missing folder refused")
+
+    # Cut the chain in half, then hang the lower half back under the top
+    ok &= check(storage.move_folder(middle, 'root') and storage.get_parent(middle)['id'] == 'root',
+                f"{backend}: lower half moved to Root")
+    ok &= check(storage.move_folder(middle, top) and len(storage.get_path(bottom)) == depth - depth // 2 + 1,
+                f"{backend}: lower half moved under the top folder")
+    storage.add_folder(top, 'Hermana')
+    sister = next(node['id'] for node in storage.get_folder_contents(top) if node['name'] == 'Hermana')
+    ok &= check(storage.move_folder(sister, bottom) and not storage.move_folder(middle, sister),
+                f"{backend}: sibling moved to the bottom, and the cycle through it refused")
+
+    # Root > top > middle > ... > bottom > sister, below the upper half of the chain
+    outline = outline_of(storage)
+    ok &= check(len(outline) == depth + 2 and outline[-1][0] == sister and outline[-1][2] == depth - depth // 2 + 3,
+                f"{backend}: outline lists {len(outline)} folders in tree order")
+    ok &= check(not storage.check_folder_stats(), f"{backend}: folder aggregates match a recount")
+    stats = storage.get_folder_stats(['root', top])
+    ok &= check(stats['root']['total_folders'] == depth + 1 and stats[top]['total_items'] == 1,
+                f"{backend}: totals count the whole chain")
+
+    # A copy of the deep chain is one record carrying the whole subtree
+    ok &= check(storage.copy_nodes([middle], 'root') == 1, f"{backend}: deep subtree copied")
+    # Reopened from what each write left on disk (the journal, for the journal backend)
+    reopened = open_backend(backend)
+    ok &= check(outline_of(reopened) == outline_of(storage) and not reopened.check_folder_stats(),
+                f"{backend}: reopened library matches")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backend', choices=['json', 'journal', 'sqlite'], action='append')
+    parser.add_argument('--depth', type=int, default=1500)
+    options = parser.parse_args()
+    ok = all([run(backend, options.depth) for backend in options.backend or ['json', 'journal', 'sqlite']])
+    sys.exit(0 if ok else 1)
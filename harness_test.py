@@ -0,0 +1,218 @@
+"""
+End-to-end test of the addon through the headless Kodi harness.
+
+Drives every plugin route the way a user would in Kodi, with each
+keyboard and dialog answered from a script (strict: a dialog nobody
+expected fails the run), and checks what was rendered, notified and
+stored. Finishes with a throughput run of plugin calls in silent mode.
+Each backend runs in its own interpreter and temporary directory.
+
+    python harness_test.py [--backend json|journal|sqlite] [--calls 2000]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SETTINGS = {
+    'json': {'backend': '0', 'service': 'false'},
+    'journal': {'backend': '0', 'service': 'false', 'journal': 'true'},
+    'sqlite': {'backend': '1', 'service': 'false'},
+}
+
+
+def check(ok, message):
+    print(f"[{'PASS' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def labels(listing):
+    return [li.getLabel() for _, li, _ in listing['items']]
+
+
+def node_id(listing, name):
+    """Id of the entry labelled name, from its URL or its context menu."""
+    for url, li, _ in listing['items']:
+        if name not in li.getLabel():
+            continue
+        for target in [url] + [command for _, command in li.context_menu]:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(target.strip('RunPlugin()')).query)
+            for key in ('item_id', 'folder_id'):
+                if key in query:
+                    return query[key][0]
+    raise LookupError(name)
+
+
+def pick(name):
+    """A select answer: the option containing name."""
+    return lambda heading, options: next(i for i, option in enumerate(options) if name in option)
+
+
+def run(backend, calls):
+    sys.path[:0] = [ROOT]
+    from mock_kodi import KodiHarness, NoAnswer
+    kodi = KodiHarness(settings=SETTINGS[backend], strict=True).install()
+    ok = True
+
+    kodi.answer('keyboard', 'Películas', 'Series')
+    kodi.run('add_folder', folder_id='root')
+    kodi.run('add_folder', folder_id='root')
+    root = kodi.run('folder', folder_id='root')
+    ok &= check(root['succeeded'] and all(any(name in label for label in labels(root)) for name in ('Películas', 'Series')),
+                f"{backend}: folders added and listed")
+    films, series = node_id(root, 'Películas'), node_id(root, 'Series')
+    ok &= check(all(labels(kodi.run('folder', folder_id='root', page=page)) == labels(root) for page in ('x', '-3', '1.5')),
+                f"{backend}: malformed or negative page lists the first page")
+    kodi.settings['page_size'] = '1'
+    last, past = (labels(kodi.run('folder', folder_id='root', page=page)) for page in ('1', '7'))
+    kodi.settings['page_size'] = ''
+    ok &= check(past == last and any('(1/2)' in label for label in past)
+                and labels(kodi.run('folder', folder_id='root', page='7')) == labels(root),
+                f"{backend}: a page past the end lists the last page")
+
+    for name, url in (('Uno', 'plugin://a/?1'), ('Dos', 'plugin://a/?2'), ('Tres', 'plugin://a/?3')):
+        kodi.answer('keyboard', name, url)
+        kodi.run('add_item', folder_id=films)
+    listing = kodi.run('folder', folder_id=films)
+    ok &= check(sum(name in ' '.join(labels(listing)) for name in ('Uno', 'Dos', 'Tres')) == 3
+                and kodi.builtins.count('Container.Refresh') == 5,
+                f"{backend}: items added, each add refreshed the container")
+
+    kodi.answer('keyboard', 'Dos', 'plugin://a/?2')
+    kodi.run('add_item', folder_id=series)
+    ok &= check(kodi.notifications[-1][0] == 'Ya existe', f"{backend}: duplicate URL reported")
+
+    kodi.answer('keyboard', 'Cuatro')
+    kodi.run('rename_item', item_id=node_id(listing, 'Tres'))
+    kodi.answer('keyboard', 'Cinco', 'plugin://a/?5', '')
+    kodi.run('edit_item', item_id=node_id(listing, 'Uno'))
+    kodi.answer('select', pick('Series'))
+    kodi.run('move_item', item_id=node_id(listing, 'Dos'))
+    listing = kodi.run('folder', folder_id=films)
+    ok &= check(any('Cuatro' in label for label in labels(listing)) and any('Cinco' in label for label in labels(listing))
+                and not any('Dos' in label for label in labels(listing)),
+                f"{backend}: item renamed, edited and moved out")
+
+    kodi.answer('select', pick('Películas'))
+    kodi.run('move_folder', item_id=series)
+    kodi.answer('select', -1)
+    kodi.run('move_folder', item_id=films)
+    ok &= check(kodi.notifications[-1][1] == 'Carpeta movida' and not any('Series' in option for option in kodi.dialogs[-1][2]),
+                f"{backend}: folder moved, and not offered a move into its own subfolder")
+    for stale in ('no-such-folder', node_id(kodi.run('folder', folder_id=films), 'Cuatro')):
+        kodi.run('move_folder', item_id=stale)
+        ok &= check(kodi.notifications[-1][:2] == ('Error', 'No se pudo mover'),
+                    f"{backend}: moving a missing folder or an item as a folder reported")
+
+    found = kodi.run('search', query='cuatro')
+    ok &= check(len(found['items']) == 1 and 'Cuatro' in labels(found)[0], f"{backend}: search finds the renamed item")
+
+    kodi.answer('select', pick('Películas'))
+    kodi.run_context_menu('Seis', 'plugin://a/?6')
+    ok &= check(kodi.notifications[-1][0] == 'Guardado'
+                and any('Seis' in label for label in labels(kodi.run('folder', folder_id=films))),
+                f"{backend}: context menu added to a chosen folder")
+
+    favourites = kodi.translate_path('special://profile/favourites.xml')
+    os.makedirs(os.path.dirname(favourites), exist_ok=True)
+    with open(favourites, 'w', encoding='utf-8') as f:
+        f.write('<favourites>\n    <favourite name="Siete" thumb="">PlayMedia(&quot;plugin://b/?7&quot;)</favourite>\n'
+                '    <favourite name="Ocho" thumb="">PlayMedia(&quot;plugin://b/?8&quot;)</favourite>\n</favourites>\n')
+    kodi.answer('multiselect', [0, 1])
+    kodi.run('import_kodi', folder_id='root')
+    ok &= check(kodi.notifications[-1][0] == 'Importación completa'
+                and sum(name in ' '.join(labels(kodi.run('folder', folder_id='root'))) for name in ('Siete', 'Ocho')) == 2,
+                f"{backend}: favourites.xml under the harness profile imported")
+
+    # Películas > (Cuatro, Cinco, Seis, Series > Dos): copy everything below it to Root
+    kodi.answer('yesno', True)
+    kodi.answer('multiselect', lambda heading, options: list(range(len(options))))
+    kodi.answer('select', pick('Root'))
+    kodi.run('multi_copy', folder_id=films)
+    ok &= check(kodi.notifications[-1][0] == 'Éxito', f"{backend}: subfolder contents copied")
+
+    # The copies repeat the originals' URLs: dedupe keeps the older ones
+    kodi.answer('yesno', True)
+    kodi.run('dedupe')
+    ok &= check(kodi.notifications[-1][1] == '4 duplicados eliminados', f"{backend}: copies deduplicated")
+
+    # Everything below Películas, Nueve in its subfolder included, numbered in one change
+    inner = node_id(kodi.run('folder', folder_id=films), 'Series')
+    kodi.answer('keyboard', 'Nueve', 'plugin://a/?9')
+    kodi.run('add_item', folder_id=inner)
+    contents = lambda: [label for folder in (films, inner) for label in labels(kodi.run('folder', folder_id=folder))  # noqa: E731
+                        if '[COLOR' not in label or '🗂️' in label]
+    count = len(contents())
+    kodi.answer('yesno', True)
+    kodi.answer('multiselect', lambda heading, options: list(range(len(options))))
+    kodi.answer('keyboard', '{n} - {name}')
+    kodi.run('multi_rename', folder_id=films)
+    numbers = sorted(int(re.search(r'(\d+) - ', label).group(1)) for label in contents() if re.search(r'\d+ - ', label))
+    ok &= check(kodi.notifications[-1][1] == f'{count} elementos renombrados' and numbers == list(range(1, count + 1))
+                and any('- Nueve' in label for label in contents()),
+                f"{backend}: a folder, its contents and the items around it renamed from one pattern")
+    kodi.answer('yesno', False)
+    kodi.answer('multiselect', [0])
+    kodi.answer('keyboard', '{nombre}')
+    kodi.run('multi_rename', folder_id=films)
+    ok &= check(kodi.notifications[-1][:2] == ('Error', 'Patrón no válido'), f"{backend}: bad rename pattern refused")
+
+    kodi.answer('yesno', False, True)
+    kodi.answer('multiselect', lambda heading, options: list(range(len(options))))
+    kodi.run('multi_delete', folder_id=films)
+    left = labels(kodi.run('folder', folder_id=films))
+    ok &= check(kodi.notifications[-1][0] == 'Eliminados' and all('[COLOR' in label for label in left),
+                f"{backend}: folder emptied")
+    kodi.answer('yesno', True)
+    kodi.run('delete_folder', item_id=films)
+    ok &= check(not any('Películas' in label for label in labels(kodi.run('folder', folder_id='root')))
+                and not any(kodi.answers.values()), f"{backend}: folder deleted, every scripted answer used")
+
+    view = labels(kodi.run('diagnostics'))
+    kodi.answer('yesno', True)
+    kodi.run('rebuild_storage')
+    ok &= check(any('favoritos' in label for label in view) and any('Reconstruir' in label for label in view)
+                and kodi.notifications[-1][0] == 'Reconstruir' and kodi.builtins[-1] == 'Container.Refresh',
+                f"{backend}: diagnostics listed, storage rebuilt")
+
+    try:
+        kodi.run('add_folder', folder_id='root')
+        ok &= check(False, f"{backend}: unscripted dialog raises NoAnswer when strict")
+    except NoAnswer:
+        ok &= check(True, f"{backend}: unscripted dialog raises NoAnswer when strict")
+    kodi.strict = False
+    ok &= check(not kodi.run('search')['succeeded'], f"{backend}: a dismissed keyboard ends the directory unsucceeded")
+
+    from resources.lib import profiling
+    kodi.settings['profiling'] = str(profiling.CPROFILE)
+    kodi.run('folder', folder_id='root')
+    del kodi.settings['profiling']
+    ok &= check(os.path.getsize(profiling.profile_path('folder')) > 0, f"{backend}: cProfile dump written when profiling")
+
+    kodi.clear()
+    start = time.perf_counter()
+    for _ in range(calls):
+        kodi.run('folder', folder_id='root')
+    elapsed = time.perf_counter() - start
+    ok &= check(len(kodi.directories) == calls,
+                f"{backend}: {calls} root listings, {calls / elapsed:.0f} calls/s")
+    kodi.uninstall()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backend', choices=list(SETTINGS), action='append')
+    parser.add_argument('--calls', type=int, default=2000)
+    options = parser.parse_args()
+    backends = options.backend or list(SETTINGS)
+    if len(backends) == 1:
+        sys.exit(0 if run(backends[0], options.calls) else 1)
+    # One interpreter per backend: storage resolves its data directory on import
+    codes = [subprocess.call([sys.executable, __file__, '--backend', backend, '--calls', str(options.calls)])
+             for backend in backends]
+    sys.exit(max(codes))
@@ -0,0 +1,170 @@
+"""
+Id index test for JSONStorage.
+
+Runs seeded random sequences of adds, moves, copies, renames, edits and
+deletes (single and bulk, some inside a transaction) and, after every
+step, checks the id and parent indexes against a fresh walk of the tree:
+same ids, the very same node objects, the right parent for each. Then
+does the same on a chain of folders deeper than the recursion limit, and
+on the library reloaded from disk. Runs in a temporary directory, never
+on real data.
+
+    python index_test.py [--backend json|journal] [--steps 400] [--seed 1] [--depth 1500]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def open_backend(backend):
+    # Imported here: DATA_PATH is resolved on import, relative to the working directory
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'plugin.video.mis.favoritos')]
+    import mock_kodi  # noqa: F401
+    from resources.lib.storage import JSONStorage
+    return JSONStorage(journal=backend == 'journal')
+
+
+def check(ok, message):
+    print(f"[{'PASS' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def walk(tree):
+    """(nodes, parents) as a fresh walk of the tree finds them."""
+    nodes, parents = {}, {}
+    stack = [(tree, None)]
+    while stack:
+        node, parent = stack.pop()
+        nodes[node['id']] = node
+        if parent is not None:
+            parents[node['id']] = parent
+        stack.extend((child, node) for child in node.get('children', ()))
+    return nodes, parents
+
+
+def drift(storage):
+    """What the indexes get wrong about storage.data, or '' if nothing."""
+    nodes, parents = walk(storage.data)
+    if storage._nodes.keys() != nodes.keys():
+        return f"ids {sorted(storage._nodes.keys() ^ nodes.keys())[:3]} indexed or walked, not both"
+    if storage._parents.keys() != parents.keys():
+        return f"parents {sorted(storage._parents.keys() ^ parents.keys())[:3]} indexed or walked, not both"
+    for node_id, node in nodes.items():
+        if storage._nodes[node_id] is not node:
+            return f"{node_id} indexed as a stale copy"
+        if node_id in parents and storage._parents[node_id] is not parents[node_id]:
+            return f"{node_id} indexed under {storage._parents[node_id]['id']}, is under {parents[node_id]['id']}"
+    return ''
+
+
+def shape(storage):
+    """Every node's id, name and parent id: what must survive a reload."""
+    nodes, parents = walk(storage.data)
+    return {node_id: (node['name'], parents[node_id]['id'] if node_id in parents else None)
+            for node_id, node in nodes.items()}
+
+
+def random_step(storage, rng, k):
+    """One random change; returns what it was, for the failure message."""
+    folders = [node['id'] for node in storage._nodes.values() if node['type'] == 'folder']
+    items = [node['id'] for node in storage._nodes.values() if node['type'] == 'item']
+    nodes = [node_id for node_id in storage._nodes if node_id != 'root']
+    some = lambda ids: rng.sample(ids, min(len(ids), rng.randint(1, 4)))  # noqa: E731
+    op = rng.choice(['add_folder', 'add_item', 'add_item', 'move', 'move_folder', 'move_nodes', 'copy_nodes',
+                     'rename', 'update', 'delete', 'delete_nodes', 'transaction'] if nodes else ['add_folder'])
+    if op == 'add_folder':
+        storage.add_folder(rng.choice(folders), f'Carpeta {k}')
+    elif op == 'add_item' or (op in ('move', 'update') and not items):
+        storage.add_item(rng.choice(folders), f'Favorito {k}', f'plugin://index/?k={k}', '')
+    elif op == 'move':
+        storage.move_item(rng.choice(items), rng.choice(folders))
+    elif op == 'move_folder':
+        # Into itself or below itself is refused; that must leave the indexes alone too
+        storage.move_folder(rng.choice(folders), rng.choice(folders))
+    elif op == 'move_nodes':
+        storage.move_nodes(some(nodes), rng.choice(folders))
+    elif op == 'copy_nodes':
+        storage.copy_nodes(some(nodes), rng.choice(folders))
+    elif op == 'rename':
+        node_id = rng.choice(nodes)
+        rename = storage.rename_folder if storage._nodes[node_id]['type'] == 'folder' else storage.rename_item
+        rename(node_id, f'Renombrado {k}')
+    elif op == 'update':
+        storage.update_item(rng.choice(items), url=f'plugin://index/?edited={k}')
+    elif op == 'delete':
+        node_id = rng.choice(nodes)
+        delete = storage.delete_folder if storage._nodes[node_id]['type'] == 'folder' else storage.delete_item
+        delete(node_id)
+    elif op == 'delete_nodes':
+        storage.delete_nodes(some(nodes))
+    else:
+        with storage.transaction():
+            parent = rng.choice(folders)
+            storage.add_folder(parent, f'Lote {k}')
+            storage.add_item(parent, f'Lote {k}', f'plugin://index/?batch={k}', '')
+            storage.move_nodes(some(nodes), rng.choice(folders))
+    return op
+
+
+def run(backend, steps, seed, depth):
+    os.chdir(tempfile.mkdtemp(prefix=f'misfav-index-{backend}-'))
+    storage = open_backend(backend)
+    rng = random.Random(seed)
+    ok = True
+
+    problem, done = '', []
+    for k in range(steps):
+        done.append(random_step(storage, rng, k))
+        problem = drift(storage)
+        if problem:
+            break
+    ok &= check(not problem, f"{backend}: indexes match the tree after each of {len(done)} random steps"
+                + (f" (step {len(done)}, {done[-1]}: {problem})" if problem else ''))
+    ok &= check(len(set(done)) >= 10 and len(storage._nodes) > 20,
+                f"{backend}: {len(set(done))} kinds of change, {len(storage._nodes)} nodes at the end")
+
+    chain = ['root']
+    with storage.transaction():
+        for level in range(depth):
+            storage.add_folder(chain[-1], f'Nivel {level}')
+            chain.append(next(node['id'] for node in storage.get_folder_contents(chain[-1])
+                              if node['name'] == f'Nivel {level}'))
+        storage.add_item(chain[-1], 'Fondo', 'plugin://index/?deep=1', '')
+    ok &= check(not drift(storage) and len(storage.get_path(chain[-1])) == depth - 1,
+                f"{backend}: indexes match a chain of {depth} folders")
+    storage.copy_nodes([chain[1]], 'root')
+    storage.move_folder(chain[depth // 2], 'root')
+    storage.move_nodes([chain[depth // 2 + 1]], chain[1])
+    problem = drift(storage)
+    ok &= check(not problem, f"{backend}: and after copying, moving and re-hanging deep subtrees {problem}".rstrip())
+    # chain[1] now holds the lower half too; the part cut off at depth // 2 stays
+    storage.delete_folder(chain[1])
+    problem = drift(storage)
+    ok &= check(not problem and chain[-1] not in storage._nodes and chain[depth // 2] in storage._nodes,
+                f"{backend}: and after deleting the top of the chain {problem}".rstrip())
+
+    # Reopened from what the writes left on disk (the journal, for the journal backend)
+    reopened = open_backend(backend)
+    problem = drift(reopened)
+    ok &= check(not problem and shape(reopened) == shape(storage),
+                f"{backend}: reloaded from disk, indexes match the same tree {problem}".rstrip())
+    for k in range(steps // 4):
+        random_step(reopened, rng, steps + k)
+    problem = drift(reopened)
+    ok &= check(not problem, f"{backend}: and keep matching through {steps // 4} more random steps {problem}".rstrip())
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backend', choices=['json', 'journal'], action='append')
+    parser.add_argument('--steps', type=int, default=400)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=1500)
+    options = parser.parse_args()
+    ok = all([run(backend, options.steps, options.seed, options.depth) for backend in options.backend or ['json', 'journal']])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,136 @@
+"""
+Migration test: favorites.json (and its journal) to SQLite.
+
+Builds a library with the JSON backend in journal mode, so part of it is
+in the snapshot and part only in journal records not folded yet (adds,
+copies, renames, edits, reorders, bulk moves and deletes, and a folder
+chain deeper than the recursion limit). Then opens it with the SQLite
+backend and checks that every folder lists the same nodes in the same
+order, with the same parents, aggregates and search results, and that
+the migration left no JSON side files behind. Runs in a temporary
+directory, never on real data.
+
+    python migration_test.py [--depth 1200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SIDE_FILES = ('favorites.cache', 'folders.outline', 'search.index', 'search.log')
+
+
+def check(ok, message):
+    print(f"[{'PASS' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def listing(storage):
+    """Every folder's contents, in display order, by id."""
+    folders = {}
+    stack = ['root']
+    while stack:
+        folder_id = stack.pop()
+        children = storage.get_folder_contents(folder_id)
+        folders[folder_id] = [(node['id'], node['type'], node['name'], node.get('url', '')) for node in children]
+        stack.extend(node['id'] for node in children if node['type'] == 'folder')
+    return folders
+
+
+def build(storage, depth):
+    """
+    A library whose snapshot holds the first adds and the deep chain, and
+    whose journal every other kind of change; returns a few ids to check.
+    """
+    def child(folder_id, name):
+        return next(node['id'] for node in storage.get_folder_contents(folder_id) if node['name'] == name)
+
+    for name in ('Películas', 'Series', 'Música'):
+        storage.add_folder('root', name)
+    films, series, music = (child('root', name) for name in ('Películas', 'Series', 'Música'))
+    with storage.transaction():
+        for n in range(40):
+            storage.add_item(films if n % 2 else series, f'Título {n}', f'plugin://migrate/?n={n}', f'thumb{n}.jpg')
+    chain = ['root']
+    with storage.transaction():
+        for level in range(depth):
+            storage.add_folder(chain[-1], f'Nivel {level}')
+            chain.append(child(chain[-1], f'Nivel {level}'))
+        storage.add_item(chain[-1], 'Fondo', 'plugin://migrate/?deep=1', '')
+    storage.compact()
+    storage._wait_compaction()
+
+    # From here on only in the journal
+    storage.copy_nodes([films], music)
+    storage.rename_folder(series, 'Series de TV')
+    storage.rename_item(child(films, 'Título 1'), 'Ávila al amanecer')
+    storage.update_item(child(films, 'Título 3'), url='plugin://migrate/?edited=3', thumbnail='')
+    storage.set_folder_order(music, 'manual')
+    storage.move_nodes([child(series, 'Título 0'), child(series, 'Título 2'), films], music)
+    storage.delete_nodes([child(series, 'Título 4'), child(series, 'Título 6')])
+    storage.delete_item(child(series, 'Título 8'))
+    storage.move_item(child(series, 'Título 10'), 'root')
+    storage.add_item(chain[-1], 'Último', 'plugin://migrate/?last=1', '')
+    storage.move_folder(chain[depth // 2], series)
+    return {'music': music, 'bottom': chain[-1]}
+
+
+def run(depth):
+    os.chdir(tempfile.mkdtemp(prefix='misfav-migrate-'))
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'plugin.video.mis.favoritos')]
+    import mock_kodi  # noqa: F401
+    from resources.lib.storage import DATA_PATH, JOURNAL_PATH, JSONStorage
+    from resources.lib.sqlite_storage import SQLiteStorage
+
+    source = JSONStorage(journal=True)
+    ids = build(source, depth)
+    ok = check(source.has_journal() and os.path.getsize(JOURNAL_PATH) > 0,
+               f"json: library built, {source._journal_records} journal records not folded")
+    expected = listing(source)
+    for name in SIDE_FILES:
+        if os.path.exists(os.path.join(DATA_PATH, name)):
+            os.remove(os.path.join(DATA_PATH, name))
+
+    migrated = SQLiteStorage()
+    got = listing(migrated)
+    ok &= check(not any(os.path.exists(os.path.join(DATA_PATH, name)) for name in SIDE_FILES),
+                "sqlite: no JSON side files written while migrating")
+    ok &= check(got == expected, f"sqlite: all {len(expected)} folders list the same nodes in the same order")
+    ok &= check(all(migrated.get_parent(node_id)['id'] == folder_id
+                    for folder_id, children in expected.items() for node_id, _, _, _ in children),
+                "sqlite: every node under the same parent")
+    ok &= check(migrated.get_folder_order(ids['music']) == 'manual'
+                and len(migrated.get_path(ids['bottom'])) == depth - depth // 2 + 1,
+                "sqlite: folder order and the deep chain carried over")
+    ok &= check(not migrated.check_folder_stats()
+                and migrated.get_folder_stats(['root']) == source.get_folder_stats(['root']),
+                "sqlite: folder aggregates computed and match the JSON library's")
+    found = lambda storage, query: sorted(node['id'] for node, _ in storage.search(query))  # noqa: E731
+    ok &= check(all(found(migrated, query) == found(source, query) for query in ('avila', 'titulo', 'fondo', 'ultimo')),
+                "sqlite: search finds the same nodes")
+    edited = source.find_item_by_url('plugin://migrate/?edited=3')
+    ok &= check(migrated.find_item_by_url('plugin://migrate/?edited=3')['id'] == edited['id']
+                and migrated.find_item_by_url('plugin://migrate/?n=3')['id'] != edited['id'],
+                "sqlite: URL index follows the edits")
+
+    # Folders added afterwards, out of name order, land where each folder's ordering puts them
+    films = next(node['id'] for node in source.get_folder_contents(ids['music']) if node['name'] == 'Películas')
+    for storage in (source, migrated):
+        storage.set_folder_order(films, 'date')
+        for folder_id in ('root', ids['music'], films):
+            for name in ('Zeta', 'Alfa', 'Mu'):
+                storage.add_folder(folder_id, name)
+    outline = lambda storage: [entry[1:] for entry in storage.get_folder_outline()]  # noqa: E731
+    listed = [node['name'] for node in migrated.get_folder_contents('root') if node['type'] == 'folder']
+    ok &= check(outline(migrated) == outline(source)
+                and [name for name, depth, _ in outline(migrated) if depth == 1] == listed,
+                "sqlite: folder outline in the same display order as the JSON one and the listings")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--depth', type=int, default=1200)
+    options = parser.parse_args()
+    sys.exit(0 if run(options.depth) else 1)
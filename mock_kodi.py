@@ -1,79 +1,234 @@
 import sys
 import logging
+import os
+import threading
+import time
 
 # Configure logging to print to console
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
+ADDON_ID = 'plugin.video.mis.favoritos'
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ADDON_ID)
+
 class MockXBMC:
+    LOGDEBUG = 0
     LOGINFO = 1
     LOGERROR = 2
-    
+
     @staticmethod
     def log(msg, level=1):
         prefix = "INFO" if level == 1 else "ERROR"
         logging.info(f"[{prefix}] {msg}")
-    
+
     @staticmethod
-    def executebuiltin(cmd):
+    def executebuiltin(cmd, wait=False):
         logging.info(f"[EXEC] {cmd}")
 
     @staticmethod
     def getInfoLabel(label):
         return "" # Return empty string by default
 
+    @staticmethod
+    def translatePath(path):
+        return "."
+
+    class Monitor:
+        def abortRequested(self):
+            return False
+
+        def waitForAbort(self, timeout=None):
+            # Simulate Kodi running: sleep, never abort
+            import time
+            time.sleep(timeout or 0)
+            return False
+
     class Keyboard:
-        def __init__(self, default='', heading=''):
+        def __init__(self, default='', heading='', hidden=False):
             self.text = default
             self.heading = heading
             self.confirmed = False
-        
-        def doModal(self):
+
+        def doModal(self, autoclose=0):
             # Simulate user input
             val = input(f"[INPUT] {self.heading} (Default: '{self.text}'): ")
             if val:
                 self.text = val
             self.confirmed = True
-        
+
+        def setDefault(self, text):
+            self.text = text
+
+        def setHeading(self, heading):
+            self.heading = heading
+
         def isConfirmed(self):
             return self.confirmed
-        
+
         def getText(self):
             return self.text
 
 class MockXBMCGUI:
     NOTIFICATION_INFO = 'info'
+    NOTIFICATION_WARNING = 'warning'
     NOTIFICATION_ERROR = 'error'
 
     class ListItem:
-        def __init__(self, label=''):
+        def __init__(self, label='', label2='', path='', offscreen=False):
             self.label = label
+            self.label2 = label2
+            self.path = path
             self.art = {}
-        
+            self.info = {}
+            self.properties = {}
+            self.context_menu = []
+
+        def getLabel(self):
+            return self.label
+
+        def setLabel(self, label):
+            self.label = label
+
+        def getPath(self):
+            return self.path
+
+        def setPath(self, path):
+            self.path = path
+
         def setArt(self, art_dict):
             self.art.update(art_dict)
 
+        def getArt(self, key):
+            return self.art.get(key, '')
+
+        def setInfo(self, type, infoLabels):
+            self.info = infoLabels
+
+        def setProperty(self, key, value):
+            self.properties[key.lower()] = value
+
+        def getProperty(self, key):
+            return self.properties.get(key.lower(), '')
+
+        def addContextMenuItems(self, items, replaceItems=False):
+            self.context_menu = items
+
     class Dialog:
-        def notification(self, heading, message, icon):
+        # Without a harness every dialog is dismissed, as if the user pressed Back
+        def notification(self, heading, message, icon='info', time=5000, sound=True):
             logging.info(f"[NOTIFY] {heading}: {message}")
 
+        def ok(self, heading, message):
+            logging.info(f"[OK] {heading}: {message}")
+            return True
+
+        def yesno(self, heading, message, nolabel='', yeslabel='', autoclose=0):
+            logging.info(f"[YESNO] {heading}: {message}")
+            return False
+
+        def select(self, heading, list, autoclose=0, preselect=-1, useDetails=False):
+            logging.info(f"[SELECT] {heading}: {len(list)} options")
+            return -1
+
+        def multiselect(self, heading, options, autoclose=0, preselect=None, useDetails=False):
+            logging.info(f"[MULTISELECT] {heading}: {len(options)} options")
+            return None
+
+        def input(self, heading, defaultt='', type=0, option=0, autoclose=0):
+            logging.info(f"[INPUT] {heading}")
+            return ''
+
 class MockXBMCPlugin:
+    SORT_METHOD_NONE = 0
+    SORT_METHOD_LABEL = 1
+
     @staticmethod
     def setContent(handle, content):
         logging.info(f"[PLUGIN] Set Content: {content}")
-    
+
     @staticmethod
-    def addDirectoryItem(handle, url, listitem, isFolder):
+    def addSortMethod(handle, sortMethod, labelMask='', label2Mask=''):
+        pass
+
+    @staticmethod
+    def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
         logging.info(f"[ITEM] {'[FOLDER]' if isFolder else '[FILE]'} {listitem.label} -> {url}")
-    
+        return True
+
+    @staticmethod
+    def addDirectoryItems(handle, items, totalItems=0):
+        for url, listitem, isFolder in items:
+            MockXBMCPlugin.addDirectoryItem(handle, url, listitem, isFolder)
+        return True
+
     @staticmethod
-    def endOfDirectory(handle):
+    def endOfDirectory(handle, succeeded=True, updateListing=False, cacheToDisc=True):
         logging.info("[PLUGIN] End of Directory")
 
+    @staticmethod
+    def setResolvedUrl(handle, succeeded, listitem):
+        logging.info(f"[PLUGIN] Resolved: {listitem.getPath()}")
+
+class MockXBMCVFS:
+    @staticmethod
+    def translatePath(path):
+        return "." # Mock translates special paths to current dir
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(sys.modules['xbmcvfs'].translatePath(path))
+
+    @staticmethod
+    def mkdirs(path):
+        os.makedirs(sys.modules['xbmcvfs'].translatePath(path), exist_ok=True)
+        return True
+
+    @staticmethod
+    def delete(path):
+        try:
+            os.remove(sys.modules['xbmcvfs'].translatePath(path))
+            return True
+        except OSError:
+            return False
+
+    class File:
+        """Kodi's file object: read() gives text, readBytes() bytes."""
+
+        def __init__(self, path, mode='r'):
+            self._f = open(sys.modules['xbmcvfs'].translatePath(path), 'wb' if mode == 'w' else 'rb')
+
+        def read(self, numBytes=-1):
+            return self._f.read(numBytes).decode('utf-8', errors='replace')
+
+        def readBytes(self, numBytes=-1):
+            return bytearray(self._f.read(numBytes))
+
+        def write(self, buffer):
+            self._f.write(buffer.encode('utf-8') if isinstance(buffer, str) else bytes(buffer))
+            return True
+
+        def size(self):
+            return os.fstat(self._f.fileno()).st_size
+
+        def close(self):
+            self._f.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.close()
+
 class MockXBMCAddon:
     class Addon:
+        def __init__(self, id=None):
+            pass
+
         def getSetting(self, id):
             return ""
 
+        def getAddonInfo(self, id):
+            return {'id': ADDON_ID, 'path': PLUGIN_DIR}.get(id, '')
+
 import builtins
 
 # Inject Mocks into sys.modules
@@ -99,7 +254,9 @@ for attr in dir(MockXBMCPlugin):
 sys.modules['xbmcplugin'] = m_xbmcplugin
 
 m_xbmcvfs = ModuleType('xbmcvfs')
-m_xbmcvfs.translatePath = lambda path: "." # Mock translates special paths to current dir
+for attr in dir(MockXBMCVFS):
+    if not attr.startswith('__'):
+        setattr(m_xbmcvfs, attr, getattr(MockXBMCVFS, attr))
 sys.modules['xbmcvfs'] = m_xbmcvfs
 
 m_xbmcaddon = ModuleType('xbmcaddon')
@@ -108,4 +265,242 @@ for attr in dir(MockXBMCAddon):
         setattr(m_xbmcaddon, attr, getattr(MockXBMCAddon, attr))
 sys.modules['xbmcaddon'] = m_xbmcaddon
 
+
+class NoAnswer(LookupError):
+    """A strict harness was asked for a dialog answer it had not been given."""
+
+
+class KodiHarness:
+    """
+    Headless Kodi for automated runs. Keyboards and dialogs answer from
+    a script instead of blocking, special:// paths map into a temporary
+    directory, and what the addon shows is recorded in memory: finished
+    directories, notifications, dialogs and builtins. When silent,
+    nothing is logged at all.
+
+        with KodiHarness(settings={'backend': '1'}) as kodi:
+            kodi.answer('keyboard', 'Películas')
+            kodi.run('add_folder', folder_id='root')
+            listing = kodi.run('folder', folder_id='root')
+            labels = [li.getLabel() for _, li, _ in listing['items']]
+
+    Install it before importing the addon: storage resolves its data
+    directory on import. Answers are queued per kind ('keyboard',
+    'select', 'multiselect', 'yesno', 'input'); a queued callable is
+    called with the heading and the options (or message) to pick the
+    answer. Unanswered dialogs are dismissed, or raise NoAnswer if strict.
+    """
+
+    MODULES = ('xbmc', 'xbmcgui', 'xbmcplugin', 'xbmcvfs', 'xbmcaddon')
+
+    def __init__(self, path=None, settings=None, silent=True, strict=False, reuse_storage=True):
+        import collections
+        import tempfile
+        self.path = path or tempfile.mkdtemp(prefix='misfav-kodi-')
+        self.settings = dict(settings or {})
+        self.silent = silent
+        self.strict = strict
+        # Keep the opened library between run() calls instead of loading it every time
+        self.reuse_storage = reuse_storage
+        self.infolabels = {}
+        self.answers = collections.defaultdict(collections.deque)
+        self.abort = threading.Event()
+        self._saved = None
+        self.clear()
+
+    def clear(self):
+        """Forget everything recorded so far."""
+        self.directories = []
+        self.notifications = []
+        self.dialogs = []
+        self.builtins = []
+        self.resolved = []
+        self._building = {}
+
+    # --- Script -----------------------------------------------------------
+
+    def answer(self, kind, *values):
+        """Queue answers for the next dialogs of a kind, in order."""
+        self.answers[kind].extend(values)
+        return self
+
+    def _next(self, kind, heading, shown, dismissed):
+        self.dialogs.append((kind, heading, shown))
+        if not self.answers[kind]:
+            if self.strict:
+                raise NoAnswer(f"No scripted answer for {kind} '{heading}'")
+            return dismissed
+        value = self.answers[kind].popleft()
+        return value(heading, shown) if callable(value) else value
+
+    def translate_path(self, path):
+        """special://<root>/<rest> -> <harness dir>/<root>/<rest>; other paths unchanged."""
+        if not path.startswith('special://'):
+            return path
+        root, _, rest = path[len('special://'):].partition('/')
+        if root == 'home' and rest.rstrip('/') == f'addons/{ADDON_ID}':
+            return PLUGIN_DIR
+        return os.path.join(self.path, root, *rest.split('/'))
+
+    # --- Stand-ins ----------------------------------------------------------
+
+    def _modules(self):
+        harness = self
+        quiet = lambda *args, **kwargs: None
+
+        class Keyboard(MockXBMC.Keyboard):
+            def doModal(self, autoclose=0):
+                text = harness._next('keyboard', self.heading, self.text, None)
+                self.confirmed = text is not None
+                if text is not None:
+                    self.text = text
+
+        class Dialog(MockXBMCGUI.Dialog):
+            def notification(self, heading, message, icon='info', time=5000, sound=True):
+                harness.notifications.append((heading, message, icon))
+
+            def ok(self, heading, message):
+                harness.dialogs.append(('ok', heading, message))
+                return True
+
+            def yesno(self, heading, message, nolabel='', yeslabel='', autoclose=0):
+                return bool(harness._next('yesno', heading, message, False))
+
+            def select(self, heading, list, autoclose=0, preselect=-1, useDetails=False):
+                return harness._next('select', heading, list, -1)
+
+            def multiselect(self, heading, options, autoclose=0, preselect=None, useDetails=False):
+                return harness._next('multiselect', heading, options, None)
+
+            def input(self, heading, defaultt='', type=0, option=0, autoclose=0):
+                return harness._next('input', heading, defaultt, '')
+
+        class Monitor(MockXBMC.Monitor):
+            def abortRequested(self):
+                return harness.abort.is_set()
+
+            def waitForAbort(self, timeout=None):
+                return harness.abort.wait(timeout)
+
+        class Addon(MockXBMCAddon.Addon):
+            def getSetting(self, id):
+                return harness.settings.get(id, '')
+
+            def setSetting(self, id, value):
+                harness.settings[id] = value
+
+            def getAddonInfo(self, id):
+                return {'id': ADDON_ID, 'path': PLUGIN_DIR,
+                        'profile': f'special://profile/addon_data/{ADDON_ID}/'}.get(id, '')
+
+        def directory(handle):
+            """The directory the call is building for handle."""
+            return harness._building.setdefault(handle, {'items': [], 'content': None, 'sort_methods': []})
+
+        def add_directory_items(handle, items, totalItems=0):
+            directory(handle)['items'].extend(items)
+            return True
+
+        def end_of_directory(handle, succeeded=True, updateListing=False, cacheToDisc=True):
+            directory(handle)
+            listing = harness._building.pop(handle)
+            listing.update(handle=handle, succeeded=succeeded, update_listing=updateListing,
+                           cache_to_disc=cacheToDisc)
+            harness.directories.append(listing)
+
+        def log(msg, level=MockXBMC.LOGINFO):
+            if not harness.silent:
+                MockXBMC.log(msg, level)
+
+        def executebuiltin(cmd, wait=False):
+            harness.builtins.append(cmd)
+            if not harness.silent:
+                MockXBMC.executebuiltin(cmd)
+
+        return {
+            'xbmc': {'log': log, 'executebuiltin': executebuiltin, 'Keyboard': Keyboard, 'Monitor': Monitor,
+                     'getInfoLabel': lambda label: harness.infolabels.get(label, ''),
+                     'translatePath': self.translate_path},
+            'xbmcgui': {'Dialog': Dialog},
+            'xbmcplugin': {
+                'setContent': lambda handle, content: directory(handle).update(content=content),
+                'addSortMethod': lambda handle, sortMethod, *args, **kwargs:
+                    directory(handle)['sort_methods'].append(sortMethod),
+                'addDirectoryItem': lambda handle, url, listitem, isFolder=False, totalItems=0:
+                    add_directory_items(handle, [(url, listitem, isFolder)]),
+                'addDirectoryItems': add_directory_items,
+                'endOfDirectory': end_of_directory,
+                'setResolvedUrl': lambda handle, succeeded, listitem:
+                    harness.resolved.append((succeeded, listitem)),
+            },
+            'xbmcvfs': {'translatePath': self.translate_path},
+            'xbmcaddon': {'Addon': Addon},
+        }
+
+    def install(self):
+        """Put the harness behind the xbmc* modules; the addon is run from its folder."""
+        modules = self._modules()
+        self._saved = {name: {attr: getattr(sys.modules[name], attr) for attr in attrs}
+                       for name, attrs in modules.items()}
+        for name, attrs in modules.items():
+            for attr, value in attrs.items():
+                setattr(sys.modules[name], attr, value)
+        if PLUGIN_DIR not in sys.path:
+            sys.path.insert(0, PLUGIN_DIR)
+        return self
+
+    def uninstall(self):
+        for name, attrs in (self._saved or {}).items():
+            for attr, value in attrs.items():
+                setattr(sys.modules[name], attr, value)
+        self._saved = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    # --- Calls ----------------------------------------------------------------
+
+    def _fresh_call(self):
+        """
+        Kodi starts every call in a new interpreter. A kept library is only
+        reloaded if the files changed (e.g. through the context menu), so it
+        matches what a new interpreter would load.
+        """
+        common = sys.modules.get('resources.lib.common')
+        if common is None or common._storage is None:
+            return
+        if not self.reuse_storage:
+            common._storage = None
+        elif hasattr(common._storage, 'refresh'):
+            common._storage.refresh()
+
+    def run(self, mode=None, handle=1, **params):
+        """
+        One plugin call, as Kodi makes for plugin://<addon>/?mode=...&<params>.
+        Returns the directory it finished, if any.
+        """
+        import urllib.parse
+        query = {key: value for key, value in dict(params, mode=mode).items() if value is not None}
+        sys.argv = [f'plugin://{ADDON_ID}/', str(handle), '?' + urllib.parse.urlencode(query)]
+        started = time.perf_counter()
+        self._fresh_call()
+        import default
+        # Imported once per process here; Kodi starts each call afresh
+        default.STARTED = started
+        finished = len(self.directories)
+        default.main()
+        return self.directories[-1] if len(self.directories) > finished else None
+
+    def run_context_menu(self, label, path, thumb=''):
+        """The 'add to favourites' context menu on an item with this label, path and art."""
+        self.infolabels = {'ListItem.Label': label, 'ListItem.FilenameAndPath': path, 'ListItem.Art(thumb)': thumb}
+        started = time.perf_counter()
+        self._fresh_call()
+        from resources.lib import context_menu
+        context_menu.STARTED = started
+        context_menu.main()
+
 print("Mocks inyectados. Listo para simular Kodi.")
@@ -0,0 +1,397 @@
+import xbmc
+import xbmcgui
+
+from resources.lib.common import get_storage, log
+
+def folder_choices(outline, current_id=None):
+    """Indented picker labels and matching ids for a folder outline, marking the current folder."""
+    labels = []
+    ids = []
+    for fid, name, depth, _ in outline:
+        indent = '  ' * depth
+        if fid == current_id:
+            labels.append(f"{indent}[COLOR lime]✓ {name} [ACTUAL][/COLOR]")
+        else:
+            labels.append(f"{indent}{name}")
+        ids.append(fid)
+    return labels, ids
+
+def add_new_folder(parent_id):
+    kbd = xbmc.Keyboard('', 'Nombre de la carpeta')
+    kbd.doModal()
+    if kbd.isConfirmed():
+        name = kbd.getText()
+        if name:
+            log(f"Creating folder '{name}' in '{parent_id}'")
+            if get_storage().add_folder(parent_id, name):
+                xbmc.executebuiltin('Container.Refresh')
+            else:
+                xbmcgui.Dialog().notification('Error', 'No se pudo crear la carpeta', xbmcgui.NOTIFICATION_ERROR)
+
+def add_new_item_dialog(parent_id):
+    # Dialog for Name
+    kbd = xbmc.Keyboard('', 'Nombre del favorito')
+    kbd.doModal()
+    if not kbd.isConfirmed(): return
+    name = kbd.getText()
+    
+    # Dialog for URL
+    kbd = xbmc.Keyboard('', 'URL / plugin://...')
+    kbd.doModal()
+    if not kbd.isConfirmed(): return
+    url_link = kbd.getText()
+    
+    if name and url_link:
+        from resources.lib.storage import add_unique_item
+        log(f"Creating item '{name}' -> '{url_link}'")
+        result, existing = add_unique_item(get_storage(), parent_id, name, url_link, '')
+        if result == 'skipped':
+            xbmcgui.Dialog().notification('Ya existe', f"Esa URL ya está guardada como '{existing['name']}'", xbmcgui.NOTIFICATION_INFO)
+        elif result:
+            xbmc.executebuiltin('Container.Refresh')
+            if result == 'moved':
+                xbmcgui.Dialog().notification('Ya existe', f"'{existing['name']}' movido a esta carpeta", xbmcgui.NOTIFICATION_INFO)
+        else:
+            xbmcgui.Dialog().notification('Error', 'No se pudo añadir el item', xbmcgui.NOTIFICATION_ERROR)
+
+def rename_folder(folder_id):
+    storage = get_storage()
+    folder = storage.get_node(folder_id)
+    if folder:
+        kbd = xbmc.Keyboard(folder['name'], 'Nuevo nombre')
+        kbd.doModal()
+        if kbd.isConfirmed():
+            new_name = kbd.getText()
+            if new_name and storage.rename_folder(folder_id, new_name):
+                xbmc.executebuiltin('Container.Refresh')
+            else:
+                xbmcgui.Dialog().notification('Error', 'No se pudo renombrar', xbmcgui.NOTIFICATION_ERROR)
+
+def delete_folder(folder_id):
+    storage = get_storage()
+    folder = storage.get_node(folder_id)
+    if folder:
+        stats = storage.get_folder_stats([folder_id]).get(folder_id)
+        msg = f"¿Eliminar '{folder['name']}'?"
+        if stats and (stats['total_items'] or stats['total_folders']):
+            from resources.lib.listing import folder_summary
+            msg += f"\n\n⚠️ También se eliminarán {folder_summary(stats)}."
+        
+        if xbmcgui.Dialog().yesno('Confirmar eliminación', msg):
+            if storage.delete_folder(folder_id):
+                xbmc.executebuiltin('Container.Refresh')
+            else:
+                xbmcgui.Dialog().notification('Error', 'No se pudo eliminar', xbmcgui.NOTIFICATION_ERROR)
+
+ORDER_LABELS = [
+    ('name', 'Nombre'),
+    ('date', 'Fecha de alta (recientes primero)'),
+    ('manual', 'Manual (orden en que se añadieron)'),
+]
+
+def set_folder_order(folder_id):
+    storage = get_storage()
+    current = storage.get_folder_order(folder_id)
+    labels = [f"[COLOR lime]✓ {label}[/COLOR]" if order == current else label for order, label in ORDER_LABELS]
+    selected = xbmcgui.Dialog().select('Ordenar por:', labels)
+    if selected >= 0 and ORDER_LABELS[selected][0] != current:
+        if storage.set_folder_order(folder_id, ORDER_LABELS[selected][0]):
+            xbmc.executebuiltin('Container.Refresh')
+        else:
+            xbmcgui.Dialog().notification('Error', 'No se pudo cambiar el orden', xbmcgui.NOTIFICATION_ERROR)
+
+def rename_item(item_id):
+    storage = get_storage()
+    item = storage.get_node(item_id)
+    if item:
+        kbd = xbmc.Keyboard(item['name'], 'Nuevo nombre')
+        kbd.doModal()
+        if kbd.isConfirmed():
+            new_name = kbd.getText()
+            if new_name and storage.rename_item(item_id, new_name):
+                xbmc.executebuiltin('Container.Refresh')
+            else:
+                xbmcgui.Dialog().notification('Error', 'No se pudo renombrar', xbmcgui.NOTIFICATION_ERROR)
+
+def delete_item(item_id):
+    storage = get_storage()
+    item = storage.get_node(item_id)
+    if item:
+        if xbmcgui.Dialog().yesno('Confirmar eliminación', f"¿Eliminar '{item['name']}'?"):
+            if storage.delete_item(item_id):
+                xbmc.executebuiltin('Container.Refresh')
+            else:
+                xbmcgui.Dialog().notification('Error', 'No se pudo eliminar', xbmcgui.NOTIFICATION_ERROR)
+
+def move_item(item_id):
+    storage = get_storage()
+    # Get current parent folder
+    current_parent = storage.get_parent(item_id)
+    current_parent_id = current_parent['id'] if current_parent else None
+    
+    # Get all folders
+    folder_names, folder_ids = folder_choices(storage.get_folder_outline(), current_parent_id)
+    
+    # Show selection dialog
+    selected = xbmcgui.Dialog().select('Mover a carpeta:', folder_names)
+    if selected >= 0:
+        target_folder_id = folder_ids[selected]
+        # Don't move if it's the same folder
+        if target_folder_id == current_parent_id:
+            xbmcgui.Dialog().notification('Info', 'Ya está en esa carpeta', xbmcgui.NOTIFICATION_INFO)
+            return
+        
+        if storage.move_item(item_id, target_folder_id):
+            xbmc.executebuiltin('Container.Refresh')
+            xbmcgui.Dialog().notification('Éxito', 'Favorito movido', xbmcgui.NOTIFICATION_INFO)
+        else:
+            xbmcgui.Dialog().notification('Error', 'No se pudo mover', xbmcgui.NOTIFICATION_ERROR)
+
+def move_folder(folder_id):
+    storage = get_storage()
+    current_parent = storage.get_parent(folder_id)
+    # The folder and everything below it can't be a target: the outline
+    # lists a folder's subtree right after it, deeper than it
+    outline = storage.get_folder_outline()
+    start = next((i for i, entry in enumerate(outline) if entry[0] == folder_id), None)
+    if current_parent is None or start is None:
+        # Gone meanwhile (e.g. deleted from another window), or not a folder
+        xbmcgui.Dialog().notification('Error', 'No se pudo mover', xbmcgui.NOTIFICATION_ERROR)
+        return
+    end = start + 1
+    while end < len(outline) and outline[end][2] > outline[start][2]:
+        end += 1
+    folder_names, folder_ids = folder_choices(outline[:start] + outline[end:], current_parent['id'])
+
+    selected = xbmcgui.Dialog().select('Mover carpeta a:', folder_names)
+    if selected >= 0:
+        target_folder_id = folder_ids[selected]
+        if target_folder_id == current_parent['id']:
+            xbmcgui.Dialog().notification('Info', 'Ya está en esa carpeta', xbmcgui.NOTIFICATION_INFO)
+            return
+
+        if storage.move_folder(folder_id, target_folder_id):
+            xbmc.executebuiltin('Container.Refresh')
+            xbmcgui.Dialog().notification('Éxito', 'Carpeta movida', xbmcgui.NOTIFICATION_INFO)
+        else:
+            xbmcgui.Dialog().notification('Error', 'No se pudo mover', xbmcgui.NOTIFICATION_ERROR)
+
+def edit_item(item_id):
+    storage = get_storage()
+    item = storage.get_node(item_id)
+    if not item:
+        return
+    
+    # Name
+    kbd = xbmc.Keyboard(item['name'], 'Nombre')
+    kbd.doModal()
+    if not kbd.isConfirmed(): return
+    name = kbd.getText()
+    
+    # URL
+    kbd = xbmc.Keyboard(item.get('url', ''), 'URL')
+    kbd.doModal()
+    if not kbd.isConfirmed(): return
+    url = kbd.getText()
+    
+    # Thumbnail (optional)
+    kbd = xbmc.Keyboard(item.get('thumbnail', ''), 'Thumbnail (opcional)')
+    kbd.doModal()
+    thumbnail = kbd.getText() if kbd.isConfirmed() else item.get('thumbnail', '')
+    
+    if storage.update_item(item_id, name, url, thumbnail):
+        from resources.lib.thumbnails import prefetch_thumbnails
+        prefetch_thumbnails([thumbnail])
+        xbmc.executebuiltin('Container.Refresh')
+    else:
+        xbmcgui.Dialog().notification('Error', 'No se pudo actualizar', xbmcgui.NOTIFICATION_ERROR)
+
+def import_from_kodi(folder_id):
+    from resources.lib.kodi_importer import KodiFavoritesImporter
+    importer = KodiFavoritesImporter()
+    # Only favourites added or changed since the last import, unless the user asks for all
+    kodi_favs = importer.get_new_favorites()
+    
+    if not kodi_favs:
+        kodi_favs = importer.get_kodi_favorites()
+        if not kodi_favs:
+            xbmcgui.Dialog().ok('Sin favoritos', 'No se encontraron favoritos en Kodi.\n\nPuedes añadir favoritos desde el menú contextual de cualquier elemento en Kodi.')
+            return
+        if not xbmcgui.Dialog().yesno('Sin novedades', 'No hay favoritos nuevos en Kodi desde la última importación.\n\n¿Mostrar todos?'):
+            return
+    
+    # Show selection dialog
+    fav_names = [f"{f['name']} [COLOR yellow](modificado)[/COLOR]" if f.get('changed') else f['name'] for f in kodi_favs]
+    selected_indices = xbmcgui.Dialog().multiselect('Selecciona favoritos a importar:', fav_names)
+    if selected_indices is not None:
+        # Seen now: don't offer them as new again, imported or not
+        importer.mark_synced()
+    
+    if selected_indices:
+        selected_favs = [kodi_favs[i] for i in selected_indices]
+        count, skipped = importer.import_to_folder(get_storage(), folder_id, selected_favs)
+        xbmc.executebuiltin('Container.Refresh')
+        message = f'{count} favoritos importados'
+        if skipped:
+            message += f', {skipped} duplicados omitidos'
+        xbmcgui.Dialog().notification('Importación completa', message, xbmcgui.NOTIFICATION_INFO)
+
+def choose_sync_folder():
+    """Pick the folder that automatic sync mirrors Kodi favourites into (from the settings)."""
+    import xbmcaddon
+    addon = xbmcaddon.Addon()
+    folders = get_storage().get_folder_outline()
+    labels, _ = folder_choices(folders, addon.getSetting('sync_folder') or 'root')
+    selected = xbmcgui.Dialog().select('Sincronizar favoritos de Kodi en:', labels)
+    if selected >= 0:
+        folder_id, name, _, path = folders[selected]
+        addon.setSetting('sync_folder', folder_id)
+        addon.setSetting('sync_folder_name', ' / '.join(path) or name)
+
+def dedupe_library():
+    """Delete every favourite whose URL an older favourite already has."""
+    storage = get_storage()
+    duplicates = storage.find_duplicates()
+    if not duplicates:
+        xbmcgui.Dialog().notification('Duplicados', 'No hay favoritos duplicados', xbmcgui.NOTIFICATION_INFO)
+        return
+    if xbmcgui.Dialog().yesno('Eliminar duplicados', f"Se eliminarán {len(duplicates)} favoritos repetidos.\n\nSe conserva el más antiguo de cada URL."):
+        if storage.delete_nodes(duplicates):
+            xbmc.executebuiltin('Container.Refresh')
+            xbmcgui.Dialog().notification('Duplicados', f'{len(duplicates)} duplicados eliminados', xbmcgui.NOTIFICATION_INFO)
+        else:
+            xbmcgui.Dialog().notification('Error', 'No se pudieron eliminar', xbmcgui.NOTIFICATION_ERROR)
+
+def _select_nodes(storage, folder_id, heading, keep_nested=False):
+    """
+    Multi-select over a folder's contents. If it has subfolders the user
+    may include everything below it, listed under each folder with its
+    path. Returns the chosen nodes, or None if there was nothing to
+    choose or the dialog was cancelled. Unless keep_nested, nodes inside
+    a chosen folder are left out: they go along with it.
+    """
+    stats = storage.get_folder_stats([folder_id]).get(folder_id)
+    recursive = bool(stats and stats['folders']) and \
+        xbmcgui.Dialog().yesno(heading, '¿Incluir también el contenido de las subcarpetas?')
+    nodes = []
+    labels = []
+    parents = {}
+    # Pre-order walk, so each folder's contents follow it as in the listing
+    stack = [(iter(storage.get_folder_contents(folder_id)), '', None)]
+    while stack:
+        node = next(stack[-1][0], None)
+        if node is None:
+            stack.pop()
+            continue
+        prefix = stack[-1][1]
+        parents[node['id']] = stack[-1][2]
+        nodes.append(node)
+        if node['type'] == 'folder':
+            labels.append(f"[COLOR dodgerblue]🗂️ {prefix}{node['name']}[/COLOR]")
+            if recursive:
+                stack.append((iter(storage.get_folder_contents(node['id'])), f"{prefix}{node['name']} / ", node['id']))
+        else:
+            labels.append(prefix + node['name'])
+
+    if not nodes:
+        xbmcgui.Dialog().ok('Sin elementos', 'No hay elementos en esta carpeta.')
+        return None
+    selected_indices = xbmcgui.Dialog().multiselect(heading, labels)
+    if not selected_indices:
+        return None
+    if keep_nested:
+        return [nodes[idx] for idx in selected_indices]
+    picked = {nodes[idx]['id'] for idx in selected_indices}
+
+    def inside_picked(node_id):
+        parent_id = parents[node_id]
+        while parent_id is not None:
+            if parent_id in picked:
+                return True
+            parent_id = parents[parent_id]
+        return False
+
+    return [nodes[idx] for idx in selected_indices if not inside_picked(nodes[idx]['id'])]
+
+def _choose_target(storage, heading, current_folder_id):
+    """Folder picker; returns the chosen folder id or None."""
+    folder_names, folder_ids = folder_choices(storage.get_folder_outline(), current_folder_id)
+    selected = xbmcgui.Dialog().select(heading, folder_names)
+    return folder_ids[selected] if selected >= 0 else None
+
+def multi_move_items(current_folder_id):
+    """Select several items and/or folders, optionally across subfolders, and move them in one change."""
+    storage = get_storage()
+    nodes = _select_nodes(storage, current_folder_id, 'Selecciona elementos a mover:')
+    if not nodes:
+        return
+    target_folder_id = _choose_target(storage, 'Mover a carpeta:', current_folder_id)
+    if target_folder_id is None:
+        return
+    moved_count = storage.move_nodes([node['id'] for node in nodes], target_folder_id)
+    if moved_count:
+        xbmc.executebuiltin('Container.Refresh')
+        xbmcgui.Dialog().notification('Éxito', f'{moved_count} elementos movidos', xbmcgui.NOTIFICATION_INFO)
+    else:
+        xbmcgui.Dialog().notification('Info', 'Ya están en esa carpeta', xbmcgui.NOTIFICATION_INFO)
+
+def multi_copy_items(current_folder_id):
+    """Select several items and/or folders and copy them into another folder in one change."""
+    storage = get_storage()
+    nodes = _select_nodes(storage, current_folder_id, 'Selecciona elementos a copiar:')
+    if not nodes:
+        return
+    target_folder_id = _choose_target(storage, 'Copiar a carpeta:', current_folder_id)
+    if target_folder_id is None:
+        return
+    copied_count = storage.copy_nodes([node['id'] for node in nodes], target_folder_id)
+    if copied_count:
+        xbmc.executebuiltin('Container.Refresh')
+        xbmcgui.Dialog().notification('Éxito', f'{copied_count} elementos copiados', xbmcgui.NOTIFICATION_INFO)
+    else:
+        xbmcgui.Dialog().notification('Error', 'No se pudieron copiar', xbmcgui.NOTIFICATION_ERROR)
+
+def multi_delete_items(current_folder_id):
+    """Select several items and/or folders and delete them in one change."""
+    storage = get_storage()
+    nodes = _select_nodes(storage, current_folder_id, 'Selecciona elementos a eliminar:')
+    if not nodes:
+        return
+    from resources.lib.listing import folder_summary
+    folders = storage.get_folder_stats([node['id'] for node in nodes if node['type'] == 'folder'])
+    total = {'total_items': sum(1 for node in nodes if node['type'] == 'item'), 'total_folders': len(folders)}
+    for stats in folders.values():
+        total['total_items'] += stats['total_items']
+        total['total_folders'] += stats['total_folders']
+    if xbmcgui.Dialog().yesno('Confirmar eliminación', f"Se eliminarán {folder_summary(total)}."):
+        if storage.delete_nodes([node['id'] for node in nodes]):
+            xbmc.executebuiltin('Container.Refresh')
+            xbmcgui.Dialog().notification('Eliminados', f'{len(nodes)} elementos eliminados', xbmcgui.NOTIFICATION_INFO)
+        else:
+            xbmcgui.Dialog().notification('Error', 'No se pudieron eliminar', xbmcgui.NOTIFICATION_ERROR)
+
+# Offered in the pattern keyboard: {name} is the current name, {n} the position in the selection
+RENAME_PATTERN = '{n:02d} - {name}'
+
+def multi_rename_items(current_folder_id):
+    """Select several items and/or folders and rename them all from one pattern in one change."""
+    storage = get_storage()
+    nodes = _select_nodes(storage, current_folder_id, 'Selecciona elementos a renombrar:', keep_nested=True)
+    if not nodes:
+        return
+    kbd = xbmc.Keyboard(RENAME_PATTERN, 'Nuevo nombre ({name}: nombre actual, {n}: número)')
+    kbd.doModal()
+    pattern = kbd.getText() if kbd.isConfirmed() else ''
+    if not pattern:
+        return
+    try:
+        pattern.format(name='', n=1)
+    except (KeyError, IndexError, ValueError, AttributeError):
+        xbmcgui.Dialog().notification('Error', 'Patrón no válido', xbmcgui.NOTIFICATION_ERROR)
+        return
+    renamed_count = storage.rename_nodes([node['id'] for node in nodes], pattern)
+    if renamed_count:
+        xbmc.executebuiltin('Container.Refresh')
+        xbmcgui.Dialog().notification('Éxito', f'{renamed_count} elementos renombrados', xbmcgui.NOTIFICATION_INFO)
+    else:
+        xbmcgui.Dialog().notification('Info', 'Ningún nombre ha cambiado', xbmcgui.NOTIFICATION_INFO)
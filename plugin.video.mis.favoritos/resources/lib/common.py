@@ -0,0 +1,39 @@
+import sys
+import urllib.parse
+import xbmc
+import xbmcaddon
+
+from resources.lib import profiling
+
+# Constants
+ADDON_HANDLE = int(sys.argv[1])
+BASE_URL = sys.argv[0]
+
+_storage = None
+
+def log(msg):
+    xbmc.log(f"[MisFavoritos] {msg}", level=xbmc.LOGINFO)
+
+def get_setting_int(setting_id, default=0):
+    try:
+        return int(xbmcaddon.Addon().getSetting(setting_id))
+    except ValueError:
+        return default
+
+def get_setting_bool(setting_id):
+    return xbmcaddon.Addon().getSetting(setting_id) == 'true'
+
+def get_storage():
+    """
+    Returns the storage backend, opening it on first use.
+    Modes that never touch the library don't pay for loading it.
+    """
+    global _storage
+    if _storage is None:
+        with profiling.phase('load'):
+            from resources.lib.storage import open_storage
+            _storage = open_storage()
+    return profiling.timed(_storage)
+
+def build_url(query):
+    return BASE_URL + '?' + urllib.parse.urlencode(query)
@@ -1,3 +1,8 @@
+import time
+
+# Before any other import: what follows counts as import time when profiling
+STARTED = time.perf_counter()
+
 import sys
 import xbmc
 import xbmcgui
@@ -10,13 +15,25 @@ addon_dir = xbmc.translatePath(xbmcaddon.Addon().getAddonInfo('path'))
 if addon_dir not in sys.path:
     sys.path.append(addon_dir)
 
-from resources.lib.storage import JSONStorage
+from resources.lib import profiling
+from resources.lib.storage import add_unique_item, open_storage, read_folder_outline
 
 def get_params():
     # Helper to debug params if needed
     return sys.argv
 
 def main():
+    profiling.start('context_menu', STARTED)
+    try:
+        add_selected_item()
+    finally:
+        profiling.finish()
+
+def _open_storage():
+    with profiling.phase('load'):
+        return profiling.timed(open_storage())
+
+def add_selected_item():
     # 1. Capture Item Info
     # For global context menu items, xbmc.getInfoLabel refers to the selected item
     label = xbmc.getInfoLabel('ListItem.Label')
@@ -33,9 +50,12 @@ def main():
         xbmcgui.Dialog().notification('Error', 'No se pudo obtener la ruta del item.', xbmcgui.NOTIFICATION_ERROR)
         return
 
-    # 2. Get Folders
-    storage = JSONStorage()
-    folders = storage.get_all_folders_flat()
+    # 2. Get Folders, from the saved outline so the picker opens without loading the library
+    storage = None
+    folders = read_folder_outline() if xbmcaddon.Addon().getSetting('backend') != '1' else None
+    if folders is None:
+        storage = _open_storage()
+        folders = storage.get_folder_outline()
     
     if not folders:
         # Should not happen as Root always exists, but just in case
@@ -43,11 +63,11 @@ def main():
         return
 
     # 3. Create Selection List
-    # folders is list of (id, name, depth)
+    # folders is list of (id, name, depth, path)
     display_list = []
     ids = []
     
-    for f_id, f_name, depth in folders:
+    for f_id, f_name, depth, _ in folders:
         indent = "  " * depth
         prefix = "- " if depth > 0 else "📂 "
         display_list.append(f"{indent}{prefix}{f_name}")
@@ -59,8 +79,17 @@ def main():
     
     if idx >= 0:
         target_folder_id = ids[idx]
-        if storage.add_item(target_folder_id, label, path, art):
+        if storage is None:
+            storage = _open_storage()
+        result, existing = add_unique_item(storage, target_folder_id, label, path, art)
+        if result == 'skipped':
+            xbmcgui.Dialog().notification('Ya existe', f"Ya está guardado como '{existing['name']}'", xbmcgui.NOTIFICATION_INFO)
+        elif result == 'moved':
+            xbmcgui.Dialog().notification('Guardado', f"'{existing['name']}' movido a {display_list[idx].strip()}", xbmcgui.NOTIFICATION_INFO)
+        elif result:
             xbmcgui.Dialog().notification('Guardado', f'Añadido a {display_list[idx].strip()}', xbmcgui.NOTIFICATION_INFO)
+            from resources.lib.thumbnails import prefetch_thumbnails
+            prefetch_thumbnails([art])
         else:
             xbmcgui.Dialog().notification('Error', 'Error al guardar el favorito', xbmcgui.NOTIFICATION_ERROR)
 
@@ -0,0 +1,138 @@
+import os
+import time
+import xbmc
+import xbmcgui
+import xbmcplugin
+
+from resources.lib.common import ADDON_HANDLE, build_url, get_setting_int, get_storage, log
+from resources.lib.listing import FOLDER_ART, MENU_ART
+from resources.lib.storage import DATA_PATH, read_usage_stats
+
+# Library files worth reporting, with what they are
+DATA_FILES = [
+    ('favorites.json', 'Biblioteca'),
+    ('favorites.journal', 'Diario de cambios'),
+    ('favorites.db', 'Base de datos SQLite'),
+    ('favorites.cache', 'Caché binaria'),
+    ('search.index', 'Índice de búsqueda'),
+    ('search.log', 'Cambios pendientes del índice'),
+    ('folders.outline', 'Esquema de carpetas'),
+]
+
+# Past these a library is in the slow zone: loads the user notices,
+# a snapshot rewritten on every change, folders too long to list at once
+SLOW_LOAD_SECONDS = 0.5
+SLOW_FILE_BYTES = 5 * 1024 * 1024
+SLOW_FOLDER_ITEMS = 1000
+
+LARGEST_FOLDERS = 5
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024.0
+
+def _ms(seconds):
+    ms = seconds * 1000
+    return f"{ms:.1f} ms" if ms < 10 else f"{ms:.0f} ms"
+
+def _entry(label, plot, url=None, art=MENU_ART):
+    li = xbmcgui.ListItem(label=label)
+    li.setArt(art)
+    li.setInfo('video', {'title': label, 'plot': plot})
+    # Folders so Kodi doesn't try to play them; plain rows just reopen the view
+    return (url or build_url({'mode': 'diagnostics'}), li, True)
+
+def slow_zone(usage, file_bytes, largest):
+    """Reasons the library is in the slow zone, if any."""
+    reasons = []
+    load = usage['last_load_seconds']
+    if load and load >= SLOW_LOAD_SECONDS:
+        reasons.append(f"la carga tarda {_ms(load)}")
+    if file_bytes.get('favorites.json', 0) >= SLOW_FILE_BYTES and not file_bytes.get('favorites.db'):
+        reasons.append(f"favorites.json ocupa {format_bytes(file_bytes['favorites.json'])}")
+    if largest and largest[0][1] >= SLOW_FOLDER_ITEMS and not get_setting_int('page_size'):
+        reasons.append(f"'{largest[0][0]}' tiene {largest[0][1]} favoritos sin paginar")
+    return reasons
+
+def show_diagnostics():
+    """
+    How the library and its storage are doing: size and shape, files on
+    disk, writes and load times from the usage stats, with a warning if
+    the library is in the slow zone and the rebuild action at the end.
+    """
+    storage = get_storage()
+    outline = storage.get_folder_outline()
+    stats = storage.get_folder_stats([folder_id for folder_id, _, _, _ in outline])
+    root = stats.get('root', {'total_items': 0, 'total_folders': 0})
+    names = {folder_id: ' / '.join(path) or 'Inicio' for folder_id, _, _, path in outline}
+    largest = sorted(((names[folder_id], folder['items'], folder_id) for folder_id, folder in stats.items()
+                      if folder['items']), key=lambda entry: -entry[1])[:LARGEST_FOLDERS]
+    file_bytes = {}
+    for name, _ in DATA_FILES:
+        try:
+            file_bytes[name] = os.path.getsize(os.path.join(DATA_PATH, name))
+        except OSError:
+            pass
+    usage = read_usage_stats()
+
+    xbmcplugin.setContent(ADDON_HANDLE, 'files')
+    entries = []
+    reasons = slow_zone(usage, file_bytes, largest)
+    if reasons:
+        log("Library in the slow zone: " + '; '.join(reasons))
+        entries.append(_entry("[COLOR red]⚠️ Biblioteca en la zona lenta[/COLOR]",
+                              '\n'.join(reasons) + "\n\nPrueba a reconstruir, activar el diario de cambios, "
+                              "paginar las carpetas grandes o pasar a SQLite."))
+
+    entries.append(_entry(f"📚 {root['total_items']} favoritos · {root['total_folders']} carpetas",
+                          'Todo lo guardado, a cualquier profundidad'))
+    entries.append(_entry(f"📐 Profundidad máxima: {max(depth for _, _, depth, _ in outline)}",
+                          'Niveles de carpetas por debajo de Inicio'))
+    for name, items, folder_id in largest:
+        entries.append(_entry(f"[COLOR dodgerblue]🗂️ {name}[/COLOR] [COLOR grey]({items})[/COLOR]",
+                              'Una de las carpetas con más favoritos directos',
+                              build_url({'mode': 'folder', 'folder_id': folder_id}), FOLDER_ART))
+
+    for name, description in DATA_FILES:
+        if name in file_bytes:
+            entries.append(_entry(f"💾 {name}: {format_bytes(file_bytes[name])}", description))
+
+    today = time.strftime('%Y-%m-%d')
+    week = time.strftime('%Y-%m-%d', time.localtime(time.time() - 6 * 86400))
+    written_week = sum(size for day, size in usage['days'].items() if day >= week)
+    since = time.strftime('%d/%m/%Y', time.localtime(usage['since'])) if usage['since'] else '—'
+    entries.append(_entry(f"✍️ Escrito hoy: {format_bytes(usage['days'].get(today, 0))} · "
+                          f"7 días: {format_bytes(written_week)}",
+                          f"Total desde el {since}: {format_bytes(usage['bytes_written'])}"
+                          + ("\n(Con SQLite se cuentan las escrituras, no los bytes)" if 'favorites.db' in file_bytes else '')))
+    entries.append(_entry(f"💽 Guardados: {usage['saves']} · diario: {usage['journal_appends']} · "
+                          f"compactaciones: {usage['compactions']}",
+                          'Escrituras completas de la biblioteca, anotaciones en el diario de cambios '
+                          'y diarios volcados a la biblioteca'))
+    if usage['loads']:
+        entries.append(_entry(f"⏱️ Carga: última {_ms(usage['last_load_seconds'])} · "
+                              f"media {_ms(usage['load_seconds'] / usage['loads'])} · "
+                              f"máx {_ms(usage['load_max_seconds'])}",
+                              f"{usage['loads']} cargas medidas; las llamadas que solo leen "
+                              "se cuentan como mucho una vez por hora"))
+
+    entries.append(_entry("[COLOR lime]🛠️ Reconstruir índices y compactar[/COLOR]",
+                          'Reescribe la biblioteca y vuelve a generar la caché, el esquema de carpetas '
+                          'y el índice de búsqueda',
+                          build_url({'mode': 'rebuild_storage'})))
+    xbmcplugin.addDirectoryItems(ADDON_HANDLE, entries, len(entries))
+    xbmcplugin.endOfDirectory(ADDON_HANDLE, cacheToDisc=False)
+
+def rebuild_storage():
+    if not xbmcgui.Dialog().yesno('Reconstruir', 'Se reescribirá la biblioteca y se regenerarán sus índices.\n\n¿Continuar?'):
+        return
+    started = time.perf_counter()
+    if get_storage().rebuild():
+        log(f"Storage rebuilt in {_ms(time.perf_counter() - started)}")
+        xbmc.executebuiltin('Container.Refresh')
+        xbmcgui.Dialog().notification('Reconstruir', f"Hecho en {_ms(time.perf_counter() - started)}",
+                                      xbmcgui.NOTIFICATION_INFO)
+    else:
+        xbmcgui.Dialog().notification('Error', 'No se pudo reconstruir', xbmcgui.NOTIFICATION_ERROR)
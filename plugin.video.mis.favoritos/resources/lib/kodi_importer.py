@@ -1,66 +1,170 @@
+import hashlib
+import json
+import os
 import xml.etree.ElementTree as ET
 import xbmcvfs
 import xbmc
 
+class _HashingReader:
+    """File wrapper hashing everything the XML parser reads through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+
 class KodiFavoritesImporter:
     """Import favorites from Kodi's native favourites.xml file."""
     
     def __init__(self):
+        from resources.lib.storage import DATA_PATH
         self.favourites_path = xbmcvfs.translatePath('special://profile/favourites.xml')
+        self.state_path = os.path.join(DATA_PATH, 'kodi_sync.json')
+        self._synced_state = None  # state to save once the offered favourites are dealt with
+    
+    def _parse(self):
+        """
+        Stream favourites.xml, one <favourite> at a time.
+        Returns (favorites, sha1 of the file), or ([], None) if it can't be read.
+        """
+        favorites = []
+        try:
+            with open(self.favourites_path, 'rb') as f:
+                reader = _HashingReader(f)
+                for _, fav in ET.iterparse(reader):
+                    if fav.tag != 'favourite':
+                        continue
+                    url = (fav.text or '').strip()
+                    if url:  # Only add if there's a valid URL
+                        favorites.append({
+                            'name': fav.get('name', 'Sin nombre'),
+                            'url': url,
+                            'thumbnail': fav.get('thumb', '')
+                        })
+                    fav.clear()
+            return favorites, reader.hash.hexdigest()
+        except (OSError, ET.ParseError) as e:
+            xbmc.log(f"[MisFavoritos] Error reading favourites.xml: {str(e)}", level=xbmc.LOGERROR)
+            return [], None
     
     def get_kodi_favorites(self):
         """
         Read and parse Kodi's favourites.xml file.
         Returns a list of dicts: [{'name': str, 'url': str, 'thumbnail': str}, ...]
         """
-        favorites = []
-        
-        if not xbmcvfs.exists(self.favourites_path):
+        if not os.path.exists(self.favourites_path):
             xbmc.log("[MisFavoritos] No favourites.xml found", level=xbmc.LOGINFO)
-            return favorites
-        
+            return []
+        favorites, _ = self._parse()
+        xbmc.log(f"[MisFavoritos] Found {len(favorites)} Kodi favorites", level=xbmc.LOGINFO)
+        return favorites
+    
+    def _load_state(self):
         try:
-            # Read the file
-            file_handle = xbmcvfs.File(self.favourites_path)
-            content = file_handle.read()
-            file_handle.close()
-            
-            # Parse XML
-            root = ET.fromstring(content)
-            
-            for fav in root.findall('favourite'):
-                name = fav.get('name', 'Sin nombre')
-                thumb = fav.get('thumb', '')
-                url = fav.text if fav.text else ''
-                
-                if url:  # Only add if there's a valid URL
-                    favorites.append({
-                        'name': name,
-                        'url': url.strip(),
-                        'thumbnail': thumb
-                    })
-            
-            xbmc.log(f"[MisFavoritos] Found {len(favorites)} Kodi favorites", level=xbmc.LOGINFO)
-            
-        except Exception as e:
-            xbmc.log(f"[MisFavoritos] Error reading favourites.xml: {str(e)}", level=xbmc.LOGERROR)
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def get_new_favorites(self):
+        """
+        Favourites added or changed (same URL, new name or thumbnail)
+        since the last mark_synced(); changed ones carry 'changed': True.
+        If favourites.xml has the same mtime and size as then, it isn't read.
+        """
+        from resources.lib.storage import url_fingerprint
+        try:
+            st = os.stat(self.favourites_path)
+        except OSError:
+            return []
+        stat = [st.st_mtime_ns, st.st_size]
+        state = self._load_state()
+        if state.get('stat') == stat:
+            return []
         
-        return favorites
+        favorites, digest = self._parse()
+        if digest is None:
+            return []
+        known = state.get('entries', {})
+        entries = {}
+        new_favorites = []
+        if digest != state.get('sha1'):
+            for fav in favorites:
+                fingerprint = url_fingerprint(fav['url'])
+                entry_hash = hashlib.sha1(f"{fav['name']}\0{fav['thumbnail']}".encode('utf-8')).hexdigest()[:16]
+                entries[fingerprint] = entry_hash
+                previous = known.get(fingerprint)
+                if previous != entry_hash:
+                    new_favorites.append(dict(fav, changed=previous is not None))
+        else:
+            entries = known  # Touched but identical
+        self._synced_state = {'stat': stat, 'sha1': digest, 'entries': entries}
+        if not new_favorites:
+            self.mark_synced()
+        return new_favorites
+    
+    def mark_synced(self):
+        """Remember the favourites seen by the last get_new_favorites() call."""
+        if self._synced_state is None:
+            return
+        tmp_path = self.state_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._synced_state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            xbmc.log(f"[MisFavoritos] Could not save {self.state_path}: {e}", level=xbmc.LOGERROR)
+        self._synced_state = None
     
     def import_to_folder(self, storage, folder_id, selected_favorites):
         """
         Import selected favorites into a specific folder.
+        URLs already stored are handled by the duplicates policy; for
+        favourites marked 'changed' the stored item gets the new name
+        and thumbnail instead.
         
         Args:
-            storage: JSONStorage instance
+            storage: JSONStorage or SQLiteStorage instance
             folder_id: Target folder ID
             selected_favorites: List of favorite dicts to import
         
         Returns:
-            Number of successfully imported favorites
+            (imported, skipped): favorites added, moved or updated, and
+            duplicates left as they were
         """
+        from resources.lib.storage import add_unique_item, duplicate_policy
         count = 0
-        for fav in selected_favorites:
-            if storage.add_item(folder_id, fav['name'], fav['url'], fav['thumbnail']):
-                count += 1
+        skipped = 0
+        policy = duplicate_policy()
+        # Single write for the whole batch
+        with storage.transaction():
+            for fav in selected_favorites:
+                result, existing = add_unique_item(storage, folder_id, fav['name'], fav['url'], fav['thumbnail'], policy)
+                if result == 'skipped' and fav.get('changed'):
+                    result = 'updated' if storage.update_item(existing['id'], fav['name'], None, fav['thumbnail']) else None
+                if result == 'skipped':
+                    skipped += 1
+                elif result:
+                    count += 1
+        if count:
+            from resources.lib.thumbnails import prefetch_thumbnails
+            prefetch_thumbnails([fav['thumbnail'] for fav in selected_favorites])
+        return count, skipped
+    
+    def auto_sync(self, storage, folder_id):
+        """
+        Mirror favourites added or changed in Kodi since the last sync
+        into folder_id, in one batched write. Returns how many were stored.
+        """
+        favorites = self.get_new_favorites()
+        if not favorites:
+            return 0
+        if storage.get_node(folder_id) is None:
+            folder_id = 'root'  # The chosen folder was deleted
+        count, _ = self.import_to_folder(storage, folder_id, favorites)
+        self.mark_synced()
         return count
@@ -0,0 +1,218 @@
+import time
+import urllib.parse
+import xbmc
+import xbmcgui
+import xbmcplugin
+
+from resources.lib.common import ADDON_HANDLE, build_url, get_setting_bool, get_setting_int, get_storage
+from resources.lib.profiling import phase
+
+# Art dicts shared by every entry that uses a default icon
+FOLDER_ART = {'icon': 'DefaultFolder.png', 'thumb': 'DefaultFolder.png'}
+ITEM_ART = {'icon': 'DefaultShortcut.png', 'thumb': 'DefaultShortcut.png',
+            'poster': 'DefaultShortcut.png', 'fanart': 'DefaultShortcut.png'}
+MENU_ART = {'icon': 'DefaultIcon.png', 'thumb': 'DefaultIcon.png',
+            'poster': 'DefaultIcon.png', 'fanart': 'DefaultIcon.png'}
+
+# (label, mode) for the context menu of each entry type
+FOLDER_ACTIONS = [('Renombrar', 'rename_folder'), ('Ordenar por...', 'set_order'), ('Mover a...', 'move_folder'),
+                  ('Eliminar', 'delete_folder')]
+ITEM_ACTIONS = [('Renombrar', 'rename_item'), ('Editar', 'edit_item'),
+                ('Mover a...', 'move_item'), ('Eliminar', 'delete_item')]
+
+# (label, mode, title, plot) for the management entries below the contents
+MENU_ENTRIES = [
+    ("[COLOR lime]➕ Crear Carpeta[/COLOR]", 'add_folder', 'Crear Carpeta', 'Crear una nueva carpeta'),
+    ("[COLOR gold]➕ Añadir Enlace Directo[/COLOR]", 'add_item', 'Añadir Enlace', 'Añadir manualmente un enlace'),
+    ("[COLOR cyan]📥 Importar[/COLOR]", 'import_kodi', 'Importar', 'Importar favoritos nativos'),
+    ("[COLOR violet]🔍 Buscar[/COLOR]", 'search', 'Buscar', 'Buscar favoritos y carpetas por nombre'),
+    ("[COLOR salmon]🧹 Eliminar duplicados[/COLOR]", 'dedupe', 'Eliminar duplicados', 'Borrar favoritos con la misma URL, conservando el más antiguo'),
+]
+# Bulk actions, only shown when the folder has contents
+MULTI_ENTRIES = [
+    ("[COLOR orange]📦 Mover[/COLOR]", 'multi_move', 'Mover', 'Mover múltiples elementos'),
+    ("[COLOR orange]📑 Copiar[/COLOR]", 'multi_copy', 'Copiar', 'Copiar múltiples elementos a otra carpeta'),
+    ("[COLOR orange]✏️ Renombrar[/COLOR]", 'multi_rename', 'Renombrar', 'Renombrar múltiples elementos con un patrón'),
+    ("[COLOR red]🗑️ Eliminar[/COLOR]", 'multi_delete', 'Eliminar', 'Eliminar múltiples elementos'),
+]
+
+def _url_template(mode, param):
+    """URL for mode with an empty param, ready to have a quoted id appended."""
+    return build_url({'mode': mode, param: ''})
+
+def _context_templates(actions):
+    return [(label, 'RunPlugin(' + _url_template(mode, 'item_id') + '{})') for label, mode in actions]
+
+def _context_menu(templates, quoted_id):
+    return [(label, template.format(quoted_id)) for label, template in templates]
+
+def folder_summary(stats):
+    """'12 favoritos · 3 carpetas' for a folder's aggregates, counting everything below it."""
+    items = stats['total_items']
+    folders = stats['total_folders']
+    parts = [f"{items} favorito{'s' if items != 1 else ''}"]
+    if folders:
+        parts.append(f"{folders} carpeta{'s' if folders != 1 else ''}")
+    return ' · '.join(parts)
+
+def build_entries(items, paths=None, thumbs=None, stats=None):
+    """
+    Build the (url, ListItem, isFolder) tuples for a folder's contents.
+    URL templates are built once per call instead of once per entry.
+    paths, if given, holds the folder path to show under each entry;
+    thumbs maps thumbnails to their local cached copies and stats
+    folder ids to their aggregates.
+    """
+    folder_url = _url_template('folder', 'folder_id')
+    folder_menu = _context_templates(FOLDER_ACTIONS)
+    item_menu = _context_templates(ITEM_ACTIONS)
+    quote = urllib.parse.quote_plus
+
+    entries = []
+    for index, item in enumerate(items):
+        quoted_id = quote(item['id'])
+        location = (' / '.join(paths[index]) or 'Inicio') if paths is not None else None
+        suffix = f"  [COLOR grey]({location})[/COLOR]" if location else ''
+        if item['type'] == 'folder':
+            folder_stats = stats.get(item['id']) if stats else None
+            count = f" [COLOR grey]({folder_stats['total_items']})[/COLOR]" if folder_stats else ''
+            li = xbmcgui.ListItem(label=f"[COLOR dodgerblue]🗂️ {item['name']}[/COLOR]{count}{suffix}")
+            li.setArt(FOLDER_ART)
+            plot = [location] if location else []
+            if folder_stats:
+                plot.append(folder_summary(folder_stats))
+                if folder_stats['modified']:
+                    plot.append('Modificada: ' + time.strftime('%d/%m/%Y %H:%M', time.localtime(folder_stats['modified'])))
+            # Set InfoTag to allow better view types
+            li.setInfo('video', {'title': item['name'], 'plot': '\n'.join(plot) or 'Carpeta'})
+            li.addContextMenuItems(_context_menu(folder_menu, quoted_id))
+            entries.append((folder_url + quoted_id, li, True))
+        else:
+            # It's an item/file
+            li = xbmcgui.ListItem(label=item['name'] + suffix)
+            thumb = item.get('thumbnail')
+            if thumbs and thumb in thumbs:
+                thumb = thumbs[thumb]
+            li.setArt({'icon': 'DefaultShortcut.png', 'thumb': thumb, 'poster': thumb, 'fanart': thumb} if thumb else ITEM_ART)
+            info = {'title': item['name'], 'mediatype': 'video'}
+            if location:
+                info['plot'] = location
+            li.setInfo('video', info)
+            # CRITICAL FIX v0.1.1: REMOVE IsPlayable=true for plugin:// links.
+            # Let Kodi resolve it naturally.
+            li.addContextMenuItems(_context_menu(item_menu, quoted_id))
+            entries.append((item['url'], li, False))
+    return entries
+
+def build_menu_entries(folder_id, has_items):
+    """Management entries. All are folders so Kodi doesn't try to play them."""
+    menu = MENU_ENTRIES + MULTI_ENTRIES if has_items else MENU_ENTRIES
+    entries = []
+    for label, mode, title, plot in menu:
+        li = xbmcgui.ListItem(label=label)
+        # Use DefaultIcon.png which is usually transparent/generic to hide ugly folders
+        li.setArt(MENU_ART)
+        li.setInfo('video', {'title': title, 'plot': plot})
+        entries.append((build_url({'mode': mode, 'folder_id': folder_id}), li, True))
+    return entries
+
+def build_page_entry(folder_id, page, pages, label):
+    li = xbmcgui.ListItem(label=f"[COLOR grey]{label} ({page + 1}/{pages})[/COLOR]")
+    li.setArt(MENU_ART)
+    li.setInfo('video', {'title': label, 'plot': f'Página {page + 1} de {pages}'})
+    return (build_url({'mode': 'folder', 'folder_id': folder_id, 'page': page}), li, True)
+
+def cached_thumbnails(items):
+    """Local copies of the items' art, if the thumbnail cache is on."""
+    thumbs = [item['thumbnail'] for item in items if item['type'] != 'folder' and item.get('thumbnail')]
+    if not thumbs:
+        return None
+    from resources.lib.thumbnails import ThumbnailCache, thumbnail_cache_enabled
+    if not thumbnail_cache_enabled():
+        return None
+    return ThumbnailCache().lookup(thumbs)
+
+def folder_stats(items):
+    """Aggregates of the folders among items, fetched in one call."""
+    folder_ids = [item['id'] for item in items if item['type'] == 'folder']
+    return get_storage().get_folder_stats(folder_ids) if folder_ids else None
+
+def sync_kodi_favourites():
+    """
+    With automatic sync on, mirror new Kodi favourites into the chosen
+    folder. Costs a single stat while favourites.xml is unchanged.
+    """
+    import xbmcaddon
+    from resources.lib.kodi_importer import KodiFavoritesImporter
+    count = KodiFavoritesImporter().auto_sync(get_storage(), xbmcaddon.Addon().getSetting('sync_folder') or 'root')
+    if count:
+        xbmcgui.Dialog().notification('Favoritos de Kodi', f'{count} favoritos sincronizados', xbmcgui.NOTIFICATION_INFO)
+
+def list_folder(folder_id, page=0):
+    """
+    List contents of a specific folder from storage.
+    With a page size set, only that page is listed, between
+    previous/next page entries.
+    """
+    if folder_id == 'root' and page == 0 and get_setting_bool('auto_sync'):
+        sync_kodi_favourites()
+
+    # Use 'movies' content to allow Poster/Fanart views
+    xbmcplugin.setContent(ADDON_HANDLE, 'movies')
+    # Removed sort method to keep Management Items at the bottom!
+    # xbmcplugin.addSortMethod(ADDON_HANDLE, xbmcplugin.SORT_METHOD_LABEL)
+
+    # 1. Get contents in display order: folders first, then items, both alphabetical
+    page_size = get_setting_int('page_size')
+    if page_size > 0:
+        items, total = get_storage().get_folder_page(folder_id, page * page_size, page_size)
+        pages = max(1, -(-total // page_size))
+        if page >= pages:
+            # Past the end, e.g. a stale URL after deletions: show the last page
+            page = pages - 1
+            items, total = get_storage().get_folder_page(folder_id, page * page_size, page_size)
+    else:
+        items, total = get_storage().get_folder_page(folder_id)
+        pages = 1
+        page = 0
+
+    # 2. Build every entry, management menu at the bottom, and hand them to Kodi at once
+    with phase('render'):
+        entries = []
+        if page > 0:
+            entries.append(build_page_entry(folder_id, page - 1, pages, '« Página anterior'))
+        entries.extend(build_entries(items, thumbs=cached_thumbnails(items), stats=folder_stats(items)))
+        if page + 1 < pages:
+            entries.append(build_page_entry(folder_id, page + 1, pages, 'Página siguiente »'))
+        entries.extend(build_menu_entries(folder_id, total > 0))
+        xbmcplugin.addDirectoryItems(ADDON_HANDLE, entries, len(entries))
+
+        xbmcplugin.endOfDirectory(ADDON_HANDLE)
+
+    # Force Poster View (501) for large images
+    xbmc.executebuiltin('Container.SetViewMode(501)')
+
+def search(query=None):
+    """
+    List the folders and favourites matching query, asking for it first
+    if missing. Each result shows the folder it lives in.
+    """
+    if not query:
+        kbd = xbmc.Keyboard('', 'Buscar')
+        kbd.doModal()
+        query = kbd.getText().strip() if kbd.isConfirmed() else ''
+    if not query:
+        xbmcplugin.endOfDirectory(ADDON_HANDLE, succeeded=False)
+        return
+
+    xbmcplugin.setContent(ADDON_HANDLE, 'movies')
+    results = get_storage().search(query)
+    with phase('render'):
+        if results:
+            nodes = [node for node, _ in results]
+            entries = build_entries(nodes, [path for _, path in results], cached_thumbnails(nodes), folder_stats(nodes))
+            xbmcplugin.addDirectoryItems(ADDON_HANDLE, entries, len(entries))
+        else:
+            xbmcgui.Dialog().notification('Buscar', f"Sin resultados para '{query}'", xbmcgui.NOTIFICATION_INFO)
+        xbmcplugin.endOfDirectory(ADDON_HANDLE, cacheToDisc=False)
+    xbmc.executebuiltin('Container.SetViewMode(501)')
@@ -0,0 +1,173 @@
+"""
+Opt-in timing of plugin calls.
+
+Enabled by the 'profiling' setting or the MISFAV_PROFILE environment
+variable ('1' or 'timing' for phase timing, 'cprofile' to also keep a
+cProfile dump per mode in the addon data directory). Each call then logs
+one line with where its time went:
+
+    Timing mode=folder 84.1 ms: import 12.0, load 30.2, lookup 5.1, render 20.3, other 16.5
+
+Phases are exclusive: time spent in a phase nested inside another (the
+persist of a write, say) only counts for the inner one, so they add up
+to the total. When disabled, phase() hands back a shared do-nothing
+context and the storage is used unwrapped.
+"""
+import os
+import time
+
+import xbmc
+import xbmcaddon
+
+ENV_VAR = 'MISFAV_PROFILE'
+# Values of the 'profiling' setting
+OFF, TIMING, CPROFILE = 0, 1, 2
+PHASES = ('import', 'load', 'lookup', 'update', 'render', 'persist')
+
+_level = OFF
+_started = 0.0
+_mode = None
+_totals = {}
+_stack = []
+_profiler = None
+_timed_storage = None
+
+
+class _NoPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase:
+    __slots__ = ('name', 'start', 'nested')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.start = time.perf_counter()
+        _stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _stack.pop()
+        _totals[self.name] = _totals.get(self.name, 0.0) + elapsed - self.nested
+        if _stack:
+            _stack[-1].nested += elapsed
+        return False
+
+
+def phase(name):
+    """Context manager timing its block as part of phase name."""
+    return _Phase(name) if _level else _NO_PHASE
+
+
+def configured_level():
+    """Profiling level from the environment, else from the addon settings."""
+    value = os.environ.get(ENV_VAR, '').strip().lower()
+    if value:
+        return {'0': OFF, 'off': OFF, 'cprofile': CPROFILE}.get(value, TIMING)
+    try:
+        return int(xbmcaddon.Addon().getSetting('profiling') or OFF)
+    except ValueError:
+        return OFF
+
+
+def start(mode, started):
+    """
+    Begin timing a call for mode, if enabled. started is the
+    time.perf_counter() reading taken before the addon's imports:
+    everything up to now counts as import.
+    """
+    global _level, _started, _mode, _profiler
+    _level = configured_level()
+    if not _level:
+        return
+    _started, _mode = started, mode
+    _totals.clear()
+    del _stack[:]
+    _totals['import'] = time.perf_counter() - started
+    if _level >= CPROFILE:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def finish():
+    """Log the call's phase summary and dump its profile, if timing."""
+    global _level, _profiler
+    if not _level:
+        return
+    total = time.perf_counter() - _started
+    if _profiler is not None:
+        _profiler.disable()
+        _dump_profile(_profiler)
+        _profiler = None
+    _level = OFF
+    xbmc.log(f"[MisFavoritos] {summary(_mode, total, _totals)}", level=xbmc.LOGINFO)
+
+
+def summary(mode, total, totals):
+    """One line: total and per-phase milliseconds, unaccounted time as other."""
+    names = [name for name in PHASES if name in totals] + sorted(set(totals) - set(PHASES))
+    other = total - sum(totals.values())
+    parts = [f"{name} {totals[name] * 1000:.1f}" for name in names] + [f"other {max(other, 0.0) * 1000:.1f}"]
+    return f"Timing mode={mode or 'folder'} {total * 1000:.1f} ms: " + ', '.join(parts)
+
+
+def profile_path(mode):
+    from resources.lib.storage import DATA_PATH
+    return os.path.join(DATA_PATH, 'profiles', f"{mode or 'folder'}.prof")
+
+
+def _dump_profile(profiler):
+    """Overwrite the mode's dump: the latest call is the one being looked at."""
+    path = profile_path(_mode)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
+    except OSError as e:
+        xbmc.log(f"[MisFavoritos] Could not write {path}: {e}", level=xbmc.LOGERROR)
+
+
+class TimedStorage:
+    """
+    Storage wrapper timing each call: reads as lookup, writes as update
+    (less the persist inside them).
+    """
+
+    def __init__(self, storage):
+        from resources.lib.storage_service import READ_METHODS, WRITE_METHODS
+        self._storage = storage
+        self._phases = dict.fromkeys(READ_METHODS, 'lookup')
+        self._phases.update(dict.fromkeys(WRITE_METHODS, 'update'))
+
+    def __getattr__(self, attr):
+        value = getattr(self._storage, attr)
+        name = self._phases.get(attr)
+        if name is None:
+            return value
+
+        def timed(*args, **kwargs):
+            with phase(name):
+                return value(*args, **kwargs)
+        return timed
+
+
+def timed(storage):
+    """storage itself when not timing, else a wrapper timing its calls."""
+    global _timed_storage
+    if not _level:
+        return storage
+    if _timed_storage is None or _timed_storage._storage is not storage:
+        with phase('import'):
+            _timed_storage = TimedStorage(storage)
+    return _timed_storage
@@ -0,0 +1,204 @@
+import json
+import marshal
+import os
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+from resources.lib.storage import StorageObserver, fold_text
+
+# Bump whenever tokenization or the file layout changes
+INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Accent- and case-folded words of text, e.g. 'Ñandú Rock!' -> ['nandu', 'rock']."""
+    return _TOKEN_RE.findall(fold_text(text))
+
+
+def node_tokens(node, include_urls):
+    tokens = set(tokenize(node['name']))
+    if include_urls and node.get('url'):
+        tokens.update(tokenize(node['url']))
+    return tokens
+
+
+class _TokenObserver(StorageObserver, ABC):
+    """Turns tree events into (node id, tokens) changes; None tokens means removed."""
+
+    def __init__(self, include_urls=False):
+        self.include_urls = include_urls
+
+    @abstractmethod
+    def _record(self, node_id, tokens):
+        """Takes one change: node_id now has tokens, or is gone if None."""
+
+    def node_added(self, node, parent):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self._record(node['id'], tuple(node_tokens(node, self.include_urls)))
+            stack.extend(node.get('children', ()))
+
+    def node_removed(self, node, parent):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self._record(node['id'], None)
+            stack.extend(node.get('children', ()))
+
+    def node_changed(self, node):
+        self._record(node['id'], tuple(node_tokens(node, self.include_urls)))
+
+
+class SearchLog(_TokenObserver):
+    """
+    Collects token changes and appends them to the log next to a saved
+    index, so keeping the index current costs O(change) per write
+    instead of rewriting it.
+    """
+
+    def __init__(self, include_urls=False):
+        super().__init__(include_urls)
+        self.changes = []
+
+    def _record(self, node_id, tokens):
+        self.changes.append((node_id, tokens))
+
+    def append(self, path, generation):
+        """
+        Writes the collected changes as one JSON line each, tagged with
+        generation. Writes that change no tokens (moves, reorders) still
+        advance the generation, so they leave a bare [generation] line.
+        """
+        lines = [[generation, node_id, tokens] for node_id, tokens in self.changes] or [[generation]]
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines))
+        self.changes = []
+
+
+class SearchIndex(_TokenObserver):
+    """
+    Inverted index from name (and optionally URL) tokens to node ids.
+    Query words match token prefixes, and every word has to match.
+    Saved next to the library, tagged with the generation it reflects;
+    later changes are replayed from the SearchLog on load.
+    """
+
+    def __init__(self, include_urls=False):
+        super().__init__(include_urls)
+        # Both maps hold a set/tuple, or the NUL-joined string they are
+        # saved as until first changed: strings unmarshal several times
+        # faster than sets, and most loads only serve a query or two.
+        self.postings = {}  # token -> node ids
+        self.tokens = {}  # node id -> its tokens
+        self._saved_tokens = None  # marshalled tokens map, loaded on first change
+        self._vocabulary = None  # sorted tokens, rebuilt lazily after changes
+        self.replayed = 0  # log lines applied by load()
+
+    @classmethod
+    def load(cls, path, log_path, generation, include_urls):
+        """
+        Returns the saved index brought up to date with its log, or None
+        if either is missing, stale or unreadable.
+        """
+        try:
+            with open(path, 'rb') as f:
+                header = marshal.loads(f.read(f.read(1)[0]))
+                version, base, saved_urls, postings_size = header
+                if version != INDEX_VERSION or saved_urls != include_urls:
+                    return None
+                index = cls(include_urls)
+                index.postings = marshal.loads(f.read(postings_size))
+                index._saved_tokens = f.read()
+                index.tokens = None
+        except (OSError, IndexError, EOFError, ValueError, TypeError):
+            return None
+        current = base
+        if current != generation:
+            try:
+                with open(log_path, encoding='utf-8') as f:
+                    for line in f:
+                        gen, *change = json.loads(line)
+                        if gen > base:
+                            if change:
+                                node_id, node_tokens = change
+                                index._record(node_id, node_tokens)
+                            index.replayed += 1
+                            current = gen
+            except (OSError, ValueError, TypeError):
+                return None
+        return index if current == generation else None
+
+    def save(self, path, generation):
+        postings = marshal.dumps({token: ids if isinstance(ids, str) else '\0'.join(ids)
+                                  for token, ids in self.postings.items()})
+        if self.tokens is None:
+            tokens = self._saved_tokens
+        else:
+            tokens = marshal.dumps({node_id: node_tokens if isinstance(node_tokens, str) else '\0'.join(node_tokens)
+                                    for node_id, node_tokens in self.tokens.items()})
+        header = marshal.dumps((INDEX_VERSION, generation, self.include_urls, len(postings)))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(bytes([len(header)]) + header + postings + tokens)
+        os.replace(tmp_path, path)
+
+    def build(self, root):
+        for child in root.get('children', ()):
+            self.node_added(child, root)
+
+    def _ids(self, token):
+        ids = self.postings[token]
+        if isinstance(ids, str):
+            ids = self.postings[token] = set(ids.split('\0'))
+        return ids
+
+    def _record(self, node_id, tokens):
+        if self.tokens is None:
+            self.tokens = marshal.loads(self._saved_tokens)
+            self._saved_tokens = None
+        old_tokens = self.tokens.pop(node_id, ())
+        for token in old_tokens.split('\0') if isinstance(old_tokens, str) else old_tokens:
+            if token in self.postings:
+                ids = self._ids(token)
+                ids.discard(node_id)
+                if not ids:
+                    del self.postings[token]
+                    self._vocabulary = None
+        if not tokens:
+            return
+        self.tokens[node_id] = tuple(tokens)
+        for token in tokens:
+            if token in self.postings:
+                self._ids(token).add(node_id)
+            else:
+                self.postings[token] = {node_id}
+                self._vocabulary = None
+
+    def _prefix_matches(self, prefix):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        vocabulary = self._vocabulary
+        ids = set()
+        i = bisect_left(vocabulary, prefix)
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            postings = self.postings[vocabulary[i]]
+            ids.update(postings.split('\0') if isinstance(postings, str) else postings)
+            i += 1
+        return ids
+
+    def search(self, query):
+        """Returns the set of node ids matching every word of query."""
+        words = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not words:
+            return set()
+        # Longest words first: they usually match the fewest tokens
+        result = self._prefix_matches(words[0])
+        for word in words[1:]:
+            if not result:
+                break
+            result &= self._prefix_matches(word)
+        return result
@@ -0,0 +1,723 @@
+import contextlib
+import itertools
+import os
+import sqlite3
+import time
+import uuid
+import xbmc
+import xbmcaddon
+
+from resources.lib.profiling import phase
+from resources.lib.search_index import INDEX_VERSION, node_tokens, tokenize
+from resources.lib.storage import (DATA_PATH, FILE_PATH, FOLDER_ORDERS, JOURNAL_PATH, STAT_FIELDS, UsageStats,
+                                   collation_key, compare_folder_stats, journal_records, read_tree, url_fingerprint)
+
+DB_PATH = os.path.join(DATA_PATH, 'favorites.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT,
+    thumbnail TEXT,
+    position INTEGER NOT NULL DEFAULT 0,
+    sort_key TEXT NOT NULL DEFAULT '',
+    added INTEGER NOT NULL DEFAULT 0,
+    sort_order TEXT NOT NULL DEFAULT 'name',
+    url_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes(parent_id, position);
+CREATE INDEX IF NOT EXISTS idx_nodes_type_name ON nodes(type, name);
+CREATE INDEX IF NOT EXISTS idx_nodes_by_name ON nodes(parent_id, type, sort_key);
+CREATE INDEX IF NOT EXISTS idx_nodes_by_date ON nodes(parent_id, type, added);
+CREATE INDEX IF NOT EXISTS idx_nodes_url ON nodes(url_key);
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT NOT NULL,
+    node_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tokens_token ON tokens(token);
+CREATE INDEX IF NOT EXISTS idx_tokens_node ON tokens(node_id);
+CREATE TABLE IF NOT EXISTS folder_stats (
+    folder_id TEXT PRIMARY KEY,
+    items INTEGER NOT NULL DEFAULT 0,
+    folders INTEGER NOT NULL DEFAULT 0,
+    total_items INTEGER NOT NULL DEFAULT 0,
+    total_folders INTEGER NOT NULL DEFAULT 0,
+    modified INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_COLUMNS = "id, parent_id, type, name, url, thumbnail"
+_INSERT = ("INSERT INTO nodes "
+           f"({_COLUMNS}, position, sort_key, added, sort_order, url_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+# Rows per INSERT batch when migrating from favorites.json
+MIGRATE_BATCH = 5000
+
+# Bump whenever url_fingerprint() changes, to recompute stored url_keys
+URL_KEY_VERSION = '1'
+
+# Bump whenever the folder_stats columns change meaning, to recompute them
+STATS_VERSION = '1'
+
+# Ids of a node and all its ancestors, up to Root
+_ANCESTORS = ("WITH RECURSIVE up(id) AS (SELECT ? UNION ALL SELECT n.parent_id FROM nodes n JOIN up ON n.id = up.id"
+              " WHERE n.parent_id IS NOT NULL) SELECT id FROM up")
+
+# ORDER BY for each folder ordering; each one is served by an index
+_ORDER_BY = {
+    'name': 'type, sort_key',
+    'date': 'type, added DESC',
+    'manual': 'position',
+}
+
+
+class SQLiteStorage:
+    """
+    Same public interface as JSONStorage, backed by an SQLite database.
+    Listings are a single indexed query and mutations touch single rows,
+    so nothing ever rewrites the whole library.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        started = time.perf_counter()
+        if not os.path.exists(DATA_PATH):
+            os.makedirs(DATA_PATH)
+        self.db_path = db_path
+        # Other processes (context menu, service) may hold the write lock briefly
+        self.db = sqlite3.connect(db_path, timeout=30)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(nodes)")}
+        if columns and 'url_key' not in columns:
+            self.db.execute("ALTER TABLE nodes ADD COLUMN url_key TEXT")
+        self.db.executescript(SCHEMA)
+        self._tx_depth = 0
+        self.search_urls = xbmcaddon.Addon().getSetting('search_urls') == 'true'
+        if self.db.execute("SELECT 1 FROM nodes WHERE id = 'root'").fetchone() is None:
+            self._migrate()
+        if self._get_meta('search_index') != self._search_signature():
+            self._rebuild_search_index()
+        if self._get_meta('url_keys') != URL_KEY_VERSION:
+            self._rebuild_url_keys()
+        if self._get_meta('folder_stats') != STATS_VERSION:
+            self._rebuild_folder_stats()
+        self._usage = UsageStats()
+        self._usage.note_load(time.perf_counter() - started)
+        if self._usage.due():
+            self._save_usage()
+
+    def _get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _search_signature(self):
+        return f"{INDEX_VERSION}:{int(self.search_urls)}"
+
+    def _rebuild_search_index(self):
+        """Refill the tokens table, e.g. after turning URL search on or off."""
+        rows = self.db.execute("SELECT id, name, url FROM nodes WHERE id != 'root'")
+        with self.db:
+            self.db.execute("DELETE FROM tokens")
+            self.db.executemany(
+                "INSERT INTO tokens VALUES (?, ?)",
+                ((token, node_id) for node_id, name, url in rows.fetchall()
+                 for token in node_tokens({'name': name, 'url': url}, self.search_urls)))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('search_index', ?)", (self._search_signature(),))
+
+    def _rebuild_url_keys(self):
+        rows = self.db.execute("SELECT id, url FROM nodes WHERE type = 'item'").fetchall()
+        with self.db:
+            self.db.executemany("UPDATE nodes SET url_key = ? WHERE id = ?",
+                                ((url_fingerprint(url or ''), node_id) for node_id, url in rows))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('url_keys', ?)", (URL_KEY_VERSION,))
+
+    def _compute_folder_stats(self):
+        """Aggregates of every folder computed from the nodes table: {id: [items, folders, totals..., modified]}."""
+        children = {}
+        stats = {}
+        for node_id, parent_id, node_type, added in self.db.execute("SELECT id, parent_id, type, added FROM nodes"):
+            children.setdefault(parent_id, []).append((node_id, node_type, added))
+            if node_type == 'folder':
+                stats[node_id] = [0, 0, 0, 0, added]
+        order = []
+        stack = ['root']
+        while stack:
+            folder_id = stack.pop()
+            order.append(folder_id)
+            stack.extend(node_id for node_id, node_type, _ in children.get(folder_id, ()) if node_type == 'folder')
+        # Reversed pre-order: every folder comes after its subfolders
+        for folder_id in reversed(order):
+            folder_stats = stats[folder_id]
+            for node_id, node_type, added in children.get(folder_id, ()):
+                if node_type == 'folder':
+                    child_stats = stats[node_id]
+                    folder_stats[1] += 1
+                    folder_stats[2] += child_stats[2]
+                    folder_stats[3] += child_stats[3] + 1
+                    folder_stats[4] = max(folder_stats[4], child_stats[4])
+                else:
+                    folder_stats[0] += 1
+                    folder_stats[2] += 1
+                    folder_stats[4] = max(folder_stats[4], added)
+        return {folder_id: stats[folder_id] for folder_id in order}
+
+    def _rebuild_folder_stats(self):
+        stats = self._compute_folder_stats()
+        with self.db:
+            self.db.execute("DELETE FROM folder_stats")
+            self.db.executemany("INSERT INTO folder_stats VALUES (?, ?, ?, ?, ?, ?)",
+                                ((folder_id, *values) for folder_id, values in stats.items()))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('folder_stats', ?)", (STATS_VERSION,))
+
+    def _bump_stats(self, folder_id, items=0, folders=0, total_items=0, total_folders=0):
+        """Apply count changes to a folder and its ancestors' totals, and mark them modified now."""
+        if items or folders:
+            self.db.execute("UPDATE folder_stats SET items = items + ?, folders = folders + ? WHERE folder_id = ?",
+                            (items, folders, folder_id))
+        self.db.execute(
+            "UPDATE folder_stats SET total_items = total_items + ?, total_folders = total_folders + ?,"
+            f" modified = MAX(modified, ?) WHERE folder_id IN ({_ANCESTORS})",
+            (total_items, total_folders, int(time.time()), folder_id))
+
+    def _subtree_counts(self, node_id, node_type):
+        """(items, folders) in a node's subtree, the node included."""
+        if node_type != 'folder':
+            return 1, 0
+        row = self.db.execute("SELECT total_items, total_folders FROM folder_stats WHERE folder_id = ?",
+                              (node_id,)).fetchone()
+        return row[0], row[1] + 1
+
+    def _index_tokens(self, node_id, name, url):
+        self.db.execute("DELETE FROM tokens WHERE node_id = ?", (node_id,))
+        self.db.executemany(
+            "INSERT INTO tokens VALUES (?, ?)",
+            ((token, node_id) for token in node_tokens({'name': name, 'url': url}, self.search_urls)))
+
+    def _migrate(self):
+        """
+        One-shot import of an existing favorites.json, plus the journal
+        records not yet folded into it. The parsed tree is walked without
+        building a JSONStorage (no indexes, observers or side files), each
+        folder's children dropped once their rows are out, and rows go in
+        MIGRATE_BATCH at a time. Search tokens and folder aggregates are
+        then computed from the rows.
+        """
+        had_json = os.path.exists(FILE_PATH)
+        root = {"id": "root", "name": "Root", "type": "folder", "children": []}
+        if had_json:
+            try:
+                root = read_tree(FILE_PATH)
+            except (OSError, ValueError) as e:
+                # Left where it is: JSON mode, or a later look, may still recover it
+                xbmc.log(f"[MisFavoritos] Could not read {FILE_PATH}, starting empty: {e}", level=xbmc.LOGERROR)
+                had_json = False
+        generation = root.get('generation', 0)
+        rows = self._subtree_rows(root, None, 0)
+        root = None
+        with self.db:
+            for batch in iter(lambda: list(itertools.islice(rows, MIGRATE_BATCH)), []):
+                self.db.executemany(_INSERT, batch)
+            if os.path.exists(JOURNAL_PATH):
+                for _, record in journal_records(JOURNAL_PATH):
+                    if record.get('gen', 0) > generation:
+                        self._replay(record)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_from', ?)",
+                            (FILE_PATH if had_json else '',))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('url_keys', ?)", (URL_KEY_VERSION,))
+        if had_json:
+            xbmc.log(f"[MisFavoritos] Migrated {FILE_PATH} to {DB_PATH}", level=xbmc.LOGINFO)
+
+    @staticmethod
+    def _subtree_rows(top, parent_id, position):
+        """
+        Rows for a JSON node and everything below it, parents first. Each
+        folder's children list is removed from the tree as it is read.
+        """
+        def row(node, parent_id, position):
+            return (node['id'], parent_id, node['type'], node['name'], node.get('url'), node.get('thumbnail'),
+                    position, collation_key(node['name']), node.get('added', 0), node.get('order', 'name'),
+                    url_fingerprint(node.get('url') or '') if node['type'] == 'item' else None)
+
+        yield row(top, parent_id, position)
+        stack = [top] if top['type'] == 'folder' else []
+        while stack:
+            parent = stack.pop()
+            for position, child in enumerate(parent.pop('children', ())):
+                yield row(child, parent['id'], position)
+                if child['type'] == 'folder':
+                    stack.append(child)
+
+    def _replay(self, record):
+        """
+        Apply one JSON journal record to the rows, during migration: no
+        tokens or aggregates, those are rebuilt afterwards.
+        """
+        op = record['op']
+        if op == 'add':
+            node = record['node']
+            if self._is_type(record['parent'], 'folder') and self.get_node(node['id']) is None:
+                self.db.executemany(_INSERT, self._subtree_rows(node, record['parent'],
+                                                                self._next_position(record['parent'])))
+        elif op in ('rename', 'update'):
+            fields = {'name': record['name']} if op == 'rename' else dict(record['fields'])
+            if 'name' in fields:
+                fields['sort_key'] = collation_key(fields['name'])
+            if 'url' in fields:
+                fields['url_key'] = url_fingerprint(fields['url'] or '')
+            fields = {column: value for column, value in fields.items()
+                      if column in ('name', 'sort_key', 'url', 'url_key', 'thumbnail')}
+            if fields:
+                assignments = ', '.join(f"{column} = ?" for column in fields)
+                self.db.execute(f"UPDATE nodes SET {assignments} WHERE id = ?", (*fields.values(), record['id']))
+        elif op == 'order':
+            if record['order'] in FOLDER_ORDERS:
+                self.db.execute("UPDATE nodes SET sort_order = ? WHERE id = ? AND type = 'folder'",
+                                (record['order'], record['id']))
+        elif op in ('delete', 'delete_many'):
+            for node_id in record.get('ids') or [record['id']]:
+                if node_id != 'root':
+                    self.db.execute(
+                        "WITH RECURSIVE subtree(id) AS ("
+                        " SELECT ? UNION ALL SELECT n.id FROM nodes n JOIN subtree s ON n.parent_id = s.id"
+                        ") DELETE FROM nodes WHERE id IN subtree", (node_id,))
+        elif op in ('move', 'move_many'):
+            parent_id = record['parent']
+            if not self._is_type(parent_id, 'folder'):
+                return
+            for node_id in record.get('ids') or [record['id']]:
+                if node_id != 'root' and self.get_node(node_id) is not None and not self._inside(node_id, parent_id):
+                    self.db.execute("UPDATE nodes SET parent_id = ?, position = ? WHERE id = ?",
+                                    (parent_id, self._next_position(parent_id), node_id))
+
+    @staticmethod
+    def _to_node(row):
+        node = {"id": row[0], "name": row[3], "type": row[2]}
+        if row[2] == 'item':
+            node['url'] = row[4] or ''
+            node['thumbnail'] = row[5] or ''
+        return node
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group several mutations into a single database transaction.
+        Everything is rolled back if the block raises.
+        """
+        self._tx_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                self.db.rollback()
+            raise
+        self._tx_depth -= 1
+        if self._tx_depth == 0:
+            self._persist()
+
+    def _changed(self):
+        if not self._tx_depth:
+            self._persist()
+
+    def _persist(self):
+        with phase('persist'):
+            self.db.commit()
+            # Pages written aren't known cheaply: commits are counted, not bytes
+            self._usage.note_write('saves')
+            self._save_usage()
+
+    def rebuild(self):
+        """
+        Recompute the search tokens, URL keys and folder aggregates from
+        the nodes, then compact the database file. Returns True.
+        """
+        self.db.commit()
+        self._rebuild_search_index()
+        self._rebuild_url_keys()
+        self._rebuild_folder_stats()
+        self.db.execute("VACUUM")
+        self.db.execute("ANALYZE")
+        self._persist()
+        return True
+
+    def _save_usage(self):
+        """Add this instance's counters to the usage stats, with the library's current size."""
+        root = self.get_folder_stats(['root']).get('root', {})
+        try:
+            size = os.path.getsize(self.db_path)
+        except OSError:
+            size = 0
+        self._usage.note_library(root.get('total_items', 0), root.get('total_folders', 0), size)
+        self._usage.merge()
+
+    def save(self):
+        """Rows are written as they change; only pending work needs committing."""
+        self._persist()
+
+    def get_node(self, node_id):
+        """Returns the node with the given id, or None."""
+        row = self.db.execute(f"SELECT {_COLUMNS} FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        return self._to_node(row) if row else None
+
+    def get_parent(self, node_id):
+        """Returns the folder containing the given node, or None for root/unknown ids."""
+        row = self.db.execute(
+            "SELECT p.id, p.parent_id, p.type, p.name, p.url, p.thumbnail "
+            "FROM nodes n JOIN nodes p ON p.id = n.parent_id WHERE n.id = ?", (node_id,)).fetchone()
+        return self._to_node(row) if row else None
+
+    def get_path(self, node_id):
+        """Names of the folders above a node, from the top, without root."""
+        names = []
+        row = self.db.execute("SELECT parent_id FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        parent_id = row[0] if row else None
+        while parent_id and parent_id != 'root':
+            parent_id, name = self.db.execute(
+                "SELECT parent_id, name FROM nodes WHERE id = ?", (parent_id,)).fetchone()
+            names.append(name)
+        names.reverse()
+        return names
+
+    def search(self, query, limit=200):
+        """
+        Returns up to limit (node, path) pairs whose name (or URL, if
+        enabled) has words starting with every word of query.
+        Each word is one range scan on the tokens index.
+        """
+        words = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not words:
+            return []
+        match = ' AND '.join(["id IN (SELECT node_id FROM tokens WHERE token >= ? AND token < ?)"] * len(words))
+        args = [bound for word in words for bound in (word, word + '\U0010ffff')]
+        rows = self.db.execute(
+            f"SELECT {_COLUMNS} FROM nodes WHERE {match} ORDER BY type != 'folder', sort_key LIMIT ?",
+            (*args, limit))
+        return [(self._to_node(row), self.get_path(row[0])) for row in rows.fetchall()]
+
+    def find_item_by_url(self, url):
+        """
+        Returns the stored item with the same url_fingerprint(), the
+        oldest one if there are several, or None.
+        """
+        row = self.db.execute(
+            f"SELECT {_COLUMNS} FROM nodes WHERE url_key = ? AND type = 'item' ORDER BY added, id LIMIT 1",
+            (url_fingerprint(url),)).fetchone()
+        return self._to_node(row) if row else None
+
+    def find_duplicates(self):
+        """Ids of every item whose URL an older item already has."""
+        rows = self.db.execute(
+            "SELECT id, url_key FROM nodes WHERE type = 'item' AND url_key IN ("
+            " SELECT url_key FROM nodes WHERE type = 'item' GROUP BY url_key HAVING COUNT(*) > 1"
+            ") ORDER BY url_key, added, id")
+        duplicates = []
+        previous = None
+        for node_id, url_key in rows:
+            if url_key == previous:
+                duplicates.append(node_id)
+            previous = url_key
+        return duplicates
+
+    def get_folder_contents(self, folder_id):
+        """
+        Returns the children list of a folder, in display order.
+        """
+        return self.get_folder_page(folder_id)[0]
+
+    def get_folder_page(self, folder_id, start=0, count=None):
+        """
+        Returns (entries, total) for a folder in display order.
+        Each ordering is read straight from an index, so nothing is sorted.
+        """
+        total = self.db.execute("SELECT COUNT(*) FROM nodes WHERE parent_id = ?", (folder_id,)).fetchone()[0]
+        order_by = _ORDER_BY[self.get_folder_order(folder_id)]
+        rows = self.db.execute(
+            f"SELECT {_COLUMNS} FROM nodes WHERE parent_id = ? ORDER BY {order_by} LIMIT ? OFFSET ?",
+            (folder_id, -1 if count is None else count, start))
+        return [self._to_node(row) for row in rows], total
+
+    def get_folder_order(self, folder_id):
+        """Returns the folder's ordering, one of FOLDER_ORDERS."""
+        row = self.db.execute("SELECT sort_order FROM nodes WHERE id = ?", (folder_id,)).fetchone()
+        return row[0] if row and row[0] in _ORDER_BY else 'name'
+
+    def set_folder_order(self, folder_id, order):
+        """Change how a folder's children are ordered."""
+        if order not in FOLDER_ORDERS or not self._is_type(folder_id, 'folder'):
+            return False
+        self.db.execute("UPDATE nodes SET sort_order = ? WHERE id = ?", (order, folder_id))
+        self._bump_stats(folder_id)
+        self._changed()
+        return True
+
+    def get_folder_outline(self):
+        """
+        Returns every folder in display order: [(id, name, depth, path)],
+        path being the folder names below Root. Only folder rows are read.
+        """
+        children = {}
+        names = {}
+        orders = {}
+        keys = {}
+        rows = self.db.execute(
+            "SELECT id, parent_id, name, sort_order, sort_key, added FROM nodes WHERE type = 'folder' ORDER BY position")
+        for folder_id, parent_id, name, order, sort_key, added in rows:
+            names[folder_id] = name
+            orders[folder_id] = order
+            keys[folder_id] = (sort_key, -added)
+            children.setdefault(parent_id, []).append(folder_id)
+        # Each folder's subfolders as get_folder_page lists them; 'manual' keeps the positions
+        for parent_id, child_ids in children.items():
+            order = orders.get(parent_id, 'name')
+            if order == 'name':
+                child_ids.sort(key=lambda folder_id: keys[folder_id][0])
+            elif order == 'date':
+                child_ids.sort(key=lambda folder_id: keys[folder_id][1])
+
+        folders = []
+        stack = [('root', 0, ())]
+        while stack:
+            folder_id, depth, path = stack.pop()
+            folders.append((folder_id, names[folder_id], depth, path))
+            for child_id in reversed(children.get(folder_id, [])):
+                stack.append((child_id, depth + 1, path + (names[child_id],)))
+        return folders
+
+    def get_all_folders_flat(self):
+        """
+        Returns a flat list of all folders: [(id, name, depth)]
+        """
+        return [(folder_id, name, depth) for folder_id, name, depth, _ in self.get_folder_outline()]
+
+    def get_folder_stats(self, folder_ids):
+        """
+        Aggregates for the given folders: {id: {'items', 'folders',
+        'total_items', 'total_folders', 'modified'}}. items/folders count
+        direct children, the totals count everything below; modified is
+        the last change anywhere below (epoch seconds).
+        """
+        folder_ids = list(folder_ids)
+        result = {}
+        # Stay under SQLite's limit on bound parameters
+        for start in range(0, len(folder_ids), 500):
+            chunk = folder_ids[start:start + 500]
+            rows = self.db.execute(
+                f"SELECT folder_id, {', '.join(STAT_FIELDS)} FROM folder_stats"
+                f" WHERE folder_id IN ({', '.join('?' * len(chunk))})", chunk)
+            for row in rows:
+                result[row[0]] = dict(zip(STAT_FIELDS, row[1:]))
+        return result
+
+    def check_folder_stats(self):
+        """Recompute every folder's aggregates from scratch; returns the ids that disagree."""
+        maintained = {row[0]: dict(zip(STAT_FIELDS, row[1:])) for row in self.db.execute(
+            f"SELECT folder_id, {', '.join(STAT_FIELDS)} FROM folder_stats")}
+        fresh = {folder_id: dict(zip(STAT_FIELDS, values)) for folder_id, values in self._compute_folder_stats().items()}
+        return compare_folder_stats(maintained, fresh)
+
+    def _is_type(self, node_id, node_type):
+        row = self.db.execute("SELECT type FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        return row is not None and row[0] == node_type
+
+    def _next_position(self, parent_id):
+        row = self.db.execute(
+            "SELECT MAX(position) FROM nodes WHERE parent_id = ?", (parent_id,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def _insert(self, parent_id, node_type, name, url=None, thumbnail=None, order='name'):
+        """Insert a node; returns its new id, or None if parent_id is not a folder."""
+        if not self._is_type(parent_id, 'folder'):
+            return None
+        node_id = str(uuid.uuid4())
+        self.db.execute(
+            _INSERT,
+            (node_id, parent_id, node_type, name, url, thumbnail,
+             self._next_position(parent_id), collation_key(name), int(time.time()), order,
+             url_fingerprint(url or '') if node_type == 'item' else None))
+        self._index_tokens(node_id, name, url)
+        if node_type == 'folder':
+            self.db.execute("INSERT INTO folder_stats (folder_id, modified) VALUES (?, ?)", (node_id, int(time.time())))
+            self._bump_stats(parent_id, folders=1, total_folders=1)
+        else:
+            self._bump_stats(parent_id, items=1, total_items=1)
+        self._changed()
+        return node_id
+
+    def add_folder(self, parent_id, name):
+        return self._insert(parent_id, 'folder', name) is not None
+
+    def add_item(self, parent_id, name, url, thumbnail):
+        return self._insert(parent_id, 'item', name, url, thumbnail) is not None
+
+    def _rename(self, node_id, node_type, new_name):
+        row = self.db.execute("SELECT url, parent_id FROM nodes WHERE id = ? AND type = ?",
+                              (node_id, node_type)).fetchone()
+        if row is None:
+            return False
+        self.db.execute(
+            "UPDATE nodes SET name = ?, sort_key = ? WHERE id = ?",
+            (new_name, collation_key(new_name), node_id))
+        self._index_tokens(node_id, new_name, row[0])
+        if row[1] is not None:
+            self._bump_stats(row[1])
+        self._changed()
+        return True
+
+    def rename_folder(self, folder_id, new_name):
+        """Rename a folder."""
+        return self._rename(folder_id, 'folder', new_name)
+
+    def rename_item(self, item_id, new_name):
+        """Rename an item."""
+        return self._rename(item_id, 'item', new_name)
+
+    def _delete(self, node_id):
+        row = self.db.execute("SELECT parent_id, type FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        if node_id == 'root' or row is None:
+            return False
+        parent_id, node_type = row
+        items, folders = self._subtree_counts(node_id, node_type)
+        ids = [(row[0],) for row in self.db.execute(
+            "WITH RECURSIVE subtree(id) AS ("
+            " SELECT ? UNION ALL SELECT n.id FROM nodes n JOIN subtree s ON n.parent_id = s.id"
+            ") SELECT id FROM subtree", (node_id,))]
+        self.db.executemany("DELETE FROM tokens WHERE node_id = ?", ids)
+        self.db.executemany("DELETE FROM folder_stats WHERE folder_id = ?", ids)
+        self.db.executemany("DELETE FROM nodes WHERE id = ?", ids)
+        is_folder = node_type == 'folder'
+        self._bump_stats(parent_id, -(not is_folder), -is_folder, -items, -folders)
+        self._changed()
+        return True
+
+    def delete_folder(self, folder_id):
+        """Delete a folder and everything inside it."""
+        if folder_id == 'root':
+            return False  # Cannot delete root
+        return self._delete(folder_id)
+
+    def delete_item(self, item_id):
+        """Delete an item."""
+        return self._delete(item_id)
+
+    def delete_nodes(self, node_ids):
+        """Delete several items and/or folders as a single change."""
+        deleted = False
+        with self.transaction():
+            for node_id in node_ids:
+                deleted = self._delete(node_id) or deleted
+        return deleted
+
+    def move_item(self, item_id, new_parent_id):
+        """Move an item to a different folder."""
+        row = self.db.execute("SELECT parent_id, type FROM nodes WHERE id = ?", (item_id,)).fetchone()
+        if item_id == 'root' or row is None or not self._is_type(new_parent_id, 'folder'):
+            return False
+        old_parent_id, node_type = row
+        if node_type == 'folder' and self._inside(item_id, new_parent_id):
+            return False  # Would detach the folder into a cycle of its own
+        items, folders = self._subtree_counts(item_id, node_type)
+        is_folder = node_type == 'folder'
+        self._bump_stats(old_parent_id, -(not is_folder), -is_folder, -items, -folders)
+        self.db.execute("UPDATE nodes SET parent_id = ?, position = ? WHERE id = ?",
+                        (new_parent_id, self._next_position(new_parent_id), item_id))
+        self._bump_stats(new_parent_id, int(not is_folder), int(is_folder), items, folders)
+        self._changed()
+        return True
+
+    def _inside(self, node_id, folder_id):
+        """True if folder_id is node_id or lies somewhere below it; walks up from folder_id, O(depth)."""
+        return self.db.execute(f"SELECT 1 FROM ({_ANCESTORS}) WHERE id = ?", (folder_id, node_id)).fetchone() is not None
+
+    def move_folder(self, folder_id, new_parent_id):
+        """
+        Move a folder, with everything in it, into another folder.
+        Refused if the target is the folder itself or lies inside it.
+        """
+        if not self._is_type(folder_id, 'folder'):
+            return False
+        return self.move_item(folder_id, new_parent_id)
+
+    def move_nodes(self, node_ids, new_parent_id):
+        """
+        Move several items and/or folders into one folder as a single
+        change. Folders that would end up inside themselves are skipped.
+        Returns how many were moved.
+        """
+        moved = 0
+        with self.transaction():
+            for node_id in dict.fromkeys(node_ids):
+                row = self.db.execute("SELECT parent_id FROM nodes WHERE id = ?", (node_id,)).fetchone()
+                if row is not None and row[0] != new_parent_id:
+                    moved += self.move_item(node_id, new_parent_id)
+        return moved
+
+    def copy_nodes(self, node_ids, parent_id):
+        """Copy items and/or whole folders into a folder, with new ids. Returns how many were copied."""
+        if not self._is_type(parent_id, 'folder'):
+            return 0
+        copied = 0
+        with self.transaction():
+            for node_id in node_ids:
+                if node_id == 'root':
+                    continue
+                # Read the subtree first, so copying a folder into itself terminates
+                rows = self.db.execute(
+                    "WITH RECURSIVE subtree(id, depth) AS ("
+                    " SELECT ?, 0 UNION ALL SELECT n.id, s.depth + 1 FROM nodes n JOIN subtree s ON n.parent_id = s.id"
+                    f") SELECT {_COLUMNS}, sort_order FROM nodes JOIN subtree USING (id) ORDER BY depth, position",
+                    (node_id,)).fetchall()
+                new_ids = {}
+                for row in rows:
+                    new_parent = parent_id if row[0] == node_id else new_ids[row[1]]
+                    new_ids[row[0]] = self._insert(new_parent, row[2], row[3], row[4], row[5], row[6])
+                copied += bool(rows)
+        return copied
+
+    def rename_nodes(self, node_ids, pattern):
+        """
+        Rename several nodes from a pattern such as '{n:02d} - {name}':
+        {name} is the current name, {n} the position in node_ids from 1.
+        Raises ValueError for a malformed pattern. Returns how many were renamed.
+        """
+        renamed = 0
+        with self.transaction():
+            for n, node_id in enumerate(node_ids, 1):
+                row = self.db.execute("SELECT name, type FROM nodes WHERE id = ?", (node_id,)).fetchone()
+                if row is None or node_id == 'root':
+                    continue
+                try:
+                    name = pattern.format(name=row[0], n=n)
+                except (KeyError, IndexError, AttributeError) as e:
+                    raise ValueError(f"Bad rename pattern {pattern!r}: {e}") from e
+                if name:
+                    renamed += self._rename(node_id, row[1], name)
+        return renamed
+
+    def update_item(self, item_id, name=None, url=None, thumbnail=None):
+        """Update item properties."""
+        if not self._is_type(item_id, 'item'):
+            return False
+        fields = {}
+        if name:
+            fields['name'] = name
+            fields['sort_key'] = collation_key(name)
+        if url:
+            fields['url'] = url
+            fields['url_key'] = url_fingerprint(url)
+        if thumbnail is not None:
+            fields['thumbnail'] = thumbnail
+        if fields:
+            assignments = ', '.join(f"{column} = ?" for column in fields)
+            self.db.execute(f"UPDATE nodes SET {assignments} WHERE id = ?", (*fields.values(), item_id))
+            if name or url:
+                row = self.db.execute("SELECT name, url FROM nodes WHERE id = ?", (item_id,)).fetchone()
+                self._index_tokens(item_id, row[0], row[1])
+            parent_id = self.db.execute("SELECT parent_id FROM nodes WHERE id = ?", (item_id,)).fetchone()[0]
+            self._bump_stats(parent_id)
+            self._changed()
+        return True
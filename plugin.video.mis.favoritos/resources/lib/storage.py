@@ -1,191 +1,1683 @@
+import contextlib
+import heapq
 import json
+import marshal
 import os
+import re
+import sys
+import threading
+import time
+import unicodedata
 import uuid
 import xbmc
+import xbmcaddon
 import xbmcvfs
 
+from resources.lib.profiling import phase
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 DATA_PATH = xbmcvfs.translatePath('special://profile/addon_data/plugin.video.mis.favoritos')
 FILE_PATH = os.path.join(DATA_PATH, 'favorites.json')
+JOURNAL_PATH = os.path.join(DATA_PATH, 'favorites.journal')
+CACHE_PATH = os.path.join(DATA_PATH, 'favorites.cache')
+SEARCH_PATH = os.path.join(DATA_PATH, 'search.index')
+SEARCH_LOG_PATH = os.path.join(DATA_PATH, 'search.log')
+LOCK_PATH = os.path.join(DATA_PATH, 'favorites.lock')
+OUTLINE_PATH = os.path.join(DATA_PATH, 'folders.outline')
+USAGE_PATH = os.path.join(DATA_PATH, 'storage.stats')
+
+# Bump whenever the layout of the cached tree (or of the indexes saved with it) changes
+CACHE_VERSION = 2
+
+# Search log size past which a search folds it into the saved index,
+# and past which an unused index is dropped instead of kept current
+SEARCH_LOG_MAX_RECORDS = 1000
+SEARCH_LOG_MAX_BYTES = 1024 * 1024
+
+# Fold the journal into a fresh snapshot once it grows past either limit
+JOURNAL_MAX_RECORDS = 500
+JOURNAL_MAX_BYTES = 512 * 1024
+
+# Days of bytes-written history kept in the usage stats; a process that
+# only reads logs its load time at most every USAGE_SAMPLE_SECONDS, and
+# the log is folded into the stats file past USAGE_LOG_MAX_BYTES
+USAGE_DAYS = 30
+USAGE_SAMPLE_SECONDS = 3600
+USAGE_LOG_MAX_BYTES = 64 * 1024
+
+_WS = re.compile(r'[ \t\n\r]*')
+
+
+def _dumps_deep(tree):
+    """
+    Serialize a tree without recursion.
+    Only used when the tree is too deep for the json module.
+    """
+    out = []
+    work = [(False, tree)]
+    while work:
+        raw, obj = work.pop()
+        if raw:
+            out.append(obj)
+        elif isinstance(obj, dict):
+            out.append('{')
+            work.append((True, '}'))
+            entries = list(obj.items())
+            for i in range(len(entries) - 1, -1, -1):
+                key, value = entries[i]
+                work.append((False, value))
+                sep = '' if i == 0 else ', '
+                work.append((True, f'{sep}{json.dumps(str(key), ensure_ascii=False)}: '))
+        elif isinstance(obj, list):
+            out.append('[')
+            work.append((True, ']'))
+            for i in range(len(obj) - 1, -1, -1):
+                work.append((False, obj[i]))
+                if i > 0:
+                    work.append((True, ', '))
+        else:
+            out.append(json.dumps(obj, ensure_ascii=False))
+    return ''.join(out)
+
+
+def _loads_deep(text):
+    """
+    Parse JSON without recursion.
+    Only used when the file is too deep for the json module.
+    """
+    decoder = json.JSONDecoder()
+    scanstring = json.decoder.scanstring
+    stack = []  # (container, key under which it goes in its parent)
+    key = None
+    idx = _WS.match(text, 0).end()
+    while True:
+        # Parse one value at idx
+        ch = text[idx]
+        if ch == '{' or ch == '[':
+            value = {} if ch == '{' else []
+            idx = _WS.match(text, idx + 1).end()
+            if text[idx] != ('}' if ch == '{' else ']'):
+                stack.append((value, key))
+                if ch == '{':
+                    key, idx = scanstring(text, idx + 1)
+                    idx = _WS.match(text, idx).end() + 1  # skip ':'
+                    idx = _WS.match(text, idx).end()
+                continue
+            idx += 1
+        else:
+            value, idx = decoder.raw_decode(text, idx)
+
+        # Attach it to its container, closing containers as needed
+        while True:
+            if not stack:
+                return value
+            container, parent_key = stack[-1]
+            if isinstance(container, dict):
+                container[key] = value
+            else:
+                container.append(value)
+            idx = _WS.match(text, idx).end()
+            if text[idx] == ',':
+                idx = _WS.match(text, idx + 1).end()
+                if isinstance(container, dict):
+                    key, idx = scanstring(text, idx + 1)
+                    idx = _WS.match(text, idx).end() + 1  # skip ':'
+                    idx = _WS.match(text, idx).end()
+                break
+            # Closing bracket
+            idx += 1
+            stack.pop()
+            value, key = container, parent_key
+
+
+def _dump_record(record):
+    """One journal line; records carrying a very deep subtree (a copied folder) go through _dumps_deep."""
+    try:
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+    except RecursionError:
+        return _dumps_deep(record)
+
+
+def _load_record(line):
+    try:
+        return json.loads(line)
+    except RecursionError:
+        return _loads_deep(line.decode('utf-8') if isinstance(line, bytes) else line)
+
+
+def read_tree(path):
+    """Parse a library file; trees too deep for the json module go through _loads_deep."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        return json.loads(text)
+    except RecursionError:
+        return _loads_deep(text)
+
+
+def journal_records(path):
+    """
+    (line, record) for each complete journal line, in order. Stops at a
+    torn or corrupt tail (e.g. power loss mid-write).
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            try:
+                record = _load_record(line)
+            except ValueError:
+                return
+            yield line, record
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Exclusive lock shared with every other process, held for the block."""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    # Gives up after ~10 s of retries; keep waiting
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Per-folder orderings: by name (default), newest first, or as placed
+FOLDER_ORDERS = ('name', 'date', 'manual')
+
+
+def fold_text(text):
+    """Case- and accent-folded text, e.g. 'Ñandú' -> 'nandu'."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def collation_key(name):
+    """
+    Accent- and case-insensitive sort key for a name.
+    'ñ' keeps sorting after 'n', as in Spanish.
+    """
+    return fold_text(unicodedata.normalize('NFC', name).casefold().replace('ñ', 'n\U0010ffff'))
+
+
+class StorageObserver:
+    """
+    Base for structures derived from the tree (indexes, caches) that
+    JSONStorage keeps current on every applied mutation.
+    Subtree events are sent once, for the subtree's top node.
+    """
+
+    def node_added(self, node, parent):
+        pass
+
+    def node_removed(self, node, parent):
+        pass
+
+    def node_changed(self, node):
+        pass
+
+    def node_moved(self, node, old_parent, new_parent):
+        pass
+
+    def children_reordered(self, folder):
+        pass
+
+
+class FolderOutline(StorageObserver):
+    """
+    Folder-only view of the tree: each folder's subfolders in display
+    order. Kept current as folders are added, renamed, moved, deleted or
+    reordered, so folder pickers never walk the items; a change only
+    rescans the children of the folders involved.
+    """
+
+    def __init__(self, root, parents):
+        self.names = {}
+        self.subfolders = {}
+        self._parents = parents
+        self._flat = None
+        self.changed = False
+        self._scan(root)
+
+    def _scan(self, folder):
+        stack = [folder]
+        while stack:
+            folder = stack.pop()
+            self.names[folder['id']] = folder['name']
+            stack.extend(self._refresh(folder))
+
+    def _refresh(self, folder):
+        """Re-read folder's subfolders; returns them."""
+        subfolders = [c for c in folder.get('children', ()) if c.get('type') == 'folder']
+        if 'order' not in folder:
+            # Saved before orderings existed: shown by name, as get_folder_contents lists it
+            subfolders.sort(key=lambda c: collation_key(c['name']))
+        self.subfolders[folder['id']] = [c['id'] for c in subfolders]
+        self._flat = None
+        self.changed = True
+        return subfolders
+
+    def _drop(self, folder_id):
+        stack = [folder_id]
+        while stack:
+            folder_id = stack.pop()
+            self.names.pop(folder_id, None)
+            stack.extend(self.subfolders.pop(folder_id, ()))
+
+    def node_added(self, node, parent):
+        if node.get('type') == 'folder':
+            self._scan(node)
+            self._refresh(parent)
+
+    def node_removed(self, node, parent):
+        if node.get('type') == 'folder' and node['id'] in self.names:
+            self._drop(node['id'])
+            self._refresh(parent)
+
+    def node_changed(self, node):
+        if node.get('type') == 'folder' and self.names.get(node['id']) != node['name']:
+            self.names[node['id']] = node['name']
+            parent = self._parents.get(node['id'])
+            if parent is not None:
+                self._refresh(parent)
+            else:
+                self._flat = None
+                self.changed = True
+
+    def node_moved(self, node, old_parent, new_parent):
+        if node.get('type') == 'folder':
+            self._refresh(old_parent)
+            self._refresh(new_parent)
+
+    def children_reordered(self, folder):
+        self._refresh(folder)
+
+    def folders(self):
+        """[(id, name, depth, path)] in display order; path holds the names below Root."""
+        if self._flat is None:
+            flat = []
+            stack = [('root', 0, ())]
+            while stack:
+                folder_id, depth, path = stack.pop()
+                flat.append((folder_id, self.names[folder_id], depth, path))
+                for child_id in reversed(self.subfolders.get(folder_id, ())):
+                    stack.append((child_id, depth + 1, path + (self.names[child_id],)))
+            self._flat = flat
+        return self._flat
+
+
+STAT_FIELDS = ('items', 'folders', 'total_items', 'total_folders', 'modified')
+
+
+class FolderStats(StorageObserver):
+    """
+    Per-folder aggregates: direct items and subfolders, items and
+    subfolders at any depth, and when anything below last changed.
+    Built on first use, or taken from the copy saved with the cache;
+    after that each mutation updates just the path from the changed
+    folder up to Root, O(depth).
+    """
+
+    def __init__(self, root, parents, saved=None):
+        self._parents = parents
+        # folder id -> [items, folders, total_items, total_folders, modified]
+        self.stats = saved if saved is not None else {}
+        if saved is None:
+            self._build(root)
+
+    def _build(self, top):
+        order = []
+        stack = [top]
+        while stack:
+            folder = stack.pop()
+            order.append(folder)
+            stack.extend(c for c in folder.get('children', ()) if c.get('type') == 'folder')
+        # Reversed pre-order: every folder comes after its subfolders
+        for folder in reversed(order):
+            items = folders = total_items = total_folders = 0
+            modified = max(folder.get('added', 0), folder.get('modified', 0))
+            for child in folder.get('children', ()):
+                if child.get('type') == 'folder':
+                    child_stats = self.stats[child['id']]
+                    folders += 1
+                    total_items += child_stats[2]
+                    total_folders += child_stats[3] + 1
+                    modified = max(modified, child_stats[4])
+                else:
+                    items += 1
+                    total_items += 1
+                    modified = max(modified, child.get('added', 0))
+            self.stats[folder['id']] = [items, folders, total_items, total_folders, modified]
+
+    def _propagate(self, parent, node, sign):
+        """Count node's subtree in (sign 1) or out of (sign -1) parent and its ancestors."""
+        if node.get('type') == 'folder':
+            items, folders = self.stats[node['id']][2], self.stats[node['id']][3] + 1
+            self.stats[parent['id']][1] += sign
+        else:
+            items, folders = 1, 0
+            self.stats[parent['id']][0] += sign
+        self._touch(parent, sign * items, sign * folders, node.get('added', 0))
+
+    def _touch(self, folder, items=0, folders=0, modified=0):
+        modified = max(modified, folder.get('modified', 0))
+        while folder is not None:
+            stats = self.stats[folder['id']]
+            stats[2] += items
+            stats[3] += folders
+            if modified > stats[4]:
+                stats[4] = modified
+            folder = self._parents.get(folder['id'])
+
+    def node_added(self, node, parent):
+        if node.get('type') == 'folder':
+            self._build(node)
+        self._propagate(parent, node, 1)
+
+    def node_removed(self, node, parent):
+        self._propagate(parent, node, -1)
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if self.stats.pop(node['id'], None) is not None:
+                stack.extend(c for c in node.get('children', ()) if c.get('type') == 'folder')
+
+    def node_changed(self, node):
+        parent = self._parents.get(node['id'])
+        if parent is not None:
+            self._touch(parent)
+
+    def node_moved(self, node, old_parent, new_parent):
+        self._propagate(old_parent, node, -1)
+        self._propagate(new_parent, node, 1)
+
+    def children_reordered(self, folder):
+        self._touch(folder)
+
+    def get(self, folder_id):
+        stats = self.stats.get(folder_id)
+        return dict(zip(STAT_FIELDS, stats)) if stats is not None else None
+
+
+def compare_folder_stats(maintained, fresh):
+    """
+    Ids of folders whose maintained aggregates disagree with freshly
+    computed ones ({id: stats dict} each). Counts must match exactly;
+    the maintained last change may be later than the recomputed one,
+    which can only see the timestamps kept in the tree.
+    """
+    bad = []
+    for folder_id in maintained.keys() | fresh.keys():
+        a, b = maintained.get(folder_id), fresh.get(folder_id)
+        if a is None or b is None or a['modified'] < b['modified'] or \
+                any(a[field] != b[field] for field in STAT_FIELDS[:4]):
+            bad.append(folder_id)
+    return sorted(bad)
+
+
+def read_folder_outline():
+    """
+    The folder outline saved by JSONStorage, [(id, name, depth, path)],
+    read without loading the library. None if there is none yet.
+    """
+    try:
+        with open(OUTLINE_PATH, 'r', encoding='utf-8') as f:
+            return [(folder_id, name, depth, tuple(path)) for folder_id, name, depth, path in json.load(f)]
+    except (OSError, ValueError):
+        return None
+
+
+USAGE_COUNTERS = ('saves', 'journal_appends', 'compactions', 'bytes_written', 'loads', 'load_seconds')
+
+
+def _add_usage(stats, entry):
+    """Fold one entry of the usage log into stats."""
+    for counter in USAGE_COUNTERS:
+        stats[counter] += entry.get(counter, 0)
+    for day, size in entry.get('days', {}).items():
+        stats['days'][day] = stats['days'].get(day, 0) + size
+    stats['load_max_seconds'] = max(stats['load_max_seconds'], entry.get('load_max_seconds', 0.0))
+    for key in ('last_load_seconds', 'library'):
+        if entry.get(key) is not None:
+            stats[key] = entry[key]
+    stats['updated'] = entry['time']
+    stats['since'] = stats['since'] or entry['time']
+
+
+def read_usage_stats(path=USAGE_PATH):
+    """The usage stats saved next to the library, with zeros for anything missing."""
+    # Entries not folded in yet, including those of a fold that was interrupted
+    return _read_usage(path, (path + '.log.fold', path + '.log'))
+
+
+def _read_usage(path, log_paths):
+    stats = dict.fromkeys(USAGE_COUNTERS, 0)
+    stats.update(days={}, load_max_seconds=0.0, last_load_seconds=None, library=None, since=None, updated=None)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stats.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    for log_path in log_paths:
+        try:
+            with open(log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        _add_usage(stats, json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        pass  # Torn by a crash mid-append
+        except OSError:
+            pass
+    stats['days'] = dict(sorted(stats['days'].items())[-USAGE_DAYS:])
+    return stats
+
+
+class UsageStats:
+    """
+    Running counters for the diagnostics view: saves, bytes written (in
+    total and per day), load times and the library's size as of the last
+    write. Counted in memory, then appended as one short line to a log
+    next to the stats file when the backend persists; the log is folded
+    into the file once it grows past USAGE_LOG_MAX_BYTES.
+    """
+
+    def __init__(self, path=USAGE_PATH):
+        self.path = path
+        self.log_path = path + '.log'
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._counts = {}
+        self._days = {}
+        self._load_max = 0.0
+        self._last_load = None
+        self._library = None
+
+    def _add(self, counter, value):
+        self._counts[counter] = self._counts.get(counter, 0) + value
+
+    def note_load(self, seconds):
+        with self._lock:
+            self._add('loads', 1)
+            self._add('load_seconds', seconds)
+            self._load_max = max(self._load_max, seconds)
+            self._last_load = seconds
+
+    def note_write(self, counter, size=0):
+        """Count a write of the given kind ('saves', 'journal_appends' or 'compactions') of size bytes."""
+        with self._lock:
+            self._add(counter, 1)
+            if size:
+                self._add('bytes_written', size)
+                day = time.strftime('%Y-%m-%d')
+                self._days[day] = self._days.get(day, 0) + size
+
+    def note_library(self, items, folders, size):
+        self._library = {'items': items, 'folders': folders, 'bytes': size}
+
+    def due(self):
+        """
+        True if nothing was logged for USAGE_SAMPLE_SECONDS: time a reader
+        logged its load time. Never before the first write started the log.
+        """
+        for path in (self.log_path, self.path):
+            try:
+                return time.time() - os.path.getmtime(path) >= USAGE_SAMPLE_SECONDS
+            except OSError:
+                pass
+        return False
+
+    def merge(self):
+        """Log what was counted so far and start counting afresh. Failures are harmless."""
+        with self._lock:
+            if not self._counts and self._library is None:
+                return
+            entry = dict(self._counts, time=int(time.time()))
+            if self._days:
+                entry['days'] = self._days
+            if self._last_load is not None:
+                entry.update(load_max_seconds=self._load_max, last_load_seconds=self._last_load)
+            if self._library is not None:
+                entry['library'] = self._library
+            self._reset()
+            try:
+                # A single short append: no lock needed, and no reading
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                    size = f.tell()
+                if size > USAGE_LOG_MAX_BYTES:
+                    self._fold()
+            except OSError as e:
+                xbmc.log(f"[MisFavoritos] Could not save the usage stats: {e}", level=xbmc.LOGERROR)
+
+    def _fold(self):
+        """Fold the log into the stats file."""
+        folding = self.log_path + '.fold'
+        # Its own lock: the caller may hold the library's, and flock doesn't nest
+        with _file_lock(self.path + '.lock'):
+            if not os.path.exists(folding):
+                try:
+                    # Later appends start a new log
+                    os.replace(self.log_path, folding)
+                except FileNotFoundError:
+                    return  # Folded by another process meanwhile
+            stats = _read_usage(self.path, (folding,))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            os.remove(folding)
+
+
+DUPLICATE_POLICIES = ('skip', 'allow', 'move')
+
+
+def url_fingerprint(url):
+    """
+    Canonical form of a URL for duplicate detection: whitespace trimmed
+    and, for plugin:// URLs, the addon id lowercased and the query
+    parameters in a fixed order.
+    """
+    url = url.strip()
+    if url[:9].lower() != 'plugin://':
+        return url
+    base, _, query = url.partition('?')
+    addon, _, path = base[9:].partition('/')
+    base = f"plugin://{addon.lower()}/{path}"
+    if not query:
+        return base
+    return base + '?' + '&'.join(sorted(param for param in query.split('&') if param))
+
+
+def _age_key(node):
+    return (node.get('added', 0), node['id'])
+
+
+class UrlIndex(StorageObserver):
+    """
+    Hash index from url_fingerprint() to item ids, for O(1) duplicate
+    checks. Built on first use, or taken from the copy saved with the
+    cache, and kept current through the observer hooks.
+    """
+
+    def __init__(self, nodes, saved=None):
+        if saved is not None:
+            self.ids, self.fingerprints = saved
+            return
+        self.ids = {}  # fingerprint -> item id, or set of ids when duplicated
+        self.fingerprints = {}  # item id -> fingerprint
+        for node in nodes:
+            if node.get('type') == 'item':
+                self._add(node)
+
+    def _add(self, node):
+        fingerprint = url_fingerprint(node.get('url') or '')
+        self.fingerprints[node['id']] = fingerprint
+        ids = self.ids.get(fingerprint)
+        if ids is None:
+            self.ids[fingerprint] = node['id']
+        elif isinstance(ids, str):
+            self.ids[fingerprint] = {ids, node['id']}
+        else:
+            ids.add(node['id'])
+
+    def _discard(self, node_id):
+        fingerprint = self.fingerprints.pop(node_id, None)
+        ids = self.ids.get(fingerprint)
+        if ids is None:
+            return
+        if isinstance(ids, str):
+            del self.ids[fingerprint]
+        else:
+            ids.discard(node_id)
+            if len(ids) == 1:
+                self.ids[fingerprint] = ids.pop()
+
+    def node_added(self, node, parent):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.get('type') == 'item':
+                self._add(node)
+            stack.extend(node.get('children', ()))
+
+    def node_removed(self, node, parent):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self._discard(node['id'])
+            stack.extend(node.get('children', ()))
+
+    def node_changed(self, node):
+        if node.get('type') == 'item':
+            self._discard(node['id'])
+            self._add(node)
+
+
+def duplicate_policy():
+    """What adding an already stored URL does, one of DUPLICATE_POLICIES."""
+    try:
+        return DUPLICATE_POLICIES[int(xbmcaddon.Addon().getSetting('duplicates') or 0)]
+    except (ValueError, IndexError):
+        return 'skip'
+
+
+def add_unique_item(storage, parent_id, name, url, thumbnail, policy=None):
+    """
+    add_item, honouring the duplicates policy when the URL is already stored.
+    Returns (result, existing item or None), result being 'added',
+    'skipped', 'moved' or None if nothing could be stored.
+    """
+    if policy is None:
+        policy = duplicate_policy()
+    existing = None if policy == 'allow' else storage.find_item_by_url(url)
+    if existing is None:
+        return ('added' if storage.add_item(parent_id, name, url, thumbnail) else None), None
+    if policy == 'move' and storage.get_parent(existing['id'])['id'] != parent_id:
+        return ('moved' if storage.move_item(existing['id'], parent_id) else None), existing
+    return 'skipped', existing
+
+
+def open_storage():
+    """Returns the storage backend selected in the addon settings."""
+    addon = xbmcaddon.Addon()
+    if addon.getSetting('backend') == '1':
+        from resources.lib.sqlite_storage import SQLiteStorage
+        return SQLiteStorage()
+    if addon.getSetting('service') != 'false':
+        # The background service already has the library in memory
+        from resources.lib.storage_service import RemoteStorage
+        remote = RemoteStorage.connect()
+        if remote is not None:
+            return remote
+    return JSONStorage()
+
 
 class JSONStorage:
-    def __init__(self):
-        self.data = self._load()
+    def __init__(self, journal=None):
+        if journal is None:
+            journal = xbmcaddon.Addon().getSetting('journal') == 'true'
+        self.journal = journal
+        self.search_urls = xbmcaddon.Addon().getSetting('search_urls') == 'true'
+        self._tx_depth = 0
+        self._pending = []
+        self._io_lock = threading.Lock()
+        self._compactor = None
+        self._lock_depth = 0
+        self._usage = UsageStats()
+        self._open()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the cross-process lock on the library files. Re-entrant
+        within this instance's thread; other processes (the context menu,
+        a second plugin call) wait for it.
+        """
+        if self._lock_depth == 0 and not os.path.exists(DATA_PATH):
+            os.makedirs(DATA_PATH)
+        self._lock_depth += 1
+        try:
+            if self._lock_depth > 1:
+                yield
+            else:
+                with _file_lock(LOCK_PATH):
+                    yield
+        finally:
+            self._lock_depth -= 1
+
+    def _disk_signature(self):
+        """Changes whenever any process rewrites the snapshot or appends to the journal."""
+        signature = []
+        for path in (FILE_PATH, JOURNAL_PATH):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _open(self):
+        # Locked so a journal append in progress elsewhere is not mistaken for a torn tail
+        with phase('load'), self._locked():
+            started = time.perf_counter()
+            self.data, self._saved = self._load()
+            self._observers = []
+            self._search = None
+            self._urls = None
+            self._stats = None
+            self._search_log = None
+            self._build_index()
+            if self._saved is None and os.path.exists(FILE_PATH):
+                # Parsed from favorites.json: cache it, with its indexes, before the journal changes it
+                self._write_cache(self._cache_payload())
+            self._journal_records = 0
+            # Replayed even with the journal disabled, so switching modes loses nothing
+            self._replay_journal()
+            # After the replay: those records were logged by whoever wrote them
+            self._attach_search_log()
+            self._outline = FolderOutline(self.data, self._parents)
+            self._observers.append(self._outline)
+            # Rewritten only if it doesn't match, e.g. after a crash mid-write
+            self._save_outline()
+            self._disk_state = self._disk_signature()
+            self._usage.note_load(time.perf_counter() - started)
+            if self._usage.due():
+                self._save_usage()
+
+    def _catch_up(self):
+        """
+        If another process wrote since this copy was loaded, reload the
+        library from disk and reapply just the pending records on top.
+        Records that no longer apply (e.g. their folder is gone) are dropped.
+        Must be called with the lock held.
+        """
+        if self._disk_signature() == self._disk_state:
+            return
+        records = [_load_record(line) for line in self._pending]
+        self._pending = []
+        self._open()
+        for record in records:
+            self._stage(record)
+
+    def refresh(self):
+        """
+        Reload the library if another process changed it since it was
+        loaded. For long-lived instances (the service); a no-op while
+        changes of this instance are pending or being compacted.
+        """
+        if self._tx_depth or self._pending:
+            return False
+        if self._compactor is not None and self._compactor.is_alive():
+            return False
+        self._wait_compaction()
+        if self._disk_signature() == self._disk_state:
+            return False
+        self._open()
+        return True
+
+    def has_journal(self):
+        """True if there are journal records not yet folded into the snapshot."""
+        return self._journal_records > 0
+
+    def _empty_root(self):
+        return {"id": "root", "name": "Root", "type": "folder", "children": []}
 
     def _load(self):
+        """
+        Returns (tree, the indexes saved with it): from the binary cache
+        if current, else the tree parsed from favorites.json and None.
+        """
         if not os.path.exists(DATA_PATH):
             os.makedirs(DATA_PATH)
-        
+
         if not os.path.exists(FILE_PATH):
             # Init empty structure
-            return {
-                "id": "root",
-                "name": "Root",
-                "type": "folder",
-                "children": []
-            }
-        
+            return self._empty_root(), None
+
+        cached = self._read_cache()
+        if cached is not None:
+            return cached
+
+        try:
+            return read_tree(FILE_PATH), None
+        except (OSError, ValueError) as e:
+            # Keep the unreadable file aside instead of overwriting it on the next save
+            xbmc.log(f"[MisFavoritos] Could not read {FILE_PATH}: {e}", level=xbmc.LOGERROR)
+            try:
+                os.replace(FILE_PATH, FILE_PATH + '.bad')
+            except OSError:
+                pass
+            return self._empty_root(), None
+
+    def _cache_key(self):
+        st = os.stat(FILE_PATH)
+        return (CACHE_VERSION, sys.version_info[:2], st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read_cache(self):
+        """
+        Returns (tree, {name: marshalled index}) from the binary cache if
+        it still matches favorites.json, or None if it is missing, stale
+        or corrupt.
+        """
         try:
-            with open(FILE_PATH, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {"id": "root", "name": "Root", "type": "folder", "children": []}
+            with open(CACHE_PATH, 'rb') as f:
+                header = f.read(f.read(1)[0])
+                if marshal.loads(header) != self._cache_key():
+                    return None
+                # Reading in one go is several times faster than marshal.load(f)
+                return marshal.loads(f.read())
+        except (OSError, IndexError, EOFError, ValueError, TypeError):
+            return None
+
+    def _cache_payload(self):
+        """
+        The tree and the indexes derived from it, so a later load skips
+        rebuilding them too. Each index stays marshalled until first used.
+        """
+        try:
+            urls = self._url_index()
+            saved = {'stats': marshal.dumps(self._folder_stats().stats),
+                     'urls': marshal.dumps((urls.ids, urls.fingerprints))}
+            return marshal.dumps((self.data, saved))
+        except ValueError:
+            return None  # Too deeply nested to marshal; JSON alone will do
+
+    def _write_cache(self, payload):
+        """Refresh the cache for the current favorites.json. Failures are harmless."""
+        if payload is None:
+            return
+        tmp_path = CACHE_PATH + '.tmp'
+        try:
+            header = marshal.dumps(self._cache_key())
+            with open(tmp_path, 'wb') as f:
+                f.write(bytes([len(header)]))
+                f.write(header)
+                f.write(payload)
+            os.replace(tmp_path, CACHE_PATH)
+        except OSError:
+            pass
+
+    def _serialize(self):
+        try:
+            return json.dumps(self.data, indent=2, ensure_ascii=False)
+        except RecursionError:
+            return _dumps_deep(self.data)
+
+    def _write_snapshot(self, text, cache_payload, counter='saves'):
+        """
+        Atomically replace the snapshot, refresh the binary cache from it,
+        then drop the journal it now contains.
+        """
+        tmp_path = FILE_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, FILE_PATH)
+        self._write_cache(cache_payload)
+        self._usage.note_write(counter, size + len(cache_payload or b''))
+        if os.path.exists(JOURNAL_PATH):
+            # Records up to the snapshot generation are skipped on replay,
+            # so a crash before this truncate is harmless.
+            open(JOURNAL_PATH, 'wb').close()
+        self._journal_records = 0
 
     def save(self):
-        with open(FILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        """Write the whole tree as a fresh snapshot, including other processes' changes."""
+        self._wait_compaction()
+        with phase('persist'), self._locked():
+            self._catch_up()
+            with self._io_lock:
+                self._write_snapshot(self._serialize(), self._cache_payload())
+            self._pending = []
+            self._disk_state = self._disk_signature()
+            self._save_usage()
+
+    def compact(self):
+        """
+        Fold the journal into a new snapshot in a background thread.
+        The tree is serialized up front, so later mutations are not included
+        and simply keep going to the journal once the compaction is done.
+        """
+        self._wait_compaction()
+        self._io_lock.acquire()
+        try:
+            text = self._serialize()
+            cache_payload = self._cache_payload()
+            expected = self._disk_state
+        except BaseException:
+            self._io_lock.release()
+            raise
+
+        def run():
+            try:
+                with _file_lock(LOCK_PATH):
+                    # Another process appended since: the serialized tree lacks
+                    # its records, so leave compacting to a later write
+                    if self._disk_signature() == expected:
+                        self._write_snapshot(text, cache_payload, 'compactions')
+                        self._disk_state = self._disk_signature()
+                        self._usage.merge()
+            except OSError as e:
+                xbmc.log(f"[MisFavoritos] Journal compaction failed: {e}", level=xbmc.LOGERROR)
+            finally:
+                self._io_lock.release()
+
+        self._compactor = threading.Thread(target=run, name='MisFavoritosCompact')
+        self._compactor.start()
+
+    def _wait_compaction(self):
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+
+    def _replay_journal(self):
+        """
+        Apply journal records newer than the snapshot.
+        A torn or corrupt tail (e.g. power loss mid-write) is dropped.
+        """
+        if not os.path.exists(JOURNAL_PATH):
+            return
+        good_bytes = 0
+        for line, record in journal_records(JOURNAL_PATH):
+            good_bytes += len(line)
+            self._journal_records += 1
+            if record.get('gen', 0) > self.data.get('generation', 0):
+                self._apply(record)
+                self.data['generation'] = record['gen']
+        if good_bytes < os.path.getsize(JOURNAL_PATH):
+            xbmc.log("[MisFavoritos] Ignoring torn record at the end of the journal", level=xbmc.LOGERROR)
+            with open(JOURNAL_PATH, 'r+b') as f:
+                f.truncate(good_bytes)
+
+    def _append_journal(self, lines):
+        self._wait_compaction()
+        data = ''.join(lines).encode('utf-8')
+        with self._io_lock:
+            with open(JOURNAL_PATH, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+        self._disk_state = self._disk_signature()
+        self._journal_records += len(lines)
+        self._usage.note_write('journal_appends', len(data))
+        self._save_usage()
+        if self._journal_records >= JOURNAL_MAX_RECORDS or size >= JOURNAL_MAX_BYTES:
+            self.compact()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group several mutations into a single write.
+        Changes are only persisted when the outermost block exits cleanly;
+        if it raises, the in-memory tree is restored from disk.
+        """
+        self._tx_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                self._pending = []
+                self._wait_compaction()
+                self._open()
+            raise
+        self._tx_depth -= 1
+        if self._tx_depth == 0:
+            self._flush()
+
+    def _flush(self):
+        """
+        Persist the pending records as one short locked read-modify-write:
+        changes other processes made meanwhile are loaded first and the
+        pending records reapplied on top, so nothing is overwritten.
+        """
+        if not self._pending:
+            return
+        self._wait_compaction()
+        with phase('persist'), self._locked():
+            self._catch_up()
+            if self._pending:
+                if self.journal:
+                    lines, self._pending = self._pending, []
+                    self._append_journal(lines)
+                else:
+                    self.save()
+            if self._search_log is not None:
+                self._search_log.append(SEARCH_LOG_PATH, self.data['generation'])
+            if self._outline.changed:
+                self._save_outline()
+
+    def rebuild(self):
+        """
+        Write every file derived from the library afresh: a snapshot with
+        the journal folded in, the binary cache, the folder outline and
+        the search index. Returns True.
+        """
+        self._flush()
+        self._wait_compaction()
+        with self._locked():
+            for path in (CACHE_PATH, OUTLINE_PATH, SEARCH_PATH, SEARCH_LOG_PATH):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            self._open()
+            self.save()
+            self._search_index()
+        return True
+
+    def _save_usage(self):
+        """Add this instance's counters to the usage stats, with the library's current size."""
+        folders = len(self._outline.names)
+        size = 0
+        for path in (FILE_PATH, JOURNAL_PATH):
+            with contextlib.suppress(OSError):
+                size += os.path.getsize(path)
+        self._usage.note_library(len(self._nodes) - folders, folders - 1, size)
+        self._usage.merge()
+
+    def _save_outline(self):
+        """Save the folder outline for readers that don't load the library (the context menu)."""
+        text = json.dumps(self._outline.folders(), ensure_ascii=False, separators=(',', ':'))
+        self._outline.changed = False
+        try:
+            with open(OUTLINE_PATH, 'r', encoding='utf-8') as f:
+                if f.read() == text:
+                    return
+        except OSError:
+            pass
+        try:
+            tmp_path = OUTLINE_PATH + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, OUTLINE_PATH)
+        except OSError as e:
+            xbmc.log(f"[MisFavoritos] Could not save the folder outline: {e}", level=xbmc.LOGERROR)
+
+    def _notify(self, event, *args):
+        for observer in self._observers:
+            getattr(observer, event)(*args)
+
+    def _stage(self, record):
+        """Apply a mutation record to the tree and queue it for the next flush."""
+        generation = self.data.get('generation', 0) + 1
+        record['gen'] = generation
+        # Kept when a record is staged again after a catch-up
+        record.setdefault('time', int(time.time()))
+        if not self._apply(record):
+            return False
+        self.data['generation'] = generation
+        # Serialized right away: the tree may change before the batch is flushed
+        self._pending.append(_dump_record(record) + '\n')
+        return True
+
+    def _commit(self, record):
+        """
+        Apply a mutation record to the tree and persist it (now, or at
+        commit time if inside a transaction).
+        """
+        if not self._stage(record):
+            return False
+        if not self._tx_depth:
+            self._flush()
+        return True
+
+    def _apply(self, record):
+        """Apply one mutation record to the in-memory tree and indexes."""
+        if self._saved:
+            self._restore_saved()
+        op = record['op']
+        node = self._nodes.get(record.get('id'))
+
+        if op == 'add':
+            parent = self._nodes.get(record['parent'])
+            new_node = record['node']
+            if not parent or parent.get('type') != 'folder' or new_node['id'] in self._nodes:
+                return False
+            self._insert_child(parent, new_node)
+            self._index_subtree(new_node, parent)
+            self._touch(parent, record)
+            self._notify('node_added', new_node, parent)
+            return True
+
+        if op == 'delete_many':
+            return self._delete_many(record['ids'], record)
+
+        if op == 'move_many':
+            return self._move_many(record)
+
+        if node is None:
+            return False
+
+        if op == 'rename':
+            node['name'] = record['name']
+            self._reposition(node)
+            self._touch(self._parents.get(node['id']), record)
+            self._notify('node_changed', node)
+        elif op == 'update':
+            node.update(record['fields'])
+            if 'name' in record['fields']:
+                self._reposition(node)
+            self._touch(self._parents.get(node['id']), record)
+            self._notify('node_changed', node)
+        elif op == 'order':
+            if node.get('type') != 'folder' or record['order'] not in FOLDER_ORDERS:
+                return False
+            # 'manual' keeps the name order a pre-ordering folder was shown in
+            self._ensure_ordered(node)
+            node['order'] = record['order']
+            key = self._order_key(node['order'])
+            if key:
+                node['children'].sort(key=key)
+            self._touch(node, record)
+            self._notify('children_reordered', node)
+        elif op == 'delete':
+            parent = self._parents.get(node['id'])
+            if not parent:
+                return False
+            parent['children'] = [c for c in parent['children'] if c['id'] != node['id']]
+            self._touch(parent, record)
+            self._notify('node_removed', node, parent)
+            self._unindex_subtree(node)
+        elif op == 'move':
+            old_parent = self._parents.get(node['id'])
+            new_parent = self._nodes.get(record['parent'])
+            if not old_parent or not new_parent or new_parent.get('type') != 'folder':
+                return False
+            if node.get('type') == 'folder' and self._inside(node['id'], new_parent['id']):
+                return False  # Would detach the folder into a cycle of its own
+            old_parent['children'].remove(node)
+            self._insert_child(new_parent, node)
+            self._parents[node['id']] = new_parent
+            self._touch(old_parent, record)
+            self._touch(new_parent, record)
+            self._notify('node_moved', node, old_parent, new_parent)
+        else:
+            return False
+        return True
+
+    def _delete_many(self, ids, record):
+        """Remove several nodes, filtering each affected folder's children once."""
+        doomed = {node_id for node_id in ids if node_id in self._parents}
+        if not doomed:
+            return False
+        # Ids nested under another doomed folder go away with it
+        doomed = {node_id for node_id in doomed if not self._has_ancestor_in(node_id, doomed)}
+        parents = {self._parents[node_id]['id']: self._parents[node_id] for node_id in doomed}
+        for parent in parents.values():
+            parent['children'] = [c for c in parent['children'] if c['id'] not in doomed]
+            self._touch(parent, record)
+        for node_id in doomed:
+            node = self._nodes[node_id]
+            self._notify('node_removed', node, self._parents[node_id])
+            self._unindex_subtree(node)
+        return True
+
+    def _move_many(self, record):
+        """
+        Move several nodes into one folder: each old parent's children are
+        filtered once and the new parent's resorted once. Drops from the
+        record the ids that can't move, so a replay moves the same nodes.
+        """
+        parent_id = record['parent']
+        new_parent = self._nodes.get(parent_id)
+        if not new_parent or new_parent.get('type') != 'folder':
+            return False
+        # Moving a folder under the target's own ancestors (or itself) would detach a cycle
+        blocked = {parent_id}
+        ancestor = self._parents.get(parent_id)
+        while ancestor is not None:
+            blocked.add(ancestor['id'])
+            ancestor = self._parents.get(ancestor['id'])
+        moves = {}
+        for node_id in record['ids']:
+            old_parent = self._parents.get(node_id)
+            if old_parent is not None and old_parent is not new_parent and node_id not in blocked:
+                moves[node_id] = old_parent
+        record['ids'] = list(moves)
+        if not moves:
+            return False
+        old_parents = {old_parent['id']: old_parent for old_parent in moves.values()}
+        for old_parent in old_parents.values():
+            old_parent['children'] = [c for c in old_parent['children'] if c['id'] not in moves]
+            self._touch(old_parent, record)
+        self._ensure_ordered(new_parent)
+        new_parent['children'].extend(self._nodes[node_id] for node_id in moves)
+        key = self._order_key(new_parent['order'])
+        if key:
+            new_parent['children'].sort(key=key)
+        self._touch(new_parent, record)
+        for node_id, old_parent in moves.items():
+            node = self._nodes[node_id]
+            self._parents[node_id] = new_parent
+            self._notify('node_moved', node, old_parent, new_parent)
+        return True
+
+    def _inside(self, node_id, folder_id):
+        """True if folder_id is node_id or lies somewhere below it; walks up from folder_id, O(depth)."""
+        while folder_id is not None:
+            if folder_id == node_id:
+                return True
+            parent = self._parents.get(folder_id)
+            folder_id = parent['id'] if parent is not None else None
+        return False
+
+    def _has_ancestor_in(self, node_id, ids):
+        parent = self._parents.get(node_id)
+        while parent is not None:
+            if parent['id'] in ids:
+                return True
+            parent = self._parents.get(parent['id'])
+        return False
+
+    def _touch(self, folder, record):
+        """Remember, in the folder itself, when its contents last changed."""
+        if folder is not None and 'time' in record:
+            folder['modified'] = record['time']
+
+    def _name_key(self, node):
+        """Collation key for a node, cached per id and recomputed only when its name changes."""
+        cached = self._keys.get(node['id'])
+        if cached is None or cached[0] != node['name']:
+            cached = (node['name'], collation_key(node['name']))
+            self._keys[node['id']] = cached
+        return (node['type'] != 'folder', cached[1])
+
+    def _order_key(self, order):
+        """Sort key for a folder ordering, or None when children keep their placement."""
+        if order == 'manual':
+            return None
+        if order == 'date':
+            return lambda node: (node['type'] != 'folder', -node.get('added', 0))
+        return self._name_key
+
+    def _ensure_ordered(self, folder):
+        """
+        Folders saved before orderings existed are sorted by name the
+        first time they are read or something is inserted into them.
+        Only in memory: the next change to the library saves it.
+        """
+        if 'order' not in folder:
+            folder['children'].sort(key=self._name_key)
+            folder['order'] = 'name'
+            self._notify('children_reordered', folder)
+
+    def _insert_child(self, folder, node):
+        """Binary-insert node into folder's children, keeping the folder's order."""
+        self._ensure_ordered(folder)
+        children = folder['children']
+        key = self._order_key(folder['order'])
+        if key is None:
+            children.append(node)
+            return
+        node_key = key(node)
+        lo, hi = 0, len(children)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(children[mid]) <= node_key:
+                lo = mid + 1
+            else:
+                hi = mid
+        children.insert(lo, node)
+
+    def _reposition(self, node):
+        """Move a renamed node to its new place among its siblings."""
+        parent = self._parents.get(node['id'])
+        if parent and parent.get('order', 'name') == 'name':
+            children = parent['children']
+            i = children.index(node)
+            key = self._name_key(node)
+            # Still in place (e.g. renamed to the same name): moving it
+            # past equal-named siblings would reorder them for nothing
+            if (i == 0 or self._name_key(children[i - 1]) <= key) and \
+                    (i == len(children) - 1 or key <= self._name_key(children[i + 1])):
+                return
+            del children[i]
+            self._insert_child(parent, node)
+
+    def _build_index(self):
+        """
+        Index every node by id, and every node's parent, so lookups
+        never have to walk the tree.
+        """
+        self._nodes = {}
+        self._parents = {}
+        self._keys = {}
+        self._index_subtree(self.data, None)
+
+    def _index_subtree(self, node, parent):
+        stack = [(node, parent)]
+        while stack:
+            node, parent = stack.pop()
+            self._nodes[node['id']] = node
+            if parent is not None:
+                self._parents[node['id']] = parent
+            for child in node.get('children', ()):
+                stack.append((child, node))
+
+    def _unindex_subtree(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self._nodes.pop(node['id'], None)
+            self._parents.pop(node['id'], None)
+            stack.extend(node.get('children', ()))
+
+    def get_node(self, node_id):
+        """Returns the node with the given id, or None."""
+        return self._nodes.get(node_id)
+
+    def get_parent(self, node_id):
+        """Returns the folder containing the given node, or None for root/unknown ids."""
+        return self._parents.get(node_id)
+
+    def get_path(self, node_id):
+        """Names of the folders above a node, from the top, without root."""
+        names = []
+        parent = self._parents.get(node_id)
+        while parent is not None and parent['id'] != 'root':
+            names.append(parent['name'])
+            parent = self._parents.get(parent['id'])
+        names.reverse()
+        return names
+
+    def _attach_search_log(self):
+        """
+        Once a search index has been saved, log every change for it.
+        An index whose log grew that big without being searched is
+        dropped instead; the next search rebuilds it.
+        """
+        try:
+            if os.path.getsize(SEARCH_LOG_PATH) > SEARCH_LOG_MAX_BYTES:
+                os.remove(SEARCH_PATH)
+                os.remove(SEARCH_LOG_PATH)
+        except OSError:
+            pass
+        if os.path.exists(SEARCH_PATH):
+            from resources.lib.search_index import SearchLog
+            self._search_log = SearchLog(self.search_urls)
+            self._observers.append(self._search_log)
+
+    def _search_index(self):
+        """
+        Returns the search index: the saved one plus its log if current,
+        else rebuilt from the tree and saved.
+        """
+        if self._search is None:
+            from resources.lib.search_index import SearchIndex
+            generation = self.data.get('generation', 0)
+            index = SearchIndex.load(SEARCH_PATH, SEARCH_LOG_PATH, generation, self.search_urls)
+            rebuilt = index is None
+            if rebuilt:
+                index = SearchIndex(self.search_urls)
+                index.build(self.data)
+            if rebuilt or index.replayed > SEARCH_LOG_MAX_RECORDS:
+                index.save(SEARCH_PATH, generation)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(SEARCH_LOG_PATH)
+            self._search = index
+            self._observers.append(index)
+            if self._search_log is None:
+                self._attach_search_log()
+        return self._search
+
+    def search(self, query, limit=200):
+        """
+        Returns up to limit (node, path) pairs whose name (or URL, if
+        enabled) has words starting with every word of query.
+        """
+        ids = self._search_index().search(query)
+        nodes = heapq.nsmallest(limit, (self._nodes[i] for i in ids if i in self._nodes), key=self._name_key)
+        return [(node, self.get_path(node['id'])) for node in nodes]
+
+    def _restore_saved(self):
+        """
+        Take every index still waiting in the cache before the tree
+        changes: the saved copies only match the tree as loaded.
+        """
+        if 'stats' in self._saved:
+            self._folder_stats()
+        if 'urls' in self._saved:
+            self._url_index()
+        self._saved = None
+
+    def _folder_stats(self):
+        if self._stats is None:
+            saved = self._saved.pop('stats', None) if self._saved else None
+            self._stats = FolderStats(self.data, self._parents, None if saved is None else marshal.loads(saved))
+            self._observers.append(self._stats)
+        return self._stats
+
+    def get_folder_stats(self, folder_ids):
+        """
+        Aggregates for the given folders: {id: {'items', 'folders',
+        'total_items', 'total_folders', 'modified'}}. items/folders count
+        direct children, the totals count everything below; modified is
+        the last change anywhere below (epoch seconds).
+        """
+        stats = self._folder_stats()
+        result = {}
+        for folder_id in folder_ids:
+            folder_stats = stats.get(folder_id)
+            if folder_stats is not None:
+                result[folder_id] = folder_stats
+        return result
+
+    def check_folder_stats(self):
+        """Recompute every folder's aggregates from scratch; returns the ids that disagree."""
+        maintained = self._folder_stats()
+        fresh = FolderStats(self.data, self._parents)
+        return compare_folder_stats({folder_id: maintained.get(folder_id) for folder_id in maintained.stats},
+                                    {folder_id: fresh.get(folder_id) for folder_id in fresh.stats})
+
+    def _url_index(self):
+        if self._urls is None:
+            saved = self._saved.pop('urls', None) if self._saved else None
+            self._urls = UrlIndex(self._nodes.values(), None if saved is None else marshal.loads(saved))
+            self._observers.append(self._urls)
+        return self._urls
+
+    def find_item_by_url(self, url):
+        """
+        Returns the stored item with the same url_fingerprint(), the
+        oldest one if there are several, or None.
+        """
+        ids = self._url_index().ids.get(url_fingerprint(url))
+        if ids is None:
+            return None
+        if isinstance(ids, str):
+            return self._nodes[ids]
+        return min((self._nodes[i] for i in ids), key=_age_key)
+
+    def find_duplicates(self):
+        """Ids of every item whose URL an older item already has."""
+        duplicates = []
+        for ids in self._url_index().ids.values():
+            if not isinstance(ids, str):
+                keep = min((self._nodes[i] for i in ids), key=_age_key)['id']
+                duplicates.extend(sorted(i for i in ids if i != keep))
+        return duplicates
 
     def get_folder_contents(self, folder_id):
         """
-        Returns the children list of a folder.
-        Uses recursive search.
+        Returns the children list of a folder, already in display order.
         """
-        node = self._find_node(self.data, folder_id)
+        node = self._nodes.get(folder_id)
         if node and node.get('type') == 'folder':
-            return node.get('children', [])
+            # Never written from here: reading must not save the library
+            self._ensure_ordered(node)
+            return node['children']
         return []
 
+    def get_folder_page(self, folder_id, start=0, count=None):
+        """
+        Returns (entries, total) for a folder in display order.
+        Children are stored in that order, so this is just a slice.
+        """
+        children = self.get_folder_contents(folder_id)
+        end = None if count is None else start + count
+        return children[start:end], len(children)
+
+    def get_folder_order(self, folder_id):
+        """Returns the folder's ordering, one of FOLDER_ORDERS."""
+        node = self._nodes.get(folder_id)
+        return node.get('order', 'name') if node else 'name'
+
+    def set_folder_order(self, folder_id, order):
+        """Change how a folder's children are ordered and re-sort them once."""
+        return self._commit({'op': 'order', 'id': folder_id, 'order': order})
+
+    def get_folder_outline(self):
+        """
+        Returns every folder in display order: [(id, name, depth, path)],
+        path being the folder names below Root. O(#folders), items are
+        never visited.
+        """
+        return list(self._outline.folders())
+
     def get_all_folders_flat(self):
         """
         Returns a flat list of all folders: [(id, name, depth)]
         """
-        folders = []
-        self._collect_folders(self.data, folders, 0)
-        return folders
+        return [(folder_id, name, depth) for folder_id, name, depth, _ in self._outline.folders()]
 
-    def _collect_folders(self, node, result_list, depth):
-        if node.get('type') == 'folder':
-            result_list.append((node['id'], node['name'], depth))
-            for child in node.get('children', []):
-                self._collect_folders(child, result_list, depth + 1)
+    def _is_type(self, node_id, node_type):
+        node = self._nodes.get(node_id)
+        return node is not None and node.get('type') == node_type
 
     def add_folder(self, parent_id, name):
-        parent = self._find_node(self.data, parent_id)
-        if parent:
-            new_folder = {
-                "id": str(uuid.uuid4()),
-                "name": name,
-                "type": "folder",
-                "children": []
-            }
-            parent['children'].append(new_folder)
-            self.save()
-            return True
-        return False
+        new_folder = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "type": "folder",
+            "children": [],
+            "added": int(time.time())
+        }
+        return self._commit({'op': 'add', 'parent': parent_id, 'node': new_folder})
 
     def add_item(self, parent_id, name, url, thumbnail):
-        parent = self._find_node(self.data, parent_id)
-        if parent:
-            new_item = {
-                "id": str(uuid.uuid4()),
-                "name": name,
-                "type": "item",
-                "url": url,
-                "thumbnail": thumbnail
-            }
-            parent['children'].append(new_item)
-            self.save()
-            return True
-        return False
-
-    def _find_node(self, current_node, target_id):
-        if current_node['id'] == target_id:
-            return current_node
-        
-        if 'children' in current_node:
-            for child in current_node['children']:
-                found = self._find_node(child, target_id)
-                if found:
-                    return found
-        return None
+        new_item = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "type": "item",
+            "url": url,
+            "thumbnail": thumbnail,
+            "added": int(time.time())
+        }
+        return self._commit({'op': 'add', 'parent': parent_id, 'node': new_item})
 
     def rename_folder(self, folder_id, new_name):
         """Rename a folder."""
-        folder = self._find_node(self.data, folder_id)
-        if folder and folder.get('type') == 'folder':
-            folder['name'] = new_name
-            self.save()
-            return True
-        return False
+        if not self._is_type(folder_id, 'folder'):
+            return False
+        return self._commit({'op': 'rename', 'id': folder_id, 'name': new_name})
 
     def delete_folder(self, folder_id):
         """Delete a folder (must be empty or user confirms)."""
         if folder_id == 'root':
             return False  # Cannot delete root
-        
-        parent = self._find_parent(self.data, folder_id)
-        if parent:
-            parent['children'] = [c for c in parent['children'] if c['id'] != folder_id]
-            self.save()
-            return True
-        return False
+
+        return self._commit({'op': 'delete', 'id': folder_id})
 
     def rename_item(self, item_id, new_name):
         """Rename an item."""
-        item = self._find_node(self.data, item_id)
-        if item and item.get('type') == 'item':
-            item['name'] = new_name
-            self.save()
-            return True
-        return False
+        if not self._is_type(item_id, 'item'):
+            return False
+        return self._commit({'op': 'rename', 'id': item_id, 'name': new_name})
 
     def delete_item(self, item_id):
         """Delete an item."""
-        parent = self._find_parent(self.data, item_id)
-        if parent:
-            parent['children'] = [c for c in parent['children'] if c['id'] != item_id]
-            self.save()
-            return True
-        return False
+        return self._commit({'op': 'delete', 'id': item_id})
+
+    def delete_nodes(self, node_ids):
+        """Delete several items and/or folders as a single change."""
+        return self._commit({'op': 'delete_many', 'ids': [i for i in node_ids if i != 'root']})
 
     def move_item(self, item_id, new_parent_id):
         """Move an item to a different folder."""
-        # Find the item and its current parent
-        old_parent = self._find_parent(self.data, item_id)
-        if not old_parent:
-            return False
-        
-        # Find the item itself
-        item = None
-        for child in old_parent['children']:
-            if child['id'] == item_id:
-                item = child
-                break
-        
-        if not item:
-            return False
-        
-        # Find new parent
-        new_parent = self._find_node(self.data, new_parent_id)
-        if not new_parent or new_parent.get('type') != 'folder':
+        return self._commit({'op': 'move', 'id': item_id, 'parent': new_parent_id})
+
+    def move_folder(self, folder_id, new_parent_id):
+        """
+        Move a folder, with everything in it, into another folder.
+        Refused if the target is the folder itself or lies inside it.
+        """
+        if folder_id == 'root' or not self._is_type(folder_id, 'folder'):
             return False
-        
-        # Move the item
-        old_parent['children'].remove(item)
-        new_parent['children'].append(item)
-        self.save()
-        return True
+        return self._commit({'op': 'move', 'id': folder_id, 'parent': new_parent_id})
 
-    def _find_parent(self, current_node, target_id):
-        """Find the parent node of a given node ID."""
-        if 'children' in current_node:
-            for child in current_node['children']:
-                if child['id'] == target_id:
-                    return current_node
-                found = self._find_parent(child, target_id)
-                if found:
-                    return found
-        return None
+    def move_nodes(self, node_ids, new_parent_id):
+        """
+        Move several items and/or folders into one folder as a single
+        change. Folders that would end up inside themselves are skipped.
+        Returns how many were moved.
+        """
+        record = {'op': 'move_many', 'ids': list(node_ids), 'parent': new_parent_id}
+        return len(record['ids']) if self._commit(record) else 0
+
+    def copy_nodes(self, node_ids, parent_id):
+        """Copy items and/or whole folders into a folder, with new ids. Returns how many were copied."""
+        if not self._is_type(parent_id, 'folder'):
+            return 0
+        copied = 0
+        now = int(time.time())
+        with self.transaction():
+            for node_id in node_ids:
+                node = self._nodes.get(node_id)
+                if node is not None and node_id != 'root':
+                    copied += self._commit({'op': 'add', 'parent': parent_id, 'node': self._clone(node, now)})
+        return copied
+
+    @staticmethod
+    def _clone(node, now):
+        """Deep copy of a subtree with fresh ids and added dates."""
+        def shallow(source):
+            copy = {k: v for k, v in source.items() if k not in ('children', 'modified')}
+            copy['id'] = str(uuid.uuid4())
+            copy['added'] = now
+            return copy
+
+        top = shallow(node)
+        stack = [(node, top)]
+        while stack:
+            source, copy = stack.pop()
+            if source.get('type') == 'folder':
+                copy['children'] = [shallow(child) for child in source.get('children', ())]
+                stack.extend(zip(source.get('children', ()), copy['children']))
+        return top
+
+    def rename_nodes(self, node_ids, pattern):
+        """
+        Rename several nodes from a pattern such as '{n:02d} - {name}':
+        {name} is the current name, {n} the position in node_ids from 1.
+        Raises ValueError for a malformed pattern. Returns how many were renamed.
+        """
+        renames = []
+        for n, node_id in enumerate(node_ids, 1):
+            node = self._nodes.get(node_id)
+            if node is not None and node_id != 'root':
+                try:
+                    renames.append((node_id, pattern.format(name=node['name'], n=n)))
+                except (KeyError, IndexError, AttributeError) as e:
+                    raise ValueError(f"Bad rename pattern {pattern!r}: {e}") from e
+        renamed = 0
+        with self.transaction():
+            for node_id, name in renames:
+                if name:
+                    renamed += self._commit({'op': 'rename', 'id': node_id, 'name': name})
+        return renamed
 
     def update_item(self, item_id, name=None, url=None, thumbnail=None):
         """Update item properties."""
-        item = self._find_node(self.data, item_id)
-        if item and item.get('type') == 'item':
-            if name:
-                item['name'] = name
-            if url:
-                item['url'] = url
-            if thumbnail is not None:
-                item['thumbnail'] = thumbnail
-            self.save()
-            return True
-        return False
+        if not self._is_type(item_id, 'item'):
+            return False
+        fields = {}
+        if name:
+            fields['name'] = name
+        if url:
+            fields['url'] = url
+        if thumbnail is not None:
+            fields['thumbnail'] = thumbnail
+        return self._commit({'op': 'update', 'id': item_id, 'fields': fields})
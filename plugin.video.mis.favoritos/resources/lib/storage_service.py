@@ -0,0 +1,271 @@
+import contextlib
+import hmac
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import time
+import xbmc
+import xbmcaddon
+
+from resources.lib.storage import DATA_PATH, JSONStorage
+
+# Where the running service publishes its port and access token
+SERVICE_PATH = os.path.join(DATA_PATH, 'service.json')
+
+# Storage methods clients may call; reads can be retried on the files if the service goes away
+READ_METHODS = {
+    'get_node', 'get_parent', 'get_path', 'search', 'find_item_by_url', 'find_duplicates',
+    'get_folder_contents', 'get_folder_page', 'get_folder_order', 'get_all_folders_flat',
+    'get_folder_outline', 'get_folder_stats',
+}
+WRITE_METHODS = {
+    'set_folder_order', 'add_folder', 'add_item', 'rename_folder', 'delete_folder', 'rename_item',
+    'delete_item', 'delete_nodes', 'move_item', 'move_folder', 'move_nodes', 'copy_nodes', 'rename_nodes', 'update_item', 'save',
+    'rebuild',
+}
+
+# Idle time after which the service folds the journal into a snapshot
+IDLE_COMPACT_SECONDS = 30
+
+CONNECT_TIMEOUT = 0.5
+REQUEST_TIMEOUT = 30
+# How long a client holding a transaction may stay silent before the
+# service rolls it back and drops the connection; well under
+# REQUEST_TIMEOUT, so clients waiting for the storage are still served
+TRANSACTION_TIMEOUT = 10
+
+
+class ServiceError(Exception):
+    """The service rejected a request or could not run it."""
+
+
+def _shallow(value):
+    """
+    Folder nodes without their subtree, like SQLiteStorage returns them,
+    so a reply never carries more than was asked for.
+    """
+    if isinstance(value, dict):
+        if 'children' in value:
+            return {k: v for k, v in value.items() if k != 'children'}
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_shallow(v) for v in value]
+    return value
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One client connection: JSON requests and replies, one per line."""
+
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        server = self.server.storage_server
+        tx = None
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    if not hmac.compare_digest(str(request.get('token', '')), server.token):
+                        raise ServiceError('bad token')
+                    method = request['method']
+                    if method == 'begin':
+                        server.lock.acquire()
+                        tx = server.storage.transaction()
+                        tx.__enter__()
+                        self.connection.settimeout(TRANSACTION_TIMEOUT)
+                        result = True
+                    elif method in ('commit', 'rollback'):
+                        if tx is None:
+                            raise ServiceError('no transaction')
+                        try:
+                            if method == 'commit':
+                                tx.__exit__(None, None, None)
+                            else:
+                                error = ServiceError('rolled back by client')
+                                tx.__exit__(ServiceError, error, None)
+                        finally:
+                            tx = None
+                            server.lock.release()
+                            self.connection.settimeout(None)
+                        result = True
+                    elif method in READ_METHODS or method in WRITE_METHODS:
+                        result = server.call(method, request.get('args', []), in_transaction=tx is not None)
+                    else:
+                        raise ServiceError(f'unknown method {method!r}')
+                    reply = {'result': _shallow(result)}
+                except Exception as e:
+                    reply = {'error': f'{type(e).__name__}: {e}'}
+                self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        except socket.timeout:
+            xbmc.log("[MisFavoritos] Client silent in a transaction, rolling it back", level=xbmc.LOGERROR)
+        except OSError:
+            pass
+        finally:
+            if tx is not None:
+                # Client went away or hung mid-transaction: undo it
+                tx.__exit__(ServiceError, ServiceError('client disconnected'), None)
+                server.lock.release()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StorageServer:
+    """
+    Keeps one JSONStorage (tree and indexes) in memory and serves it to
+    plugin and context menu processes over loopback TCP. Requests run
+    one at a time; a client transaction holds the storage until it ends.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.token = secrets.token_hex(16)
+        self.lock = threading.RLock()
+        self.last_request = time.monotonic()
+        self._server = None
+        self._thread = None
+
+    def call(self, method, args, in_transaction=False):
+        with self.lock:
+            self.last_request = time.monotonic()
+            if not in_transaction:
+                # Pick up writes made by processes that went straight to the files
+                self.storage.refresh()
+            return getattr(self.storage, method)(*args)
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.storage_server = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MisFavoritosService', daemon=True)
+        self._thread.start()
+        info = {'port': self._server.server_address[1], 'token': self.token, 'pid': os.getpid()}
+        tmp_path = SERVICE_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, SERVICE_PATH)
+        xbmc.log(f"[MisFavoritos] Storage service listening on port {info['port']}", level=xbmc.LOGINFO)
+
+    def stop(self):
+        if self._server is None:
+            return
+        with contextlib.suppress(OSError):
+            os.remove(SERVICE_PATH)
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        with self.lock:
+            self.storage.save()
+
+    def compact_if_idle(self):
+        """Fold the journal into a snapshot while nobody is browsing."""
+        with self.lock:
+            if self.storage.has_journal() and time.monotonic() - self.last_request >= IDLE_COMPACT_SECONDS:
+                self.storage.compact()
+
+
+class RemoteStorage:
+    """
+    Same public interface as JSONStorage, answered by the running service.
+    Reads fall back to the files if the service goes away mid-session.
+    """
+
+    def __init__(self, sock, token):
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+        self._token = token
+        self._tx_depth = 0
+        self._direct = None
+
+    @classmethod
+    def connect(cls):
+        """Returns a RemoteStorage if the service is running, else None."""
+        try:
+            with open(SERVICE_PATH, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            sock = socket.create_connection(('127.0.0.1', info['port']), timeout=CONNECT_TIMEOUT)
+        except (OSError, ValueError, KeyError):
+            return None
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(REQUEST_TIMEOUT)
+        return cls(sock, info['token'])
+
+    def _request(self, method, *args):
+        self._file.write(json.dumps({'token': self._token, 'method': method, 'args': args},
+                                    ensure_ascii=False).encode('utf-8') + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('service closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ServiceError(reply['error'])
+        return reply['result']
+
+    def _call(self, method, *args):
+        if self._direct is not None:
+            return getattr(self._direct, method)(*args)
+        try:
+            return self._request(method, *args)
+        except OSError:
+            if method not in READ_METHODS or self._tx_depth:
+                raise
+            xbmc.log("[MisFavoritos] Storage service went away, reading the files directly", level=xbmc.LOGERROR)
+            self._direct = JSONStorage()
+            return getattr(self._direct, method)(*args)
+
+    def __getattr__(self, name):
+        if name not in READ_METHODS and name not in WRITE_METHODS:
+            raise AttributeError(name)
+        return lambda *args: self._call(name, *args)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group several mutations into a single write, run by the service."""
+        if self._direct is not None:
+            with self._direct.transaction():
+                yield self
+            return
+        if self._tx_depth == 0:
+            self._request('begin')
+        self._tx_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                self._request('rollback')
+            raise
+        self._tx_depth -= 1
+        if self._tx_depth == 0:
+            self._request('commit')
+
+
+def run_service():
+    """
+    Entry point of the xbmc.service extension: serve the library until
+    Kodi exits, while the JSON backend and the service setting are on.
+    """
+    monitor = xbmc.Monitor()
+    server = None
+    while True:
+        addon = xbmcaddon.Addon()
+        wanted = addon.getSetting('backend') != '1' and addon.getSetting('service') != 'false'
+        if wanted and server is None:
+            # The service compacts when idle, so writes can always go to the journal
+            server = StorageServer(JSONStorage(journal=True))
+            server.start()
+        elif not wanted and server is not None:
+            server.stop()
+            server = None
+        if monitor.waitForAbort(IDLE_COMPACT_SECONDS / 3):
+            break
+        if server is not None:
+            server.compact_if_idle()
+    if server is not None:
+        server.stop()
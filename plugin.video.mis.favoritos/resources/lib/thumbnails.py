@@ -0,0 +1,271 @@
+import concurrent.futures
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import urllib.request
+import xbmc
+import xbmcaddon
+import xbmcvfs
+
+from resources.lib.storage import DATA_PATH, _file_lock
+
+try:
+    from PIL import Image  # script.module.pil, imported in addon.xml
+except ImportError:  # Only outside Kodi, e.g. a bare test run: copies keep their original size
+    Image = None
+
+THUMBS_PATH = os.path.join(DATA_PATH, 'thumbs')
+INDEX_PATH = os.path.join(THUMBS_PATH, 'index.json')
+LOCK_PATH = os.path.join(THUMBS_PATH, 'index.lock')
+
+# Copies are downscaled to fit this box (poster aspect), which is all the
+# poster view shows
+THUMB_BOX = (400, 600)
+JPEG_QUALITY = 85
+
+FETCH_WORKERS = 4
+FETCH_TIMEOUT = 10
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+
+DEFAULT_MAX_MB = 100
+# Evict down to this share of the cap, so the next few fetches don't evict again
+EVICT_TO = 0.9
+# Last-use times are only rewritten when older than this, so browsing
+# doesn't rewrite the index on every navigation
+TOUCH_INTERVAL = 3600
+
+# File signatures of the formats Kodi can show
+_MAGIC = [(b'\x89PNG\r\n\x1a\n', '.png'), (b'\xff\xd8\xff', '.jpg'), (b'GIF8', '.gif'),
+          (b'RIFF', '.webp'), (b'BM', '.bmp')]
+
+
+def _extension(data):
+    for magic, ext in _MAGIC:
+        if data.startswith(magic):
+            return ext
+    return None
+
+
+def _source_path(thumb):
+    """Local file behind thumb, or None for remote and Kodi-internal (image://) art."""
+    if thumb.startswith('special://'):
+        return xbmcvfs.translatePath(thumb)
+    if os.path.isabs(thumb):
+        return thumb
+    return None
+
+
+def is_cacheable(thumb):
+    return bool(thumb) and (thumb.startswith(('http://', 'https://')) or _source_path(thumb) is not None)
+
+
+def _read_source(thumb):
+    path = _source_path(thumb)
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read(MAX_SOURCE_BYTES + 1)
+    request = urllib.request.Request(thumb, headers={'User-Agent': 'Kodi MisFavoritos'})
+    with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+        data = response.read(MAX_SOURCE_BYTES + 1)
+        # A capped read returns a body cut short by the server without complaint
+        if len(data) <= MAX_SOURCE_BYTES and response.length:
+            raise http.client.IncompleteRead(data, response.length)
+        return data
+
+
+def _downscale(data):
+    """(bytes, extension) of the copy to keep, or None if data is not an image."""
+    if Image is None:
+        ext = _extension(data)
+        return (data, ext) if ext else None
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        return None
+    if image.width <= THUMB_BOX[0] and image.height <= THUMB_BOX[1] and _extension(data):
+        return data, _extension(data)
+    image.thumbnail(THUMB_BOX)
+    out = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(out, 'PNG', optimize=True)
+        return out.getvalue(), '.png'
+    image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue(), '.jpg'
+
+
+def _fetch(thumb):
+    """
+    Fetch and downscale one thumbnail into its content-addressed file.
+    Runs in the pool; returns (file name, size) or None. Whatever a bad
+    server or file does (HTTPException, a truncated body, ...) only
+    loses this one thumbnail.
+    """
+    try:
+        return _store(thumb)
+    except Exception as e:
+        xbmc.log(f"[MisFavoritos] Could not fetch thumbnail {thumb}: {type(e).__name__}: {e}", level=xbmc.LOGERROR)
+        return None
+
+
+def _store(thumb):
+    data = _read_source(thumb)
+    if len(data) > MAX_SOURCE_BYTES:
+        return None
+    copy = _downscale(data)
+    if copy is None:
+        return None
+    data, ext = copy
+    digest = hashlib.sha1(data).hexdigest()
+    name = os.path.join(digest[:2], digest + ext)
+    path = os.path.join(THUMBS_PATH, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return name, len(data)
+
+
+class ThumbnailCache:
+    """
+    Local, downscaled copies of item art under the addon data directory.
+    Files are named after a hash of their contents, so items sharing an
+    image share one file. index.json maps each source URL to
+    [file, size, last used]; past the size cap the least recently used
+    files are evicted.
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            try:
+                max_mb = int(xbmcaddon.Addon().getSetting('thumb_cache_mb'))
+            except ValueError:
+                max_mb = DEFAULT_MAX_MB
+            max_bytes = max_mb * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.entries = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(INDEX_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, update):
+        """Merge update ({url: entry or None}) into the index on disk, evicting past the cap."""
+        os.makedirs(THUMBS_PATH, exist_ok=True)
+        with _file_lock(LOCK_PATH):
+            # Another process may have cached or evicted files meanwhile
+            entries = self._read_index()
+            for url, entry in update.items():
+                if entry is None:
+                    entries.pop(url, None)
+                elif url not in entries or entries[url][2] < entry[2]:
+                    entries[url] = entry
+            self._evict(entries)
+            tmp_path = INDEX_PATH + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, INDEX_PATH)
+        self.entries = entries
+
+    def _evict(self, entries):
+        # A file is as recent as the most recent URL using it
+        files = {}
+        for name, size, used in entries.values():
+            files[name] = (size, max(used, files.get(name, (0, 0))[1]))
+        total = sum(size for size, _ in files.values())
+        if total <= self.max_bytes:
+            return
+        evicted = set()
+        for name, (size, _) in sorted(files.items(), key=lambda f: f[1][1]):
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(os.path.join(THUMBS_PATH, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted.add(name)
+        for url in [url for url, entry in entries.items() if entry[0] in evicted]:
+            del entries[url]
+
+    def lookup(self, thumbs):
+        """
+        Local copies of the given thumbnails: {thumb: path} for those
+        cached. Records the use for eviction, rewriting the index at most
+        once per TOUCH_INTERVAL per entry.
+        """
+        now = int(time.time())
+        found = {}
+        update = {}
+        for thumb in thumbs:
+            entry = self.entries.get(thumb)
+            if entry is None:
+                continue
+            path = os.path.join(THUMBS_PATH, entry[0])
+            if not os.path.exists(path):
+                update[thumb] = None  # Removed behind our back
+                continue
+            found[thumb] = path
+            if now - entry[2] >= TOUCH_INTERVAL:
+                update[thumb] = [entry[0], entry[1], now]
+        if update:
+            try:
+                self._write_index(update)
+            except OSError as e:
+                xbmc.log(f"[MisFavoritos] Could not update the thumbnail index: {e}", level=xbmc.LOGERROR)
+        return found
+
+    def prefetch(self, thumbs):
+        """
+        Fetch the thumbnails not cached yet, FETCH_WORKERS at a time.
+        Returns how many were stored.
+        """
+        missing = list(dict.fromkeys(t for t in thumbs if is_cacheable(t) and t not in self.entries))
+        if not missing:
+            return 0
+        now = int(time.time())
+        update = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            for thumb, result in zip(missing, pool.map(_fetch, missing)):
+                if result is not None:
+                    update[thumb] = [result[0], result[1], now]
+        if update:
+            self._write_index(update)
+        return len(update)
+
+
+def thumbnail_cache_enabled():
+    return xbmcaddon.Addon().getSetting('thumb_cache') != 'false'
+
+
+def _prefetch(thumbs):
+    try:
+        ThumbnailCache().prefetch(thumbs)
+    except Exception as e:
+        xbmc.log(f"[MisFavoritos] Thumbnail prefetch failed: {type(e).__name__}: {e}", level=xbmc.LOGERROR)
+
+
+def prefetch_thumbnails(thumbs):
+    """
+    Cache the art of newly added or edited items in a background thread,
+    so the add, edit or import returns without waiting on remote servers.
+    Never fails the caller. Returns the thread, or None if there is
+    nothing to fetch.
+    """
+    thumbs = [t for t in thumbs if is_cacheable(t)]
+    if not thumbs or not thumbnail_cache_enabled():
+        return None
+    # Not a daemon: the call's interpreter lets it finish before exiting,
+    # once the action has already returned to Kodi
+    thread = threading.Thread(target=_prefetch, args=(thumbs,), name='MisFavoritosThumbnails')
+    thread.start()
+    return thread
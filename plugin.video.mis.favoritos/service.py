@@ -0,0 +1,4 @@
+from resources.lib.storage_service import run_service
+
+if __name__ == '__main__':
+    run_service()
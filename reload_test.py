@@ -0,0 +1,134 @@
+"""
+Reload test: what JSONStorage saves next to the library.
+
+Each plugin call is a fresh process that opens the library from disk, so
+the structures derived from the tree must come back from their saved
+copies, kept current by every kind of write, instead of being rebuilt
+over the whole tree on each call. Opens a new JSONStorage for every
+"call" and counts the full builds. Runs in a temporary directory, never
+on real data.
+
+    python reload_test.py [--backend json|journal]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def check(ok, message):
+    print(f"[{'PASS' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def counting(cls, method, counts, name, when=lambda *args, **kwargs: True):
+    """Wrap cls.method so each call for which when() holds adds one to counts[name]."""
+    original = getattr(cls, method)
+
+    def wrapper(*args, **kwargs):
+        if when(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+        return original(*args, **kwargs)
+    setattr(cls, method, wrapper)
+
+
+def child(storage, folder_id, name):
+    return next(node['id'] for node in storage.get_folder_contents(folder_id) if node['name'] == name)
+
+
+def run(backend):
+    os.chdir(tempfile.mkdtemp(prefix=f'misfav-reload-{backend}-'))
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'plugin.video.mis.favoritos')]
+    import mock_kodi  # noqa: F401
+    from resources.lib.search_index import SearchIndex
+    from resources.lib.storage import FolderStats, JSONStorage, UrlIndex, add_unique_item
+
+    counts = {}
+    counting(SearchIndex, 'build', counts, 'search')
+    counting(FolderStats, '__init__', counts, 'stats', lambda self, root, parents, saved=None: saved is None)
+    counting(UrlIndex, '__init__', counts, 'urls', lambda self, nodes, saved=None: saved is None)
+    call = lambda: JSONStorage(journal=backend == 'journal')  # noqa: E731
+    ok = True
+
+    storage = call()
+    with storage.transaction():
+        for name in ('Películas', 'Series', 'Música'):
+            storage.add_folder('root', name)
+    films, series = child(storage, 'root', 'Películas'), child(storage, 'root', 'Series')
+    with storage.transaction():
+        for n in range(20):
+            storage.add_item(films if n % 2 else series, f'Título {n}', f'plugin://reload/?n={n}', '')
+    storage.search('titulo')
+    ok &= check(counts.get('search') == 1, f"{backend}: search index built once and saved")
+
+    # Writes that change no tokens, each in its own call
+    call().move_item(child(call(), series, 'Título 0'), films)
+    call().set_folder_order(films, 'date')
+    call().move_folder(series, films)
+    storage = call()
+    storage.move_nodes([child(storage, films, 'Título 1'), child(storage, films, 'Título 3')], 'root')
+    found = {node['name'] for node, _ in call().search('titulo 1')}
+    ok &= check(counts['search'] == 1 and {'Título 1', 'Título 10', 'Título 19'} <= found,
+                f"{backend}: moves and reorders replayed from the log, not rebuilt ({counts['search'] - 1} rebuilds)")
+
+    # Folder aggregates come with the cache, and writes since (the journal) are applied to them
+    storage = call()
+    storage.compact()
+    storage._wait_compaction()
+    counts['stats'] = 0
+    call().add_item(films, 'Nuevo', 'plugin://reload/?new=1', '')
+    call().delete_item(child(call(), 'root', 'Título 1'))
+    stats = [call().get_folder_stats(['root', films]) for _ in range(2)]
+    builds = counts['stats']
+    ok &= check(builds == 0 and stats[0] == stats[1] and stats[0]['root']['total_items'] == 20
+                and stats[0][films]['items'] == 10 and not call().check_folder_stats(),
+                f"{backend}: folder aggregates loaded, not rebuilt, by later calls ({builds} builds)")
+
+    # So does the URL index the duplicate checks use
+    counts['urls'] = 0
+    added = [add_unique_item(call(), films, 'Otra vez', url, '', 'skip')[0]
+             for url in ('plugin://reload/?n=2', 'plugin://reload/?new=1', 'plugin://reload/?n=1', 'plugin://reload/?n=1')]
+    storage = call()
+    ok &= check(counts['urls'] == 0 and added == ['skipped', 'skipped', 'added', 'skipped']
+                and len(storage.find_duplicates()) == 0,
+                f"{backend}: URL index loaded, not rebuilt, by later calls ({counts['urls']} builds)")
+
+    # A library saved before folders had an ordering: reading it must not write
+    legacy = {'id': 'root', 'name': 'Root', 'type': 'folder', 'generation': 1, 'children': [
+        {'id': name, 'name': name, 'type': 'folder', 'children': []} for name in ('Zeta', 'alfa', 'Mu')]}
+    legacy['children'][0]['children'] = [{'id': f'z{n}', 'name': name, 'type': 'item', 'url': f'plugin://z/?{n}'}
+                                         for n, name in enumerate(('Ñu', 'nube', 'Oso', 'ala'))]
+    with open('favorites.json', 'w', encoding='utf-8') as f:
+        json.dump(legacy, f)
+    for path in ('favorites.journal', 'search.index', 'search.log'):
+        if os.path.exists(path):
+            os.remove(path)
+    storage = call()
+    storage.search('nube')
+    written = os.stat('favorites.json').st_mtime_ns
+    storage = call()
+    listed = ([node['name'] for node in storage.get_folder_contents('root')],
+              [node['name'] for node in storage.get_folder_contents('Zeta')])
+    outline = [name for _, name, _, _ in storage.get_folder_outline()]
+    ok &= check(listed == (['alfa', 'Mu', 'Zeta'], ['ala', 'nube', 'Ñu', 'Oso']) and outline == ['Root'] + listed[0]
+                and os.stat('favorites.json').st_mtime_ns == written and not os.path.exists('favorites.journal')
+                and storage.data['generation'] == 1,
+                f"{backend}: legacy folders listed and outlined by name without writing anything")
+    call().set_folder_order('Zeta', 'manual')
+    call().add_item('Zeta', 'Bisonte', 'plugin://z/?new', '')
+    found = {node['name'] for node, _ in call().search('bisonte')}
+    listed = [node['name'] for node in call().get_folder_contents('Zeta')]
+    ok &= check(listed == ['ala', 'nube', 'Ñu', 'Oso', 'Bisonte'] and found == {'Bisonte'} and counts['search'] == 2,
+                f"{backend}: made manual, a legacy folder keeps the name order it was shown in")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backend', choices=['json', 'journal'], action='append')
+    options = parser.parse_args()
+    ok = all([run(backend) for backend in options.backend or ['json', 'journal']])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,90 @@
+"""
+Storage service test: transactions that never end.
+
+Starts the storage service in this process and connects clients to it
+as the plugin does. A client that begins a transaction and then hangs,
+or drops its connection, must not keep the others waiting: its changes
+are rolled back and the storage is free again within the transaction
+timeout. Runs in a temporary directory, never on real data.
+
+    python service_test.py [--timeout 0.5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def check(ok, message):
+    print(f"[{'PASS' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def run(timeout):
+    os.chdir(tempfile.mkdtemp(prefix='misfav-service-'))
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'plugin.video.mis.favoritos')]
+    import mock_kodi  # noqa: F401
+    from resources.lib import storage_service
+    from resources.lib.storage import JSONStorage
+    from resources.lib.storage_service import RemoteStorage, StorageServer
+
+    storage_service.TRANSACTION_TIMEOUT = timeout
+    server = StorageServer(JSONStorage(journal=True))
+    server.start()
+    names = lambda: [node['name'] for node in RemoteStorage.connect().get_folder_contents('root')]  # noqa: E731
+    ok = True
+
+    def add_waiting(client, name):
+        """Seconds an add_folder by client waits for the storage."""
+        started = time.monotonic()
+        client.add_folder('root', name)
+        return time.monotonic() - started
+
+    committed = RemoteStorage.connect()
+    with committed.transaction():
+        committed.add_folder('root', 'Confirmada')
+        committed.add_folder('root', 'También')
+    ok &= check({'Confirmada', 'También'} <= set(names()), "transaction committed")
+
+    # Begins, writes, then hangs without ever committing
+    hung = RemoteStorage.connect()
+    hung._request('begin')
+    hung._request('add_folder', 'root', 'Colgada')
+    waited = add_waiting(RemoteStorage.connect(), 'Después de colgada')
+    ok &= check(timeout * 0.5 <= waited < timeout + 2,
+                f"a hung transaction holds the storage only until the timeout ({waited:.2f} s)")
+    ok &= check('Colgada' not in names() and 'Después de colgada' in names(), "the hung transaction rolled back")
+    try:
+        hung._request('commit')
+        ok &= check(False, "the hung client's connection was dropped")
+    except OSError:
+        ok &= check(True, "the hung client's connection was dropped")
+
+    # Begins, writes, then goes away: the storage is free at once
+    dropped = RemoteStorage.connect()
+    dropped._request('begin')
+    dropped._request('add_folder', 'root', 'Abandonada')
+    threading.Timer(timeout / 4, lambda: (dropped._file.close(), dropped._sock.close())).start()
+    waited = add_waiting(RemoteStorage.connect(), 'Después de abandonada')
+    ok &= check(waited < timeout * 0.75 and 'Abandonada' not in names() and 'Después de abandonada' in names(),
+                f"a dropped transaction rolled back and the storage freed when it closed ({waited:.2f} s)")
+
+    # Silence outside a transaction is fine: idle clients stay connected
+    idle = RemoteStorage.connect()
+    idle.get_folder_contents('root')
+    time.sleep(timeout * 1.5)
+    ok &= check(idle.add_folder('root', 'Sin prisa') and 'Sin prisa' in names(), "idle client still served")
+
+    server.stop()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--timeout', type=float, default=0.5, help='transaction timeout to test with, in seconds')
+    options = parser.parse_args()
+    sys.exit(0 if run(options.timeout) else 1)
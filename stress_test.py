@@ -0,0 +1,110 @@
+"""
+Multi-process stress test for the storage backends.
+
+Several processes add, move and rename favourites in the same library at
+once, each keeping its own long-lived storage instance (as the plugin and
+the context menu do). At the end every change must be on disk: no lost
+updates. Runs in a temporary directory, never on real data.
+
+    python stress_test.py [--backend json|journal|sqlite] [--processes 8] [--ops 200]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FOLDERS = [f'folder-{i}' for i in range(5)]
+
+
+def open_backend(backend):
+    # Imported here: DATA_PATH is resolved on import, relative to the working directory
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'plugin.video.mis.favoritos')]
+    import mock_kodi  # noqa: F401
+    if backend == 'sqlite':
+        from resources.lib.sqlite_storage import SQLiteStorage
+        return SQLiteStorage()
+    from resources.lib.storage import JSONStorage
+    return JSONStorage(journal=backend == 'journal')
+
+
+def marker_url(folder):
+    return f'plugin://stress/?folder={folder}'
+
+
+def worker(args):
+    """Run ops random mutations on this worker's own items; returns their expected final state."""
+    backend, workdir, worker_id, ops = args
+    os.chdir(workdir)
+    storage = open_backend(backend)
+    folder_ids = {name: storage.get_parent(storage.find_item_by_url(marker_url(name))['id'])['id']
+                  for name in FOLDERS}
+    rng = random.Random(worker_id)
+    expected = {}  # url -> (name, folder name)
+    for i in range(ops):
+        action = rng.random()
+        if not expected or action < 0.5:
+            url = f'plugin://stress/?worker={worker_id}&n={i}'
+            folder = rng.choice(FOLDERS)
+            assert storage.add_item(folder_ids[folder], f'w{worker_id} item {i}', url, '')
+            expected[url] = (f'w{worker_id} item {i}', folder)
+        elif action < 0.75:
+            url = rng.choice(list(expected))
+            folder = rng.choice(FOLDERS)
+            assert storage.move_item(storage.find_item_by_url(url)['id'], folder_ids[folder])
+            expected[url] = (expected[url][0], folder)
+        else:
+            url = rng.choice(list(expected))
+            name = f'w{worker_id} renamed {i}'
+            assert storage.rename_item(storage.find_item_by_url(url)['id'], name)
+            expected[url] = (name, expected[url][1])
+    return expected
+
+
+def run(backend, processes, ops):
+    workdir = tempfile.mkdtemp(prefix='misfav-stress-')
+    os.chdir(workdir)
+    storage = open_backend(backend)
+    with storage.transaction():
+        for name in FOLDERS:
+            storage.add_folder('root', name)
+    # A marker item in each folder lets workers find the folder ids by URL
+    with storage.transaction():
+        for folder_id, name, _ in storage.get_all_folders_flat()[1:]:
+            storage.add_item(folder_id, 'marker', marker_url(name), '')
+    del storage
+
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = pool.map(worker, [(backend, workdir, w, ops) for w in range(processes)])
+    elapsed = time.perf_counter() - start
+
+    storage = open_backend(backend)
+    lost = 0
+    total = 0
+    for expected in results:
+        for url, (name, folder) in expected.items():
+            total += 1
+            item = storage.find_item_by_url(url)
+            parent = storage.get_parent(item['id']) if item else None
+            if item is None or item['name'] != name or parent['name'] != folder:
+                lost += 1
+    writes = processes * ops
+    status = 'PASS' if lost == 0 else 'FAIL'
+    print(f"[{status}] {backend}: {processes} processes x {ops} ops, {total} items checked, "
+          f"{lost} lost updates, {writes / elapsed:.0f} writes/s ({elapsed:.2f} s)")
+    return lost == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backend', choices=['json', 'journal', 'sqlite'], action='append')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=200)
+    options = parser.parse_args()
+    ok = all([run(backend, options.processes, options.ops)
+              for backend in options.backend or ['json', 'journal', 'sqlite']])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,194 @@
+"""
+Thumbnail cache test and benchmark.
+
+A local HTTP server stands in for the sites favourites take their art
+from, a couple of them broken. 500 favourites are added to one folder;
+the test checks that their art is cached in the background as local
+content-addressed copies, that a broken server only loses its own art,
+that eviction keeps the cache under its cap, and times rendering the
+folder in poster view with and without the cache. Rendering counts what Kodi does with a
+cold texture cache: list the folder, then load every poster it points at.
+Runs in a temporary directory, never on real data.
+
+    python thumbnail_test.py [--items 500] [--latency 20]
+"""
+import argparse
+import functools
+import http.server
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import zlib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_png(seed, width=160, height=240):
+    """A noisy (so incompressible, ~115 KB) RGB PNG, without needing PIL."""
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b''))
+
+
+class SlowHandler(http.server.SimpleHTTPRequestHandler):
+    latency = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path == '/drop.png':
+            # Connection closed without a response: RemoteDisconnected
+            self.close_connection = True
+            return
+        if self.path == '/short.png':
+            # Body shorter than announced: IncompleteRead
+            self.send_response(200)
+            self.send_header('Content-Length', '100000')
+            self.end_headers()
+            self.wfile.write(make_png(0)[:1000])
+            self.close_connection = True
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(directory, latency):
+    handler = functools.partial(SlowHandler, directory=directory)
+    SlowHandler.latency = latency
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def render(listing, folder_id, captured, thumbnails_path):
+    """List the folder, then load every poster like Kodi's texture loader."""
+    start = time.perf_counter()
+    captured.clear()
+    listing.list_folder(folder_id)
+    for _, li, _ in captured:
+        poster = li.art.get('poster', '')
+        if poster.startswith('http'):
+            with urllib.request.urlopen(poster) as response:
+                response.read()
+        elif poster.startswith(thumbnails_path):
+            with open(poster, 'rb') as f:
+                f.read()
+    return time.perf_counter() - start
+
+
+def check(ok, message):
+    print(f"[{'PASS' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def run(items, latency):
+    workdir = tempfile.mkdtemp(prefix='misfav-thumbs-')
+    images = os.path.join(workdir, 'images')
+    os.makedirs(images)
+    # Every tenth favourite reuses an earlier image under another URL
+    for i in range(items):
+        if i % 10:
+            with open(os.path.join(images, f'{i}.png'), 'wb') as f:
+                f.write(make_png(i))
+    big = make_png(0, 1200, 1800)
+    with open(os.path.join(images, 'big.png'), 'wb') as f:
+        f.write(big)
+    os.chdir(workdir)
+    server = serve(images, latency / 1000)
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'plugin.video.mis.favoritos')]
+    sys.argv = ['plugin://plugin.video.mis.favoritos/', '1', '']
+    import mock_kodi  # noqa: F401
+    import xbmcplugin
+    from resources.lib import listing, thumbnails
+    from resources.lib.storage import JSONStorage
+
+    captured = []
+    xbmcplugin.addDirectoryItems = lambda handle, entries, total=0: captured.extend(entries) or True
+    listing.get_storage = functools.lru_cache(None)(lambda: JSONStorage())
+
+    storage = listing.get_storage()
+    storage.add_folder('root', 'Posters')
+    folder_id = storage.get_all_folders_flat()[1][0]
+    favourites = [{'name': f'Película {i}', 'url': f'plugin://video/?id={i}',
+                   'thumbnail': f'{base}/{i if i % 10 else i - 1}.png'} for i in range(1, items + 1)]
+    favourites[0]['thumbnail'] = f'{base}/1.png'
+
+    ok = True
+    # Without the cache: posters are the remote URLs
+    mock_kodi.MockXBMCAddon.Addon.getSetting = lambda self, id: 'false' if id == 'thumb_cache' else ''
+    with storage.transaction():
+        for fav in favourites:
+            storage.add_item(folder_id, fav['name'], fav['url'], fav['thumbnail'])
+    uncached = render(listing, folder_id, captured, thumbnails.THUMBS_PATH)
+
+    # Cache on: art is fetched in the background, as after an import or add;
+    # broken servers must not take the rest down with them
+    mock_kodi.MockXBMCAddon.Addon.getSetting = lambda self, id: ''
+    failures = []
+    threading.excepthook = failures.append
+    start = time.perf_counter()
+    thread = thumbnails.prefetch_thumbnails([f'{base}/drop.png', f'{base}/short.png']
+                                            + [fav['thumbnail'] for fav in favourites])
+    returned = time.perf_counter() - start
+    thread.join()
+    prefetch_time = time.perf_counter() - start
+    cache = thumbnails.ThumbnailCache()
+    files = {entry[0] for entry in cache.entries.values()}
+    unique = len({fav['thumbnail'] for fav in favourites})
+    ok &= check(returned < 0.1 and len(cache.entries) == unique and not failures,
+                f"{len(cache.entries)} of {unique} thumbnails fetched in {prefetch_time:.2f} s in the background, "
+                f"returned after {returned * 1000:.1f} ms; broken servers skipped")
+    ok &= check(len(files) == len({f.rsplit('/', 1)[1] for f in (fav['thumbnail'] for fav in favourites)}),
+                f"{len(files)} content-addressed files for {unique} URLs")
+
+    # Art bigger than the poster box is stored downscaled, keeping its aspect
+    if thumbnails.Image is None:
+        ok &= check(False, "art downscaled: needs PIL (pip install pillow; Kodi has it from script.module.pil)")
+    else:
+        name, size = thumbnails._fetch(f'{base}/big.png')
+        with thumbnails.Image.open(os.path.join(thumbnails.THUMBS_PATH, name)) as image:
+            ok &= check(image.size == thumbnails.THUMB_BOX and name.endswith('.jpg') and size < len(big) // 10,
+                        f"{len(big) // 1024} KB 1200x1800 art stored as a {size // 1024} KB "
+                        f"{image.size[0]}x{image.size[1]} copy")
+
+    cached = render(listing, folder_id, captured, thumbnails.THUMBS_PATH)
+    posters = [li.art.get('poster', '') for _, li, is_folder in captured if not is_folder and li.art.get('poster')]
+    ok &= check(bool(posters) and all(p.startswith(thumbnails.THUMBS_PATH) for p in posters),
+                f"list_folder points {len(posters)} posters at local copies")
+
+    # Eviction: a cap of half the cache drops the least recently used files
+    total = sum(entry[1] for entry in {e[0]: e for e in cache.entries.values()}.values())
+    small = thumbnails.ThumbnailCache(max_bytes=total // 2)
+    small._write_index({})
+    kept = {entry[0] for entry in small.entries.values()}
+    on_disk = sum(os.path.getsize(os.path.join(thumbnails.THUMBS_PATH, name)) for name in kept)
+    ok &= check(on_disk <= total // 2 and len(kept) < len(files),
+                f"eviction kept {len(kept)} of {len(files)} files, {on_disk // 1024} KB <= {total // 2048} KB cap")
+    ok &= check(all(os.path.exists(os.path.join(thumbnails.THUMBS_PATH, name)) == (name in kept) for name in files),
+                "evicted files removed from disk")
+
+    print(f"[INFO] {items}-item poster folder, {latency} ms per remote image: "
+          f"render {uncached * 1000:.0f} ms uncached, {cached * 1000:.0f} ms from the cache")
+    server.shutdown()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--latency', type=int, default=20, help='simulated remote latency per image (ms)')
+    options = parser.parse_args()
+    sys.exit(0 if run(options.items, options.latency) else 1)
@@ -0,0 +1,479 @@
+"""
+Benchmark suite for plugin.video.mis.favoritos.
+
+Generates a synthetic library from a seed, then runs plugin modes
+through default.main() (and the context menu script) under the mocks,
+each call in a fresh interpreter as Kodi does. For every mode it reports,
+as JSON:
+
+  cold  the first call on a library with no derived files on disk
+        (binary tree cache, folder outline, search index)
+  warm  the following calls, with those files in place
+
+with the time spent importing and running the addon, how it splits into
+phases (as the addon's own timing of each routed call logs it), the
+whole process time, the peak memory traced by tracemalloc (on a separate run, since
+tracing slows everything down) and the bytes written to the data
+directory (counted from the process's write calls where the OS reports
+them). --compare flags regressions against an earlier result file.
+Runs in a temporary directory, never on real data.
+
+    python tools/benchmark.py [--items 20000] [--fanout 6] [--depth 3] [--seed 1]
+                              [--backend json|journal|sqlite] [--runs 3] [--mode list_root ...]
+                              [--output results.json] [--compare baseline.json]
+    python tools/benchmark.py --write-library favorites.json [--items ...]
+"""
+import argparse
+import ast
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from xml.sax.saxutils import quoteattr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = os.path.join(ROOT, 'plugin.video.mis.favoritos')
+# Where the harness keeps special://profile/addon_data/<addon> and special://profile/favourites.xml
+DATA_DIR = os.path.join('profile', 'addon_data', 'plugin.video.mis.favoritos')
+FAVOURITES_XML = os.path.join('profile', 'favourites.xml')
+
+# Files the addon derives from the library or keeps beside it; removed for cold runs
+DERIVED = ('favorites.cache', 'folders.outline', 'search.index', 'search.log', 'storage.stats', 'storage.stats.log',
+           'thumbs')
+
+WORDS = ['película', 'serie', 'capítulo', 'documental', 'niños', 'año', 'acción', 'comedia', 'drama', 'música',
+         'directo', 'canal', 'noticias', 'deportes', 'fútbol', 'cocina', 'viaje', 'historia', 'ciencia', 'animación',
+         'clásico', 'estreno', 'temporada', 'episodio', 'concierto', 'entrevista', 'Ñandú', 'Ávila', 'Óscar', 'zona',
+         'the', 'night', 'river', 'king', 'last', 'world', 'season', 'live', 'show', 'best']
+NAME_STYLES = ('short', 'long', 'mixed')
+URL_STYLES = ('plugin', 'http', 'mixed')
+
+# Each mode: the plugin query to run (None: the context menu script) and
+# the scripted keyboard and dialog answers ('all': every option of a
+# multiselect). {k} is the run number, the rest come from the generated
+# library. Every mode default.py routes needs one: checked on start.
+MODES = {
+    'list_default': {'query': {}},
+    'list_root': {'query': {'mode': 'folder', 'folder_id': 'root'}},
+    'list_large': {'query': {'mode': 'folder', 'folder_id': '{hot}'}},
+    'search': {'query': {'mode': 'search', 'query': '{word}'}},
+    'add_folder': {'query': {'mode': 'add_folder', 'folder_id': 'root'}, 'answers': {'keyboard': ['Nueva carpeta {k}']}},
+    'add': {'query': {'mode': 'add_item', 'folder_id': '{hot}'},
+            'answers': {'keyboard': ['Nuevo favorito {k}', 'plugin://plugin.video.bench/?new={k}']}},
+    'rename': {'query': {'mode': 'rename_item', 'item_id': '{item}'}, 'answers': {'keyboard': ['Renombrado {k}']}},
+    'edit': {'query': {'mode': 'edit_item', 'item_id': '{item}'},
+             'answers': {'keyboard': ['Editado {k}', 'plugin://plugin.video.bench/?edited={k}', '']}},
+    'move': {'query': {'mode': 'move_item', 'item_id': '{item}'}, 'answers': {'select': [1]}},
+    'delete': {'query': {'mode': 'delete_item', 'item_id': '{item}'}, 'answers': {'yesno': [True]}},
+    'rename_folder': {'query': {'mode': 'rename_folder', 'item_id': '{leaf}'},
+                      'answers': {'keyboard': ['Carpeta renombrada {k}']}},
+    'set_order': {'query': {'mode': 'set_order', 'item_id': '{hot}'}, 'answers': {'select': [1]}},
+    'move_folder': {'query': {'mode': 'move_folder', 'item_id': '{leaf}'}, 'answers': {'select': [0]}},
+    'delete_folder': {'query': {'mode': 'delete_folder', 'item_id': '{leaf}'}, 'answers': {'yesno': [True]}},
+    'multi_move': {'query': {'mode': 'multi_move', 'folder_id': '{leaf}'},
+                   'answers': {'multiselect': ['all'], 'select': [1]}},
+    'multi_copy': {'query': {'mode': 'multi_copy', 'folder_id': '{leaf}'},
+                   'answers': {'multiselect': ['all'], 'select': [1]}},
+    'multi_rename': {'query': {'mode': 'multi_rename', 'folder_id': '{leaf}'},
+                     'answers': {'multiselect': ['all'], 'keyboard': ['{{n}} {k} - {{name}}']}},
+    'multi_delete': {'query': {'mode': 'multi_delete', 'folder_id': '{leaf}'},
+                     'answers': {'multiselect': ['all'], 'yesno': [True]}},
+    'import': {'query': {'mode': 'import_kodi', 'folder_id': 'root'},
+               'answers': {'multiselect': ['all'], 'yesno': [True]}},
+    'sync_folder': {'query': {'mode': 'sync_folder'}, 'answers': {'select': [1]}},
+    'dedupe': {'query': {'mode': 'dedupe'}, 'answers': {'yesno': [True]}},
+    'diagnostics': {'query': {'mode': 'diagnostics'}},
+    'rebuild_storage': {'query': {'mode': 'rebuild_storage'}, 'answers': {'yesno': [True]}},
+    'context_add': {'query': None, 'answers': {'select': [1]},
+                    'item': {'label': 'Desde el menú {k}', 'path': 'plugin://plugin.video.bench/?context={k}'}},
+}
+
+IMPORT_BATCH = 200
+
+# Timing differences below this are noise, whatever the ratio
+NOISE_SECONDS = 0.005
+
+
+def _name(rng, style):
+    if style == 'mixed':
+        style = rng.choice(NAME_STYLES[:2])
+    words = rng.sample(WORDS, rng.randint(1, 2) if style == 'short' else rng.randint(4, 8))
+    name = ' '.join(words)
+    return name.capitalize() if rng.random() < 0.5 else name
+
+
+def _url(rng, style, n):
+    if style == 'mixed':
+        style = rng.choice(URL_STYLES[:2])
+    if style == 'plugin':
+        return f'plugin://plugin.video.{rng.choice(WORDS[:10])}/?action=play&id={n}&t={rng.randrange(10 ** 6)}'
+    return f'https://www.{rng.choice(WORDS[:10])}.example/watch/{n}?v={rng.randrange(10 ** 9):x}'
+
+
+def generate_library(items, fanout=6, depth=3, seed=1, names='mixed', urls='mixed', duplicates=0.0, hot=0.1):
+    """
+    A synthetic library tree, the same for the same arguments: a full
+    tree of folders, fanout per folder and depth levels below Root, with
+    items spread over them at random, a `hot` share of them all in one
+    folder. `duplicates` is the share of items reusing an earlier URL.
+    Returns (tree, info), info naming the nodes the modes act on.
+    """
+    # Sort keys as the addon computes them, so folders are stored in order
+    sys.path[:0] = [ROOT, PLUGIN_DIR]
+    with contextlib.redirect_stdout(sys.stderr):  # Keep stdout for the report
+        import mock_kodi  # noqa: F401
+    from resources.lib.storage import collation_key
+
+    rng = random.Random(seed)
+
+    def new_id():
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    added = 1600000000
+    root = {'id': 'root', 'name': 'Root', 'type': 'folder', 'children': [], 'order': 'name'}
+    folders = [root]
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(fanout):
+                added += 1
+                folder = {'id': new_id(), 'name': _name(rng, 'short').capitalize(), 'type': 'folder',
+                          'children': [], 'added': added, 'order': 'name'}
+                parent['children'].append(folder)
+                next_level.append(folder)
+        folders.extend(next_level)
+        level = next_level
+    hot_folder = level[-1]
+
+    seen_urls = []
+    for n in range(items):
+        if seen_urls and rng.random() < duplicates:
+            url = rng.choice(seen_urls)
+        else:
+            url = _url(rng, urls, n)
+            seen_urls.append(url)
+        thumbnail = f'https://img.example/{rng.randrange(10 ** 9):x}.jpg' if rng.random() < 0.5 else ''
+        parent = hot_folder if rng.random() < hot else rng.choice(folders)
+        parent['children'].append({'id': new_id(), 'name': _name(rng, names), 'type': 'item', 'url': url,
+                                    'thumbnail': thumbnail, 'added': added + rng.randrange(10 ** 8)})
+
+    for folder in folders:
+        folder['children'].sort(key=lambda node: (node['type'] != 'folder', collation_key(node['name'])))
+    leaves = [folder for folder in level if folder is not hot_folder]
+    info = {
+        'items': items,
+        'folders': len(folders) - 1,
+        'hot': hot_folder['id'],
+        'hot_items': [node['id'] for node in hot_folder['children'] if node['type'] == 'item'],
+        'leaves': [folder['id'] for folder in leaves],
+        'word': WORDS[0],
+    }
+    return root, info
+
+
+def write_favourites_xml(path, batch, seed):
+    """A Kodi favourites.xml with IMPORT_BATCH favourites not in the library."""
+    rng = random.Random(f'{seed}-import-{batch}')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<favourites>\n')
+        for n in range(IMPORT_BATCH):
+            url = f'PlayMedia(&quot;plugin://plugin.video.kodi/?import={batch}.{n}&quot;)'
+            f.write(f'    <favourite name={quoteattr(_name(rng, "short"))} thumb="">{url}</favourite>\n')
+        f.write('</favourites>\n')
+
+
+# --- Child process: one plugin call -------------------------------------
+
+def route_modes():
+    """The modes default.py's ROUTES table dispatches, read without importing it."""
+    with open(os.path.join(PLUGIN_DIR, 'default.py'), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    table = next(node.value for node in tree.body
+                 if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'ROUTES')
+    return {ast.literal_eval(key) for key in table.keys}
+
+
+def parse_timing(line):
+    """{phase: ms} from the addon's 'Timing mode=... 84.1 ms: import 12.0, load 30.2, ...' log line."""
+    phases = line.partition(' ms: ')[2]
+    return {name: float(ms) for name, ms in (part.rsplit(' ', 1) for part in phases.split(', '))}
+
+
+def _write_syscall_bytes():
+    """Bytes this process has passed to write calls so far, where the OS reports it (Linux), else None."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('wchar:'))
+    except (OSError, StopIteration, ValueError):
+        return None
+
+
+def run_child(spec):
+    """Run one plugin call as described by spec; prints the measurements as JSON."""
+    import tracemalloc
+    sys.path[:0] = [ROOT, PLUGIN_DIR]
+    from mock_kodi import KodiHarness
+    kodi = KodiHarness(path=spec['data'], settings=spec['settings']).install()
+    timings = []
+    log = sys.modules['xbmc'].log
+
+    def keep_timing(msg, *args, **kwargs):
+        if '] Timing mode=' in msg:
+            timings.append(parse_timing(msg))
+        return log(msg, *args, **kwargs)
+
+    sys.modules['xbmc'].log = keep_timing
+    for kind, values in spec['answers'].items():
+        kodi.answer(kind, *[(lambda heading, options: list(range(len(options)))) if value == 'all' else value
+                            for value in values])
+    if spec['trace']:
+        tracemalloc.start()
+    written = _write_syscall_bytes()
+    start = time.perf_counter()
+    if spec['query'] is None:
+        kodi.run_context_menu(**spec['item'])
+    else:
+        kodi.run(**spec['query'])
+    seconds = time.perf_counter() - start
+    if written is not None:
+        written = _write_syscall_bytes() - written
+    peak = tracemalloc.get_traced_memory()[1] if spec['trace'] else None
+    print(json.dumps({'seconds': seconds, 'peak_bytes': peak, 'bytes_written': written,
+                      'phases_ms': timings[-1] if timings else {},
+                      'entries': sum(len(listing['items']) for listing in kodi.directories),
+                      'notifications': [message for _, message, _ in kodi.notifications]}))
+
+
+# --- Parent process ------------------------------------------------------
+
+def _disk_state(path):
+    state = {}
+    for folder, _, files in os.walk(path):
+        for name in files:
+            st = os.stat(os.path.join(folder, name))
+            state[os.path.join(folder, name)] = (st.st_ino, st.st_mtime_ns, st.st_size)
+    return state
+
+
+def _bytes_written(before, after):
+    """
+    Estimate of the bytes written between two disk states, where the
+    write calls can't be counted: appended bytes, or the whole file if
+    replaced or rewritten.
+    """
+    written = 0
+    for path, (ino, mtime, size) in after.items():
+        old = before.get(path)
+        if old == (ino, mtime, size):
+            continue
+        if old is not None and old[0] == ino and size > old[2]:
+            written += size - old[2]
+        else:
+            written += size
+    return written
+
+
+def _fill(template, values):
+    if isinstance(template, dict):
+        return {key: _fill(value, values) for key, value in template.items()}
+    if isinstance(template, list):
+        return [_fill(value, values) for value in template]
+    if isinstance(template, str):
+        return template.format(**values)
+    return template
+
+
+class Bench:
+    def __init__(self, options):
+        self.options = options
+        self.workdir = tempfile.mkdtemp(prefix='misfav-bench-')
+        self.pristine = os.path.join(self.workdir, 'pristine')
+        library = os.path.join(self.pristine, DATA_DIR, 'favorites.json')
+        os.makedirs(os.path.dirname(library))
+        tree, self.info = generate_library(options.items, options.fanout, options.depth, options.seed,
+                                           options.names, options.urls, options.duplicates, options.hot)
+        with open(library, 'w', encoding='utf-8') as f:
+            json.dump(tree, f, indent=2, ensure_ascii=False)
+        self.info['library_bytes'] = os.path.getsize(library)
+        self.settings = {'backend': '1' if options.backend == 'sqlite' else '0',
+                         'journal': 'true' if options.backend == 'journal' else 'false',
+                         'service': 'false', 'profiling': '1'}
+        if options.backend == 'sqlite':
+            # The one-time migration is not part of any mode
+            self.call(self.pristine, MODES['list_root'])
+            for name in DERIVED:
+                self._remove(os.path.join(self.pristine, DATA_DIR, name))
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def call(self, data, mode, k=0, trace=False):
+        """Run one plugin call in a fresh interpreter; returns its measurements."""
+        values = {'k': k, 'hot': self.info['hot'], 'word': self.info['word'],
+                  'item': self.info['hot_items'][k % len(self.info['hot_items'])],
+                  'leaf': self.info['leaves'][k % len(self.info['leaves'])]}
+        spec = {
+            'data': data,
+            'query': _fill(mode['query'], values),
+            'settings': self.settings,
+            'answers': _fill(mode.get('answers', {}), values),
+            'item': _fill(mode.get('item'), values),
+            'trace': trace,
+        }
+        if spec['query'] and spec['query'].get('mode') == 'import_kodi':
+            write_favourites_xml(os.path.join(data, FAVOURITES_XML), k, self.options.seed)
+        before = _disk_state(data)
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        process_seconds = time.perf_counter() - start
+        if process.returncode != 0:
+            raise RuntimeError(f"{spec['query']} failed:\n{process.stderr}")
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result['process_seconds'] = process_seconds
+        if result['bytes_written'] is None:
+            result['bytes_written'] = _bytes_written(before, _disk_state(data))
+        return result
+
+    def fresh_copy(self, name):
+        path = os.path.join(self.workdir, name)
+        self._remove(path)
+        shutil.copytree(self.pristine, path)
+        return path
+
+    def measure(self, name):
+        mode = MODES[name]
+        runs = self.options.runs
+        # Cold: every call on its own copy of the library, without derived files
+        cold = [self.call(self.fresh_copy(name), mode) for _ in range(runs)]
+        cold_peak = self.call(self.fresh_copy(name), mode, trace=True)['peak_bytes']
+        # Warm: further calls on the last copy, which now has them
+        data = self.fresh_copy(name)
+        self.call(data, mode)
+        warm = [self.call(data, mode, k) for k in range(1, runs + 1)]
+        warm_peak = self.call(data, mode, runs + 1, trace=True)['peak_bytes']
+        return {'cold': summarize(cold, cold_peak), 'warm': summarize(warm, warm_peak)}
+
+
+def summarize(results, peak_bytes):
+    seconds = [r['seconds'] for r in results]
+    return {
+        'seconds': {'median': statistics.median(seconds), 'min': min(seconds), 'max': max(seconds)},
+        'process_seconds': statistics.median(r['process_seconds'] for r in results),
+        'phases_ms': {name: round(statistics.median(r['phases_ms'].get(name, 0.0) for r in results), 1)
+                      for name in sorted(set().union(*(r['phases_ms'] for r in results)))},
+        'peak_kb': round(peak_bytes / 1024),
+        'bytes_written': round(statistics.median(r['bytes_written'] for r in results)),
+        'entries': results[-1]['entries'],
+        'notifications': results[-1]['notifications'],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Print each metric against the baseline; returns False if any regressed past threshold."""
+    ok = True
+    for name, phases in current['results'].items():
+        for phase, metrics in phases.items():
+            old = baseline.get('results', {}).get(name, {}).get(phase)
+            if old is None:
+                continue
+            for metric, new_value, old_value in (
+                    ('seconds', metrics['seconds']['median'], old['seconds']['median']),
+                    ('peak_kb', metrics['peak_kb'], old['peak_kb']),
+                    ('bytes_written', metrics['bytes_written'], old['bytes_written'])):
+                ratio = new_value / old_value if old_value else (1.0 if not new_value else float('inf'))
+                regressed = ratio > threshold and not (metric == 'seconds' and new_value - old_value < NOISE_SECONDS)
+                ok &= not regressed
+                print(f"[{'FAIL' if regressed else 'PASS'}] {name} {phase} {metric}: "
+                      f"{old_value:.4g} -> {new_value:.4g} ({ratio:.2f}x)", file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--fanout', type=int, default=6, help='subfolders per folder')
+    parser.add_argument('--depth', type=int, default=3, help='folder levels below Root')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--names', choices=NAME_STYLES, default='mixed', help='item names: 1-2 words, 4-8 or both')
+    parser.add_argument('--urls', choices=URL_STYLES, default='mixed', help='plugin:// URLs, web URLs or both')
+    parser.add_argument('--duplicates', type=float, default=0.02, help='share of items reusing an earlier URL')
+    parser.add_argument('--hot', type=float, default=0.1, help='share of items in the one large folder')
+    parser.add_argument('--backend', choices=['json', 'journal', 'sqlite'], default='json')
+    parser.add_argument('--runs', type=int, default=3, help='timed calls per mode, cold and warm')
+    parser.add_argument('--mode', choices=sorted(MODES), action='append', help='modes to run (default: all)')
+    parser.add_argument('--output', help='write the results here instead of stdout')
+    parser.add_argument('--compare', help='earlier results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='ratio to the baseline counted as a regression')
+    parser.add_argument('--write-library', metavar='PATH', help='only write the generated favorites.json to PATH')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        run_child(json.loads(options.child))
+        return 0
+    if options.write_library:
+        tree, info = generate_library(options.items, options.fanout, options.depth, options.seed,
+                                      options.names, options.urls, options.duplicates, options.hot)
+        with open(options.write_library, 'w', encoding='utf-8') as f:
+            json.dump(tree, f, indent=2, ensure_ascii=False)
+        print(f"{info['items']} items in {info['folders']} folders written to {options.write_library}", file=sys.stderr)
+        return 0
+
+    unmeasured = route_modes() - {mode['query'].get('mode') for mode in MODES.values() if mode['query'] is not None}
+    if unmeasured:
+        parser.error(f"modes routed by default.py with no entry in MODES: {sorted(unmeasured, key=str)}")
+    bench = Bench(options)
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': options.backend,
+        'library': {key: getattr(options, key) for key in
+                    ('items', 'fanout', 'depth', 'seed', 'names', 'urls', 'duplicates', 'hot')},
+        'library_bytes': bench.info['library_bytes'],
+        'folders': bench.info['folders'],
+        'runs': options.runs,
+        'results': {},
+    }
+    for name in options.mode or list(MODES):
+        print(f"{name}...", file=sys.stderr)
+        report['results'][name] = bench.measure(name)
+    shutil.rmtree(bench.workdir)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if options.compare:
+        with open(options.compare, 'r', encoding='utf-8') as f:
+            if not compare(json.load(f), report, options.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Benchmark of tools/update_repo.py on a repository of many addons.
+
+Generates, from a seed, a source tree of synthetic addons (copies of
+plugin.video.mis.favoritos under their own ids, each with a media file of
+seeded size so some go through the parallel deflate), then times the
+repository builds a release goes through, as JSON:
+
+  cold_serial    every addon packaged in this process (--jobs 1)
+  cold_parallel  every addon packaged in the process pool
+  noop           nothing changed since the last build
+  edit_one       one file of one addon changed
+  bump_one       one addon released under a new version (prunes and
+                 rewrites that addon's index page)
+
+Each scenario runs --runs times and reports the median seconds and the
+slowest run. Runs in a temporary directory, never on the real repository.
+
+    python tools/benchmark_repo.py [--addons 50] [--seed 1] [--runs 3] [--jobs N] [--output results.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+import update_repo
+from benchmark import PLUGIN_DIR, WORDS, git_commit
+
+# Media file per addon: words from the benchmark's vocabulary, between these sizes
+MEDIA_BYTES = (16 * 1024, 2 * 1024 * 1024)
+
+
+def generate_addons(source_root, count, seed=1):
+    """count addons under source_root, plugin.video.bench.NNN, each a copy of the real addon plus a media file."""
+    rng = random.Random(seed)
+    template = update_repo.list_addon_files(PLUGIN_DIR)
+    total = 0
+    for n in range(count):
+        addon_id = f"plugin.video.bench.{n:03d}"
+        plugin_src = os.path.join(source_root, addon_id)
+        for rel_path in template:
+            os.makedirs(os.path.dirname(os.path.join(plugin_src, rel_path)), exist_ok=True)
+            shutil.copyfile(os.path.join(PLUGIN_DIR, rel_path), os.path.join(plugin_src, rel_path))
+        set_version(plugin_src, f"1.0.{rng.randrange(10)}", addon_id)
+        size = int(MEDIA_BYTES[0] * (MEDIA_BYTES[1] / MEDIA_BYTES[0]) ** rng.random())
+        # Words average over 5 bytes with their space: enough of them to fill size
+        media = ' '.join(rng.choice(WORDS) for _ in range(size // 5)).encode('utf-8')[:size]
+        os.makedirs(os.path.join(plugin_src, 'resources', 'media'), exist_ok=True)
+        with open(os.path.join(plugin_src, 'resources', 'media', 'notes.txt'), 'wb') as f:
+            f.write(media)
+        total += sum(os.path.getsize(os.path.join(plugin_src, rel_path)) for rel_path in template) + len(media)
+    return total
+
+
+def set_version(plugin_src, version, addon_id=None):
+    path = os.path.join(plugin_src, 'addon.xml')
+    tree = ET.parse(path)
+    tree.getroot().set('version', version)
+    if addon_id:
+        tree.getroot().set('id', addon_id)
+    tree.write(path, encoding='UTF-8', xml_declaration=True)
+
+
+def build(source_root, repo_path, jobs=None, force=False):
+    """Seconds one build takes, and the addons it rebuilt; the tool's own output is dropped."""
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, rebuilt = update_repo.build_repository(source_root, repo_path, force=force, jobs=jobs)
+    return time.perf_counter() - started, rebuilt
+
+
+def measure(name, runs, prepare, source_root, repo_path, jobs):
+    seconds = []
+    rebuilt = set()
+    for k in range(1, runs + 1):
+        prepare(k)
+        elapsed, ids = build(source_root, repo_path, jobs)
+        seconds.append(elapsed)
+        rebuilt.update(ids)
+    print(f"{name}: {statistics.median(seconds):.3f} s", file=sys.stderr)
+    return {'median_s': round(statistics.median(seconds), 4), 'max_s': round(max(seconds), 4),
+            'addons_rebuilt': len(rebuilt)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--addons', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=3, help='builds per scenario')
+    parser.add_argument('--jobs', type=int, default=None, help='processes for the parallel builds (default: CPUs)')
+    parser.add_argument('--output', help='write the results here instead of stdout')
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='misfav-repo-bench-')
+    source_root = os.path.join(workdir, 'src')
+    repo_path = os.path.join(workdir, update_repo.REPO_DIR)
+    source_bytes = generate_addons(source_root, options.addons, options.seed)
+    edited = os.path.join(source_root, 'plugin.video.bench.000', 'resources', 'lib', 'common.py')
+    bumped = os.path.join(source_root, f"plugin.video.bench.{options.addons - 1:03d}")
+
+    def fresh(k):
+        shutil.rmtree(repo_path, ignore_errors=True)
+
+    def edit(k):
+        with open(edited, 'a', encoding='utf-8') as f:
+            f.write(f"# edit {k}\n")
+
+    def bump(k):
+        set_version(bumped, f"2.0.{k}")
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'addons': options.addons,
+        'seed': options.seed,
+        'source_bytes': source_bytes,
+        'runs': options.runs,
+        'results': {},
+    }
+    results = report['results']
+    results['cold_serial'] = measure('cold_serial', options.runs, fresh, source_root, repo_path, 1)
+    results['cold_parallel'] = measure('cold_parallel', options.runs, fresh, source_root, repo_path, options.jobs)
+    results['noop'] = measure('noop', options.runs, lambda k: None, source_root, repo_path, options.jobs)
+    results['edit_one'] = measure('edit_one', options.runs, edit, source_root, repo_path, options.jobs)
+    results['bump_one'] = measure('bump_one', options.runs + update_repo.KEEP_VERSIONS, bump, source_root, repo_path,
+                                  options.jobs)
+    bumped_dir = os.path.join(repo_path, os.path.basename(bumped))
+    report['zips_kept'] = len([name for name in os.listdir(bumped_dir) if name.endswith('.zip')])
+    report['repository_bytes'] = sum(os.path.getsize(os.path.join(root, name))
+                                     for root, _, names in os.walk(repo_path) for name in names)
+    shutil.rmtree(workdir)
+
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,500 @@
+"""
+Storage and rendering micro-benchmarks for plugin.video.mis.favoritos.
+
+Where tools/benchmark.py times whole plugin calls, these time the part of
+the addon a change was about, each scenario on seeded libraries from the
+same generator:
+
+  crossover   JSON against SQLite by library size: open (JSON both
+              without and with its cache), listing a large folder and a
+              rename, and the peak Python memory of open plus listing
+              (SQLite's own page cache is not traced); reports the size
+              from which SQLite opens and lists faster
+  cold_load   opening the JSON library as a fresh plugin call does:
+              json.loads of favorites.json alone, then JSONStorage with
+              and without its parsed-tree cache
+  render      the folder mode rendering a folder of about 5,000 entries
+              on a library opened beforehand, and the Kodi calls it makes
+  navigation  listing one big folder again and again, as browsing back
+              into it does, from a library saved before folders kept
+              their children in display order: the first listing, the
+              ones after it, and the storage call alone, 100 entries
+              a page
+  search      building the search index on the first search, its size
+              on disk, the first search of a plugin call (index loaded
+              from disk) and later ones, against the linear scan over
+              every name it replaces (queries return the first 200 hits)
+  picker      the folder list of the move and add pickers: from the
+              folder outline in memory, from folders.outline as the
+              context menu reads it, and get_all_folders_flat(); and
+              the library open the context menu no longer needs
+  bulk        moving and renaming 1,000 items in one change, against
+              moving 100 of them one move_item() call, and one save, at
+              a time (timed once)
+
+Each measurement runs in a fresh interpreter and its own temporary
+directory, importing the addon from --root (default: this checkout)
+under this checkout's Kodi mocks.
+For before and after numbers, run it again with --root on a git
+worktree of the commit before the change; scenarios that checkout
+doesn't support yet are reported as unsupported. Times are the best of
+--runs, in milliseconds.
+
+    python tools/benchmark_storage.py [--scenario crossover ...] [--sizes 1000 10000] [--runs 5]
+                                      [--seed 1] [--root CHECKOUT] [--output results.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import unicodedata
+import urllib.parse
+
+from benchmark import ROOT, generate_library, git_commit
+
+# Left in place between cold runs; everything else in the data directory is derived
+SOURCES = ('favorites.json', 'favorites.db')
+
+
+# --- Child process: one scenario variant on one library -----------------
+
+class Unsupported(Exception):
+    """The checkout being measured predates what the scenario needs."""
+
+
+def require(obj, name):
+    if not hasattr(obj, name):
+        raise Unsupported(f"{getattr(obj, '__name__', type(obj).__name__)} has no {name}")
+    return getattr(obj, name)
+
+
+def best(fn, runs, setup=None):
+    """Best of runs timings of fn(), in ms; setup() runs untimed before each."""
+    times = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return round(min(times) * 1000, 4)
+
+
+def peak_mb(fn):
+    """Peak traced Python memory while fn() runs, in MB."""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def remove_derived():
+    for name in os.listdir('.'):
+        if name not in SOURCES:
+            shutil.rmtree(name) if os.path.isdir(name) else os.remove(name)
+
+
+def child_crossover(spec):
+    runs, hot = spec['runs'], spec['hot']
+    if spec['variant'] == 'sqlite':
+        from resources.lib.sqlite_storage import SQLiteStorage
+        SQLiteStorage().db.close()  # The one-time migration is not measured
+        remove_derived()
+
+        def open_storage():
+            return SQLiteStorage()
+
+        def close(storage):
+            storage.db.close()
+    else:
+        from resources.lib.storage import JSONStorage
+        open_storage = JSONStorage
+
+        def close(storage):
+            pass
+
+    result = {}
+    if spec['variant'] == 'json':
+        result['open_cold_ms'] = best(lambda: close(open_storage()), runs, remove_derived)
+    result['open_ms'] = best(lambda: close(open_storage()), runs)
+    storage = open_storage()
+    result['list_ms'] = best(lambda: storage.get_folder_contents(hot), runs)
+    names = iter(range(10 ** 6))
+    result['rename_ms'] = best(lambda: storage.rename_item(spec['item'], f'Renombrado {next(names)}'), runs)
+    close(storage)
+    result['peak_mb'] = peak_mb(lambda: open_storage().get_folder_contents(hot))
+    return result
+
+
+def child_cold_load(spec):
+    from resources.lib import storage as storage_module
+    cache = getattr(storage_module, 'CACHE_PATH', 'favorites.cache')
+
+    def read():
+        with open('favorites.json', 'rb') as f:
+            json.loads(f.read())
+
+    def drop_cache():
+        if os.path.exists(cache):
+            os.remove(cache)
+
+    storage_module.JSONStorage()  # Side files other than the cache are kept between runs
+    result = {'json_loads_ms': best(read, spec['runs']),
+              'open_without_cache_ms': best(storage_module.JSONStorage, spec['runs'], drop_cache)}
+    storage_module.JSONStorage()
+    if os.path.exists(cache):
+        result['open_with_cache_ms'] = best(storage_module.JSONStorage, spec['runs'])
+        result['cache_bytes'] = os.path.getsize(cache)
+    return result
+
+
+def plugin_call(spec, folder_id, settings=None):
+    """
+    A function running the plugin's folder mode on folder_id through
+    default.main(), with the library opened beforehand and the addon
+    settings given, and the Kodi directory calls it makes:
+    {'calls': ..., 'entries': ...}. The Kodi calls themselves do nothing,
+    so only the addon's own work is timed.
+    """
+    settings = settings or {}
+    sys.modules['xbmcaddon'].Addon.getSetting = lambda self, setting_id: settings.get(setting_id, '')
+    sys.argv = ['plugin://plugin.video.mis.favoritos/', '1',
+                '?' + urllib.parse.urlencode({'mode': 'folder', 'folder_id': folder_id})]
+    import default
+    from resources.lib import common
+    from resources.lib.storage import open_storage
+    common._storage = open_storage()
+
+    counts = {'calls': 0, 'entries': 0}
+
+    def add_directory_item(handle, url, listitem, isFolder=False, totalItems=0):
+        counts['calls'] += 1
+        counts['entries'] += 1
+        return True
+
+    def add_directory_items(handle, items, totalItems=0):
+        counts['calls'] += 1
+        counts['entries'] += len(items)
+        return True
+
+    xbmcplugin = sys.modules['xbmcplugin']
+    xbmcplugin.addDirectoryItem = add_directory_item
+    xbmcplugin.addDirectoryItems = add_directory_items
+    return default.main, counts
+
+
+def child_render(spec):
+    render, counts = plugin_call(spec, spec['hot'])
+    render()
+    counts.update(calls=0, entries=0)
+    render()
+    result = dict(counts)
+    result['render_ms'] = best(render, spec['runs'])
+    return result
+
+
+def child_navigation(spec):
+    # As older commits saved it: no stored order, children as they were added
+    with open('favorites.json', 'rb') as f:
+        tree = json.loads(f.read())
+    stack = [tree]
+    while stack:
+        folder = stack.pop()
+        folder.pop('order', None)
+        folder['children'].sort(key=lambda node: node['id'])
+        stack.extend(node for node in folder['children'] if node['type'] == 'folder')
+    with open('favorites.json', 'w', encoding='utf-8') as f:
+        json.dump(tree, f, ensure_ascii=False)
+
+    navigate, _ = plugin_call(spec, spec['hot'], {'page_size': '100'})
+    from resources.lib import common
+    result = {'first_list_ms': best(navigate, 1), 'list_ms': best(navigate, spec['runs'])}
+    get_folder_page = require(common.get_storage(), 'get_folder_page')
+    result['page_ms'] = best(lambda: get_folder_page(spec['hot'], 0, 100), spec['runs'])
+    return result
+
+
+def child_search(spec):
+    from resources.lib.storage import JSONStorage
+    query = spec['query']
+    if spec['variant'] == 'scan':
+        def fold(text):
+            return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c)).casefold()
+
+        def scan():
+            words = fold(query).split()
+            hits, stack = [], [storage.data]
+            while stack:
+                node = stack.pop()
+                stack.extend(node.get('children', ()))
+                names = fold(node['name']).split()
+                if all(any(name.startswith(word) for name in names) for word in words):
+                    hits.append(node['id'])
+            return hits
+
+        storage = JSONStorage()
+        return {'query_ms': best(scan, spec['runs']), 'hits': len(scan())}
+
+    from resources.lib import storage as storage_module
+    index_path = require(storage_module, 'SEARCH_PATH')
+    opened = {}
+
+    def reopen(drop_index=False):
+        for path in (index_path, storage_module.SEARCH_LOG_PATH) if drop_index else ():
+            if os.path.exists(path):
+                os.remove(path)
+        opened['storage'] = JSONStorage()
+
+    def search():
+        return opened['storage'].search(query)
+
+    result = {'build_ms': best(search, spec['runs'], lambda: reopen(drop_index=True)),
+              'index_bytes': os.path.getsize(index_path),
+              'cold_query_ms': best(search, spec['runs'], reopen),
+              'warm_query_ms': best(search, spec['runs']),
+              'hits': len(opened['storage'].search(query, limit=10 ** 9))}
+    return result
+
+
+def child_picker(spec):
+    from resources.lib import storage as storage_module
+    runs = spec['runs']
+    storage = storage_module.JSONStorage()
+    result = {'open_ms': best(storage_module.JSONStorage, runs),
+              'flat_ms': best(storage.get_all_folders_flat, runs),
+              'folders': len(storage.get_all_folders_flat())}
+    # Older checkouts only have the tree walk
+    if hasattr(storage, 'get_folder_outline'):
+        result['outline_ms'] = best(storage.get_folder_outline, runs)
+        result['read_outline_ms'] = best(storage_module.read_folder_outline, runs)
+    return result
+
+
+def child_bulk(spec):
+    from resources.lib.storage import open_storage
+    if spec['variant'] == 'sqlite':
+        sys.modules['xbmcaddon'].Addon.getSetting = lambda self, setting_id: '1' if setting_id == 'backend' else ''
+    storage = open_storage()
+    ids, targets = spec['ids'], [spec['target'], spec['hot']]
+
+    def one_by_one():
+        for node_id in ids[:100]:
+            storage.move_item(node_id, targets[0])
+
+    def move_nodes():
+        targets.reverse()
+        storage.move_nodes(ids, targets[0])
+
+    result = {'one_by_one_100_ms': best(one_by_one, 1)}
+    # Older checkouts only have the one by one moves
+    if hasattr(storage, 'move_nodes'):
+        result['move_ms'] = best(move_nodes, spec['runs'])
+        names = iter(range(10 ** 6))
+        result['rename_ms'] = best(lambda: storage.rename_nodes(ids, f'{next(names)} {{n}} - {{name}}'), spec['runs'])
+    return result
+
+
+CHILDREN = {
+    'crossover': child_crossover,
+    'cold_load': child_cold_load,
+    'render': child_render,
+    'navigation': child_navigation,
+    'search': child_search,
+    'picker': child_picker,
+    'bulk': child_bulk,
+}
+
+
+def run_child(spec):
+    """
+    Run one scenario variant in spec['data'] against the addon in
+    spec['root'], under this checkout's Kodi mocks (older ones lack calls
+    the addon made at the time); prints the result as JSON.
+    """
+    sys.path[:0] = [ROOT, os.path.join(spec['root'], 'plugin.video.mis.favoritos')]
+    os.chdir(spec['data'])
+    out = sys.stdout
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import mock_kodi  # noqa: F401
+        try:
+            result = CHILDREN[spec['scenario']](spec)
+        except (ImportError, Unsupported) as e:
+            result = {'unsupported': f"{type(e).__name__}: {e}"}
+    out.write(json.dumps(result) + '\n')
+
+
+# --- Parent process ------------------------------------------------------
+
+class Bench:
+    def __init__(self, options):
+        self.options = options
+        self.workdir = tempfile.mkdtemp(prefix='misfav-storage-bench-')
+        self.libraries = {}
+        self.runs = 0
+
+    def library(self, items, fanout=6, depth=2, hot=0.1):
+        """Path of a generated favorites.json and its info, generated once per shape."""
+        key = (items, fanout, depth, hot)
+        if key not in self.libraries:
+            path = os.path.join(self.workdir, f'library-{len(self.libraries)}', 'favorites.json')
+            os.makedirs(os.path.dirname(path))
+            with contextlib.redirect_stdout(sys.stderr):
+                tree, info = generate_library(items, fanout, depth, self.options.seed, hot=hot)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(tree, f, ensure_ascii=False)
+            info['library_bytes'] = os.path.getsize(path)
+            self.libraries[key] = (path, info)
+        return self.libraries[key]
+
+    def child(self, scenario, library, variant=None, **params):
+        """Run a scenario variant on a fresh copy of library in a new interpreter; returns its result."""
+        path, info = library
+        self.runs += 1
+        data = os.path.join(self.workdir, f'run-{self.runs}')
+        os.makedirs(data)
+        shutil.copyfile(path, os.path.join(data, 'favorites.json'))
+        spec = {'scenario': scenario, 'variant': variant, 'root': os.path.abspath(self.options.root), 'data': data,
+                'runs': self.options.runs, 'hot': info['hot'], 'item': info['hot_items'][0], 'word': info['word'],
+                **params}
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        shutil.rmtree(data)
+        if process.returncode != 0:
+            raise RuntimeError(f"{scenario} {variant} failed:\n{process.stderr}")
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def scenario_crossover(bench, sizes):
+    rows = {}
+    crossover = None
+    for items in sizes or (100, 1000, 5000, 20000, 100000):
+        library = bench.library(items)
+        row = {'library_bytes': library[1]['library_bytes'],
+               'json': bench.child('crossover', library, 'json'),
+               'sqlite': bench.child('crossover', library, 'sqlite')}
+        rows[items] = row
+        if 'unsupported' in row['sqlite']:
+            continue
+        # The smallest size from which SQLite stays ahead at every larger size
+        if row['sqlite']['open_ms'] + row['sqlite']['list_ms'] < row['json']['open_ms'] + row['json']['list_ms']:
+            crossover = crossover or items
+        else:
+            crossover = None
+    return {'sizes': rows, 'sqlite_faster_from_items': crossover}
+
+
+def scenario_cold_load(bench, sizes):
+    rows = {}
+    for items in sizes or (1000, 10000, 100000):
+        library = bench.library(items)
+        rows[items] = {'library_bytes': library[1]['library_bytes'], **bench.child('cold_load', library)}
+    return {'sizes': rows}
+
+
+def scenario_render(bench, sizes):
+    rows = {}
+    # 10% of the library lands in one folder: about 5,000 entries at 50k items
+    for items in sizes or (50000,):
+        library = bench.library(items, hot=0.1)
+        rows[items] = {'folder_items': len(library[1]['hot_items']), **bench.child('render', library)}
+    return {'sizes': rows}
+
+
+def scenario_navigation(bench, sizes):
+    rows = {}
+    for items in sizes or (1000, 10000, 100000):
+        rows[items] = bench.child('navigation', bench.library(items, fanout=1, depth=1, hot=1.0))
+    return {'sizes': rows}
+
+
+def scenario_search(bench, sizes):
+    rows = {}
+    # Two words of the generator's vocabulary, one cut short, accents left out
+    query = 'pelicula avi'
+    for items in sizes or (100000,):
+        library = bench.library(items, fanout=7, depth=2)
+        rows[items] = {'index': bench.child('search', library, 'index', query=query),
+                       'scan': bench.child('search', library, 'scan', query=query)}
+    return {'query': query, 'sizes': rows}
+
+
+def scenario_picker(bench, sizes):
+    rows = {}
+    # 12 + 144 + 1,728 folders
+    for items in sizes or (100000,):
+        rows[items] = bench.child('picker', bench.library(items, fanout=12, depth=3))
+    return {'sizes': rows}
+
+
+def scenario_bulk(bench, sizes):
+    rows = {}
+    for items in sizes or (10000,):
+        library = bench.library(items, hot=0.1)
+        params = {'ids': library[1]['hot_items'][:1000], 'target': library[1]['leaves'][0]}
+        rows[items] = {'moved': len(params['ids']),
+                       'json': bench.child('bulk', library, 'json', **params),
+                       'sqlite': bench.child('bulk', library, 'sqlite', **params)}
+    return {'sizes': rows}
+
+
+SCENARIOS = {
+    'crossover': scenario_crossover,
+    'cold_load': scenario_cold_load,
+    'render': scenario_render,
+    'navigation': scenario_navigation,
+    'search': scenario_search,
+    'picker': scenario_picker,
+    'bulk': scenario_bulk,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append', help='scenarios to run (default: all)')
+    parser.add_argument('--sizes', type=int, nargs='+', help='library sizes in items (default: per scenario)')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per measurement')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--root', default=ROOT, help='checkout whose addon is measured')
+    parser.add_argument('--output', help='write the results here instead of stdout')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        run_child(json.loads(options.child))
+        return 0
+
+    bench = Bench(options)
+    report = {
+        'commit': git_commit(),
+        'root': os.path.abspath(options.root),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': options.seed,
+        'runs': options.runs,
+        'results': {},
+    }
+    for name in options.scenario or list(SCENARIOS):
+        print(f"{name}...", file=sys.stderr)
+        report['results'][name] = SCENARIOS[name](bench, options.sizes)
+    shutil.rmtree(bench.workdir)
+
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,77 +1,191 @@
-import os
-import shutil
+import argparse
+import fnmatch
 import hashlib
-import zipfile
+import json
+import os
 import re
+import struct
+import time
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # Configuration
-PLUGIN_ID = "plugin.video.mis.favoritos"
 REPO_DIR = "repository"
 TOOLS_DIR = "tools"
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def get_addon_version(addon_xml_path):
-    with open(addon_xml_path, 'r') as f:
-        content = f.read()
-        # Look for the version attribute specifically in the addon tag
-        # We search specifically for <addon ... version="..." because other tags like <import> also have version attributes
-        match = re.search(r'<addon[^>]+version="([^"]+)"', content)
-        if match:
-            return match.group(1)
-    return None
+# Left out of addon zips; matched against every path component
+EXCLUDE_PATTERNS = ['__pycache__', '*.pyc', '*.pyo', '.*', '*~', '*.swp', '*.orig', '*.rej', 'Thumbs.db']
+
+# Zips kept per addon: the current version and the ones before it
+KEEP_VERSIONS = 3
+
+# Build cache in the repository root: addon id -> content hash of its last build
+CACHE_FILE = ".build_cache.json"
+# Bump whenever the zip layout changes, so every addon is rebuilt once
+BUILD_FORMAT = 1
+
+# Zip entries all get the same timestamp (the earliest DOS date) and mode
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_FILE_MODE = 0o100644
+COMPRESS_LEVEL = zlib.Z_DEFAULT_COMPRESSION
+# Files at least this big are deflated in worker threads (zlib releases the GIL)
+PARALLEL_MIN_BYTES = 64 * 1024
+# Limits of the plain (non-ZIP64) zip format write_zip produces
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_MAX_BYTES = 0xFFFFFFFF
+
+def read_addon_xml(addon_xml_path):
+    """The <addon> element of an addon.xml; ValueError if it lacks an id or version."""
+    addon = ET.parse(addon_xml_path).getroot()
+    if addon.tag != 'addon' or not addon.get('id') or not addon.get('version'):
+        raise ValueError(f"{addon_xml_path} has no <addon id=... version=...>")
+    return addon
+
+def version_key(version):
+    """Sort key for versions like 1.10.2 or 2.0.0~beta1: numbers compare as numbers, ~ marks a pre-release."""
+    def parts(text):
+        return [(int(part), '') if part.isdigit() else (-1, part) for part in re.findall(r'\d+|[a-z]+', text.lower())]
+    release, _, pre = version.partition('~')
+    return parts(release), not pre, parts(pre)
+
+def excluded(name):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in EXCLUDE_PATTERNS)
+
+def list_addon_files(plugin_path):
+    """Relative paths of the files that go into the zip, sorted, with '/' separators."""
+    files = []
+    for root, dirs, names in os.walk(plugin_path):
+        dirs[:] = sorted(d for d in dirs if not excluded(d))
+        rel_root = os.path.relpath(root, plugin_path)
+        for name in sorted(names):
+            if not excluded(name):
+                files.append(name if rel_root == '.' else f"{rel_root}/{name}".replace(os.sep, '/'))
+    return sorted(files)
+
+def content_hash(plugin_path, files):
+    """Hash of the build format and every included file's path and contents."""
+    digest = hashlib.sha256(f"format {BUILD_FORMAT}\n".encode())
+    for rel_path in files:
+        with open(os.path.join(plugin_path, rel_path), 'rb') as f:
+            data = f.read()
+        digest.update(f"{rel_path}\0{len(data)}\0".encode('utf-8'))
+        digest.update(data)
+    return digest.hexdigest()
+
+def deflate(data):
+    """(method, payload): raw deflate, or stored if that is no smaller."""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    packed = compressor.compress(data) + compressor.flush()
+    return (8, packed) if len(packed) < len(data) else (0, data)
 
-def create_zip(plugin_path, version, destination_dir):
-    zip_name = f"{PLUGIN_ID}-{version}.zip"
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+def write_zip(zip_path, entries):
+    """
+    Write a zip of (name, data, method, payload) entries in the given
+    order. Every entry carries the same timestamp and mode and no extra
+    fields, so the same files always give a byte-identical zip.
+    ValueError, before anything is written, if the zip would need ZIP64:
+    more than ZIP_MAX_ENTRIES entries, or a file, offset or directory
+    past ZIP_MAX_BYTES.
+    """
+    if len(entries) > ZIP_MAX_ENTRIES:
+        raise ValueError(f"{zip_path}: {len(entries)} files, a zip without ZIP64 holds at most {ZIP_MAX_ENTRIES}")
+    end = 0
+    for name, data, _, payload in entries:
+        if max(len(data), len(payload), end) >= ZIP_MAX_BYTES:
+            raise ValueError(f"{zip_path}: {name} is past the {ZIP_MAX_BYTES} byte limit of a zip without ZIP64")
+        end += 30 + len(name.encode('utf-8')) + len(payload)
+    directory_size = sum(46 + len(name.encode('utf-8')) for name, _, _, _ in entries)
+    if end + directory_size >= ZIP_MAX_BYTES:
+        raise ValueError(f"{zip_path}: {end + directory_size} bytes, past the {ZIP_MAX_BYTES} byte limit of a zip without ZIP64")
+    date, time_ = _dos_date_time(ZIP_DATE_TIME)
+    central = []
+    offset = 0
+    tmp_path = zip_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for name, data, method, payload in entries:
+            raw_name = name.encode('utf-8')
+            fields = (20, 0x0800, method, time_, date, zlib.crc32(data), len(payload), len(data), len(raw_name))
+            f.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, *fields, 0) + raw_name)
+            f.write(payload)
+            central.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 3 << 8 | 20, *fields, 0, 0, 0, 0,
+                                       ZIP_FILE_MODE << 16, offset) + raw_name)
+            offset += 30 + len(raw_name) + len(payload)
+        directory = b''.join(central)
+        f.write(directory)
+        f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(entries), len(entries), len(directory), offset, 0))
+    os.replace(tmp_path, zip_path)
+
+def create_zip(plugin_path, version, destination_dir, files=None, jobs=None):
+    addon_id = os.path.basename(plugin_path)
+    zip_name = f"{addon_id}-{version}.zip"
     zip_path = os.path.join(destination_dir, zip_name)
-    
+
     print(f"Creating zip: {zip_path}")
-    
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(plugin_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                # Calculate relative path from the plugin root, but prepend the plugin ID folder
-                rel_path = os.path.relpath(file_path, os.path.dirname(plugin_path))
-                zipf.write(file_path, rel_path)
+
+    if files is None:
+        files = list_addon_files(plugin_path)
+    contents = []
+    for rel_path in files:
+        with open(os.path.join(plugin_path, rel_path), 'rb') as f:
+            contents.append(f.read())
+    large = [index for index, data in enumerate(contents) if len(data) >= PARALLEL_MIN_BYTES]
+    packed = {}
+    if large:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            packed = dict(zip(large, pool.map(deflate, [contents[index] for index in large])))
+    entries = []
+    for index, (rel_path, data) in enumerate(zip(files, contents)):
+        method, payload = packed[index] if index in packed else deflate(data)
+        # Paths inside the zip are prefixed with the addon id folder
+        entries.append((f"{addon_id}/{rel_path}", data, method, payload))
+    write_zip(zip_path, entries)
     return zip_name
 
-def generate_addons_xml(repo_path):
+def write_if_changed(path, text):
+    """Write text to path unless it already holds it. Returns True if written."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return True
+
+def generate_addons_xml(repo_path, addons):
+    """addons.xml listing the given <addon> elements, merged with ElementTree. Returns (path, changed)."""
     print("Generating addons.xml...")
-    addons_xml_content = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<addons>\n'
-    
-    # Find all addon.xml files in the repo structure (we simply copy the one from source for now)
-    # But better: read the source addon.xml
-    source_addon_xml = os.path.join(PROJECT_ROOT, PLUGIN_ID, "addon.xml")
-    
-    if os.path.exists(source_addon_xml):
-        with open(source_addon_xml, 'r') as f:
-            xml_lines = f.readlines()
-            # Skip definition lines if we were merging multiple, but here we just embed it
-            # Strip standard xml header to avoid duplication if we were looping
-            for line in xml_lines:
-                if line.strip().startswith('<?xml'): continue
-                addons_xml_content += line
-    
-    addons_xml_content += '</addons>\n'
-    
+    root = ET.Element('addons')
+    root.text = '\n'
+    for addon in sorted(addons, key=lambda element: element.get('id')):
+        addon.tail = '\n'
+        root.append(addon)
+    addons_xml_content = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + \
+        ET.tostring(root, encoding='unicode') + '\n'
+
     xml_path = os.path.join(repo_path, "addons.xml")
-    with open(xml_path, 'w') as f:
-        f.write(addons_xml_content)
-        
-    return xml_path
+    changed = write_if_changed(xml_path, addons_xml_content)
+
+    return xml_path, changed
 
 def generate_md5(file_path):
     print(f"Generating MD5 for {file_path}")
     with open(file_path, 'rb') as f:
         md5 = hashlib.md5(f.read()).hexdigest()
-    
-    with open(file_path + ".md5", 'w') as f:
-        f.write(md5)
+
+    return write_if_changed(file_path + ".md5", md5)
 
 def generate_index_html(directory, title="Kodi Repository"):
     print(f"Generating index.html for {directory}")
     items = sorted(os.listdir(directory))
-    
+
     html = f"""<!DOCTYPE html>
 <html>
 <head>
@@ -99,43 +213,201 @@ def generate_index_html(directory, title="Kodi Repository"):
 </body>
 </html>
 """
-    with open(os.path.join(directory, "index.html"), 'w') as f:
-        f.write(html)
+    return write_if_changed(os.path.join(directory, "index.html"), html)
+
+def load_cache(repo_path):
+    try:
+        with open(os.path.join(repo_path, CACHE_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(repo_path, cache):
+    write_if_changed(os.path.join(repo_path, CACHE_FILE), json.dumps(cache, indent=2, sort_keys=True) + '\n')
+
+def discover_addons(source_root):
+    """Source folders holding an addon.xml, sorted; the repository output itself is left out."""
+    addons = []
+    for name in sorted(os.listdir(source_root)):
+        path = os.path.join(source_root, name)
+        if name != REPO_DIR and not excluded(name) and os.path.isfile(os.path.join(path, "addon.xml")):
+            addons.append(path)
+    return addons
+
+def scan_addon(plugin_src):
+    """(plugin_src, <addon> element, included files, content hash) of one addon source."""
+    files = list_addon_files(plugin_src)
+    return plugin_src, read_addon_xml(os.path.join(plugin_src, "addon.xml")), files, content_hash(plugin_src, files)
+
+def package_addon(plugin_src, version, files, repo_path, threads=None):
+    """
+    Copy the addon.xml and write the zip of one addon into
+    repo_path/<addon id>/. Runs in a worker process; returns the seconds
+    it took.
+    """
+    started = time.perf_counter()
+    plugin_dest_dir = os.path.join(repo_path, os.path.basename(plugin_src))
+    os.makedirs(plugin_dest_dir, exist_ok=True)
+    with open(os.path.join(plugin_src, "addon.xml"), 'r', encoding='utf-8') as f:
+        write_if_changed(os.path.join(plugin_dest_dir, "addon.xml"), f.read())
+    create_zip(plugin_src, version, plugin_dest_dir, files, threads)
+    return time.perf_counter() - started
+
+def prune_versions(plugin_dest_dir, addon_id, current_zip, keep=KEEP_VERSIONS):
+    """
+    Remove all but the current zip and the keep - 1 newest other
+    <addon_id>-<version>.zip packages, with their .md5 files. Nothing
+    else in the directory is touched: icons, fanart, changelogs or
+    whatever a maintainer put there stay. Returns the names removed.
+    """
+    package = re.compile(re.escape(addon_id) + r'-(\d[\w.+~-]*)\.zip(?:\.md5)?')
+    packages = {name: package.fullmatch(name) for name in os.listdir(plugin_dest_dir)}
+    packages = {name: match.group(1) for name, match in packages.items() if match}
+    zips = sorted((name for name in packages if name.endswith('.zip') and name != current_zip),
+                  key=lambda name: version_key(packages[name]), reverse=True)
+    kept = {current_zip} | set(zips[:max(keep - 1, 0)])
+    removed = sorted(name for name in packages if name not in kept and name[:-len('.md5')] not in kept)
+    for name in removed:
+        os.remove(os.path.join(plugin_dest_dir, name))
+    return removed
+
+def rebuild_reason(entry, digest, zip_name, plugin_dest_dir, force=False):
+    """Why an addon needs packaging, given its cache entry; None if its last build still stands."""
+    if force:
+        return "forced rebuild"
+    if not entry:
+        return "first build"
+    if entry.get('zip') != zip_name:
+        return "new version"
+    if entry.get('hash') != digest:
+        return "content changed"
+    if not os.path.exists(os.path.join(plugin_dest_dir, zip_name)):
+        return "zip missing"
+    return None
+
+class BuildSummary:
+    """What each step did and how long it took, printed at the end."""
+
+    def __init__(self):
+        self.rows = []
+        self.started = time.perf_counter()
+
+    def step(self, name, outcome, started):
+        self.add(name, outcome, time.perf_counter() - started)
+
+    def add(self, name, outcome, seconds):
+        self.rows.append((name, outcome, seconds))
+
+    def print(self):
+        print("\nBuild summary:")
+        width = max(len(name) for name, _, _ in self.rows)
+        outcome_width = max(len(outcome) for _, outcome, _ in self.rows)
+        for name, outcome, seconds in self.rows:
+            print(f"  {name:<{width}}  {outcome:<{outcome_width}} {seconds * 1000:8.1f} ms")
+        print(f"  {'total':<{width}}  {'':<{outcome_width}} {(time.perf_counter() - self.started) * 1000:8.1f} ms")
+
+def build_repository(source_root, repo_path, force=False, jobs=None, keep=KEEP_VERSIONS):
+    """
+    Build repo_path from every addon under source_root: zip the addons
+    whose content hash differs from their last build (in a process pool
+    when there are several), prune old versions, then rewrite addons.xml
+    and the index pages of the folders that changed. Returns the summary
+    and the ids of the addons rebuilt.
+    """
+    summary = BuildSummary()
+    os.makedirs(repo_path, exist_ok=True)
+    cache = load_cache(repo_path)
+
+    # 1. Find and hash every addon (hashing releases the GIL, so threads overlap the reads)
+    started = time.perf_counter()
+    plugin_srcs = discover_addons(source_root)
+    summary.step("discover", f"{len(plugin_srcs)} addons", started)
+    started = time.perf_counter()
+    scans = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for plugin_src, future in [(src, pool.submit(scan_addon, src)) for src in plugin_srcs]:
+            try:
+                scans.append(future.result())
+            except (OSError, ET.ParseError, ValueError) as e:
+                print(f"Error: Skipping {plugin_src}: {e}")
+    summary.step("hash", f"{sum(len(files) for _, _, files, _ in scans)} files", started)
+
+    # 2. Package the addons that changed since the last build
+    todo = []
+    addons = {}
+    for plugin_src, addon, files, digest in scans:
+        addon_id, version = addon.get('id'), addon.get('version')
+        if addon_id != os.path.basename(plugin_src):
+            print(f"Error: Skipping {plugin_src}: its addon.xml says id=\"{addon_id}\", Kodi needs them to match")
+            continue
+        addons[addon_id] = addon
+        zip_name = f"{addon_id}-{version}.zip"
+        reason = rebuild_reason(cache.get(addon_id), digest, zip_name, os.path.join(repo_path, addon_id), force)
+        if reason:
+            todo.append((plugin_src, version, files, reason))
+            cache[addon_id] = {'hash': digest, 'zip': zip_name}
+
+    started = time.perf_counter()
+    created = [addon_id for addon_id in addons if not os.path.isdir(os.path.join(repo_path, addon_id))]
+    workers = min(jobs or os.cpu_count() or 1, len(todo))
+    if workers > 1:
+        # Each process also deflates its large files in threads; share the CPUs between them
+        threads = max((os.cpu_count() or 1) // workers, 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            seconds = list(pool.map(package_addon, *zip(*[(src, version, files, repo_path, threads)
+                                                          for src, version, files, _ in todo])))
+    else:
+        seconds = [package_addon(src, version, files, repo_path) for src, version, files, _ in todo]
+    summary.step("package", f"{len(todo)} rebuilt, {len(addons) - len(todo)} unchanged"
+                 + (f", {workers} processes" if workers > 1 else ""), started)
+    for (plugin_src, version, _, reason), elapsed in zip(todo, seconds):
+        summary.add(f"  {os.path.basename(plugin_src)} {version}", reason, elapsed)
+
+    # 3. Keep the newest versions of each addon
+    started = time.perf_counter()
+    changed_dirs = {os.path.basename(src) for src, _, _, _ in todo}
+    pruned = 0
+    for addon_id, addon in addons.items():
+        removed = prune_versions(os.path.join(repo_path, addon_id), addon_id,
+                                 f"{addon_id}-{addon.get('version')}.zip", keep)
+        if removed:
+            pruned += len(removed)
+            changed_dirs.add(addon_id)
+    summary.step("prune", f"{pruned} old files removed, keeping {keep}", started)
 
-def main():
-    repo_path = os.path.join(PROJECT_ROOT, REPO_DIR)
-    plugin_src = os.path.join(PROJECT_ROOT, PLUGIN_ID)
-    addon_xml = os.path.join(plugin_src, "addon.xml")
-    
-    if not os.path.exists(addon_xml):
-        print(f"Error: Could not find {addon_xml}")
-        return
-
-    version = get_addon_version(addon_xml)
-    print(f"Detected version: {version}")
-    
-    # 1. Prepare structure
-    plugin_dest_dir = os.path.join(repo_path, PLUGIN_ID)
-    if os.path.exists(plugin_dest_dir):
-        shutil.rmtree(plugin_dest_dir)
-    os.makedirs(plugin_dest_dir)
-    
-    # 2. Copy addon.xml to plugin folder in repo
-    shutil.copy(addon_xml, os.path.join(plugin_dest_dir, "addon.xml"))
-    
-    # 3. Create Zip
-    create_zip(plugin_src, version, plugin_dest_dir)
-    
     # 4. Generate Root addons.xml and md5
-    xml_path = generate_addons_xml(repo_path)
-    generate_md5(xml_path)
-    
-    # 5. Generate index.html files (for root and plugin dir)
-    generate_index_html(repo_path, "Kodi Repository Root")
-    generate_index_html(plugin_dest_dir, f"Index of {PLUGIN_ID}")
-    
-    print("\nRepository build complete!")
-    print(f"Repository location: {repo_path}")
+    started = time.perf_counter()
+    xml_path, changed = generate_addons_xml(repo_path, list(addons.values()))
+    changed = generate_md5(xml_path) or changed
+    summary.step("addons.xml + md5", "updated" if changed else "unchanged", started)
+
+    # 5. Generate index.html files, only for the folders whose listing changed
+    started = time.perf_counter()
+    pages = [(os.path.join(repo_path, addon_id), f"Index of {addon_id}") for addon_id in sorted(addons)
+             if addon_id in changed_dirs or not os.path.exists(os.path.join(repo_path, addon_id, "index.html"))]
+    if created or not os.path.exists(os.path.join(repo_path, "index.html")):
+        pages.append((repo_path, "Kodi Repository Root"))
+    written = sum(generate_index_html(directory, title) for directory, title in pages)
+    summary.step("index.html", f"{written} of {len(pages)} pages updated", started)
+
+    # Addons no longer in the source drop out of the cache (their folders stay published)
+    save_cache(repo_path, {addon_id: entry for addon_id, entry in cache.items() if addon_id in addons})
+    return summary, [os.path.basename(src) for src, _, _, _ in todo]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Kodi repository: addon zips, addons.xml and indexes.")
+    parser.add_argument('--force', action='store_true', help="rebuild every addon, ignoring the build cache")
+    parser.add_argument('--jobs', type=int, default=None, help="processes packaging addons (default: CPUs)")
+    parser.add_argument('--keep', type=int, default=KEEP_VERSIONS, help="zips kept per addon, newest first")
+    parser.add_argument('--source-dir', default=PROJECT_ROOT, help="folder holding the addon sources")
+    parser.add_argument('--repo-dir', default=os.path.join(PROJECT_ROOT, REPO_DIR), help="where to build the repository")
+    options = parser.parse_args()
+
+    summary, rebuilt = build_repository(options.source_dir, options.repo_dir, options.force, options.jobs, options.keep)
+    summary.print()
+
+    print("\nRepository build complete!" if rebuilt else "\nRepository up to date.")
+    print(f"Repository location: {options.repo_dir}")
 
 if __name__ == "__main__":
     main()